@@ -0,0 +1,155 @@
+import os
+import json
+import threading
+
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageFont
+
+ASSETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
+
+# Templates and fonts the image renderers use
+TEMPLATES = ('whois', 'AMP', 'http', 'https')
+FONTS = (
+    ('Lato-Regular', 10),
+    ('Lato-Regular', 20),
+    ('Vazirmatn-Regular', 10),
+    ('Vazirmatn-Regular', 14),
+    ('Roboto-Medium', 21),
+)
+
+# The flags of the WHOIS card, at the size they are pasted at, in one image (built by `flag_atlas.py`)
+FLAG_ATLAS = 'flags.png'
+# {"flags": {"IR": [x, y, width, height], ...}}
+FLAG_INDEX = 'flags.json'
+
+_images: Dict[Tuple[str, str], Image.Image] = {}
+_fonts: Dict[Tuple[str, int], ImageFont.FreeTypeFont] = {}
+_flags: Dict[str, Image.Image] = {}
+_flag_index: Optional[Dict[str, Tuple[int, int, int, int]]] = None
+_flag_atlas: Optional[Image.Image] = None
+_lock = threading.Lock()
+
+
+def asset_path(*parts: str) -> str:
+    """
+    Resolves a path inside the assets directory of the package (regardless of the CWD).
+
+    :param parts: Path parts relative to the assets directory
+    :return: The absolute path
+    """
+    return os.path.join(ASSETS_PATH, *parts)
+
+
+def get_image(name: str, mode: str = None) -> Image.Image:
+    """
+    Gets a copy of a template image from `assets/images`.
+    The file is decoded only once; every call returns a new copy that can be drawn on.
+
+    :param name: Name of the image without the extension (e.g. `whois`)
+    :param mode: Mode to convert the image to (e.g. `RGBA`)
+    :return: A copy of the image
+    """
+    key = (name, mode)
+    image = _images.get(key)
+    if image is None:
+        with _lock:
+            image = _images.get(key)
+            if image is None:
+                with Image.open(asset_path('images', f'{name}.jpg')) as file:
+                    image = file.convert(mode) if mode else file.copy()
+                _images[key] = image
+
+    return image.copy()
+
+
+def get_font(name: str, size: int) -> ImageFont.FreeTypeFont:
+    """
+    Gets a font from `assets/fonts`.
+    Every font and size pair is parsed only once and shared by all the renders.
+
+    :param name: Name of the font without the extension (e.g. `Lato-Regular`)
+    :param size: Size of the font
+    :return: The font
+    """
+    key = (name, size)
+    font = _fonts.get(key)
+    if font is None:
+        with _lock:
+            font = _fonts.get(key)
+            if font is None:
+                font = ImageFont.truetype(asset_path('fonts', f'{name}.ttf'), size)
+                _fonts[key] = font
+
+    return font
+
+
+def _load_flag_atlas():
+    global _flag_index, _flag_atlas
+    try:
+        with open(asset_path('images', FLAG_INDEX), 'r', encoding='utf-8') as file:
+            index = {code.upper(): tuple(box) for code, box in json.load(file)['flags'].items()}
+        with Image.open(asset_path('images', FLAG_ATLAS)) as file:
+            _flag_atlas = file.convert('RGBA')
+    except (OSError, ValueError, KeyError):
+        # No atlas; the flags are downloaded
+        index = {}
+    _flag_index = index
+
+
+def has_flag(country_code: Optional[str]) -> bool:
+    """
+    Checks if the flag atlas has the flag of a country.
+
+    :param country_code: ISO code of the country
+    :return: True if `get_flag` can give its flag
+    """
+    if _flag_index is None:
+        with _lock:
+            if _flag_index is None:
+                _load_flag_atlas()
+    return bool(country_code) and country_code.upper() in _flag_index
+
+
+def get_flag(country_code: Optional[str]) -> Optional[Image.Image]:
+    """
+    Gets the flag of a country from the flag atlas, at the size the WHOIS card shows it.
+    The atlas is decoded only once and every flag is cut out of it once; the flags are only pasted, so they're shared.
+
+    :param country_code: ISO code of the country
+    :return: The RGBA flag or None if the atlas doesn't have it
+    """
+    if not has_flag(country_code):
+        return None
+    country_code = country_code.upper()
+    flag = _flags.get(country_code)
+    if flag is None:
+        x, y, width, height = _flag_index[country_code]
+        flag = _flag_atlas.crop((x, y, x + width, y + height))
+        _flags[country_code] = flag
+
+    return flag
+
+
+def preload():
+    """
+    Loads all the templates, fonts and the flag atlas.
+    Call it before forking the worker processes so they share the decoded assets.
+    """
+    for name in TEMPLATES:
+        get_image(name)
+    get_image('http', 'RGBA')
+    get_image('https', 'RGBA')
+    for name, size in FONTS:
+        get_font(name, size)
+    has_flag(None)
+
+
+def _reset_lock():
+    global _lock
+    _lock = threading.Lock()
+
+
+# A forked child must not inherit a lock held by another thread of the parent
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_lock)
@@ -0,0 +1,245 @@
+import os
+import sys
+import json
+import time
+import urllib.parse
+import multiprocessing
+
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO, Tuple, Union
+from contextlib import nullcontext
+from multiprocessing import util
+
+import log21
+
+from main import Analyzer, is_valid_url, needs_browser, STAGES, HEDGE_AFTER
+from driver_pool import DriverPool
+import asset_registry
+import geoip
+from lookup_cache import get_cache
+from session_store import get_session_store
+from waiting import POLL
+from capture import FULL
+from tracing import tracer
+
+# Per-process state of the batch workers
+_pool: Optional[DriverPool] = None
+_worker_options: dict = {}
+
+
+def read_urls(source: Union[str, os.PathLike, TextIO]) -> List[str]:
+    """
+    Reads the URLs from a file (one URL per line).
+    Empty lines and lines starting with `#` are ignored.
+
+    :param source: Path of the file, `-` for stdin or an opened file
+    :return: List of the URLs
+    """
+    if source == '-':
+        source = sys.stdin
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'r', encoding='utf-8') as file:
+            lines = file.readlines()
+    else:
+        lines = source.readlines()
+
+    urls = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            urls.append(line)
+
+    return urls
+
+
+def output_name(url: str) -> str:
+    """
+    Makes an output directory name for the given URL.
+
+    :param url: The URL
+    :return: A file-system friendly name based on the URL's domain
+    """
+    return urllib.parse.urlsplit(url).netloc.replace(':', '_') or 'Analyzer'
+
+
+def merge_stats(stats: Iterable[Dict[str, Dict[str, int]]]) -> Dict[str, Dict[str, int]]:
+    """
+    Sums the lookup cache stats of several workers.
+
+    :param stats: Stats of the workers
+    :return: The total stats
+    """
+    total = {}
+    for worker_stats in stats:
+        for kind, counts in worker_stats.items():
+            total_counts = total.setdefault(kind, {'hits': 0, 'misses': 0})
+            total_counts['hits'] += counts['hits']
+            total_counts['misses'] += counts['misses']
+
+    return dict(sorted(total.items()))
+
+
+def init_worker(chromedriver_path: Union[str, os.PathLike, None], recycle: int, options: dict):
+    """
+    Initializes a batch (or job queue) worker process.
+    Every worker has its own one-session DriverPool, so the browser stays warm between the URLs.
+
+    :param chromedriver_path: ChromeDriver path
+    :param recycle: Number of URLs after which the worker restarts its browser (0 for never)
+    :param options: The options of `run_batch`
+    """
+    global _pool
+    _pool = DriverPool(1, chromedriver_path, options['verbose'], max_uses=recycle)
+    # Quit the browser when the pool shuts the worker down
+    util.Finalize(None, _pool.close, exitpriority=10)
+    _worker_options.update(options)
+    if options['verbose']:
+        log21.basic_config(level=log21.DEBUG)
+    else:
+        log21.basic_config(level=log21.ERROR)
+
+
+def _analyze(job: Tuple[int, str]) -> dict:
+    """
+    Analyzes one URL in a batch worker process.
+
+    :param job: Index and URL of the job
+    :return: The manifest record of the URL
+    """
+    index, url = job
+    return analyze_url(url, _worker_options['stages'], index)
+
+
+def analyze_url(url: str, stages: Iterable[str], index: int = None) -> dict:
+    """
+    Analyzes one URL in a worker process (set up by `init_worker`).
+
+    :param url: The URL
+    :param stages: Names of the stages to run
+    :param index: Index of the URL in the batch
+    :return: The manifest record of the URL
+    """
+    stages = tuple(stages)
+    record = {'index': index, 'url': url, 'worker': os.getpid()}
+    start_time = time.time()
+
+    if not is_valid_url(url):
+        record.update(status='invalid', error='Invalid URL', seconds=0)
+        return record
+
+    try:
+        # Stages like WHOIS and AMP don't need the browser, so it's not started for them
+        with _pool.borrow() if needs_browser(stages) else nullcontext() as driver:
+            analyzer = Analyzer(url, output_name(url), verbose=_worker_options['verbose'], driver=driver,
+                                wait_strategy=_worker_options['wait_strategy'],
+                                capture_method=_worker_options['capture_method'],
+                                block_requests=_worker_options['block_requests'],
+                                stage_timeouts=_worker_options['stage_timeouts'],
+                                hedge_after=_worker_options['hedge_after'])
+            try:
+                _run(analyzer, record, stages)
+            finally:
+                # Stop the image writer even if a stage failed (a borrowed driver is left to the pool)
+                analyzer.close()
+    except Exception as e:
+        record.update(status='failed', error=f"{e.__class__.__name__}: {str(e)}")
+
+    record['seconds'] = round(time.time() - start_time, 3)
+    record['cache'] = get_cache().stats()
+    record['session'] = get_session_store().stats()
+
+    # Hand the spans of the URL over right away, so they don't pile up in long-running workers
+    spans = tracer.pop_spans()
+    if _worker_options['trace_path']:
+        try:
+            tracer.export_jsonl(_worker_options['trace_path'], spans)
+        except OSError as e:
+            log21.error(f"Couldn't write the trace of {url}: {e.__class__.__name__}: {str(e)}")
+
+    return record
+
+
+def _run(analyzer: Analyzer, record: dict, stages: Tuple[str, ...]):
+    """Runs the stages of the analyzer and adds their results to the manifest record."""
+    record['saved_path'] = analyzer.saved_path
+    report = analyzer.run_stages(stages, _worker_options['concurrent'],
+                                 _worker_options['profile'], _worker_options['max_age'], _worker_options['tabs'],
+                                 deadline=_worker_options['deadline'])
+    record['stages'] = report.results
+    record['overlap_saved'] = round(report.saved_time, 3)
+    record['wait_seconds'] = round(sum(wait.seconds for wait in analyzer.waits), 3)
+
+    if _worker_options['optimize']:
+        try:
+            # Pool workers can't start processes of their own
+            analyzer.optimize(_worker_options['formats'], workers=1)
+        except Exception as e:
+            record['optimize_error'] = f"{e.__class__.__name__}: {str(e)}"
+
+    failed = sum(stage['status'] not in ('ok', 'cached') for stage in record['stages'].values())
+    if not failed:
+        record['status'] = 'ok'
+    elif failed == len(record['stages']):
+        record['status'] = 'failed'
+    else:
+        record['status'] = 'partial'
+
+
+def run_batch(urls: List[str], workers: int = None, manifest_path: Union[str, os.PathLike] = 'manifest.jsonl',
+              chromedriver_path: Union[str, os.PathLike] = None, verbose: bool = False,
+              optimize: bool = False, concurrent: bool = True, recycle: int = 50,
+              wait_strategy: str = POLL, formats: List[str] = None, capture_method: str = FULL,
+              stages: Iterable[str] = STAGES, trace_path: Union[str, os.PathLike] = None,
+              profile: Iterable[str] = (), max_age: float = None, block_requests: bool = True,
+              tabs: int = 1, deadline: float = None, stage_timeouts: Dict[str, float] = None,
+              hedge_after: float = HEDGE_AFTER) -> Iterator[dict]:
+    """
+    Analyzes a list of URLs using a pool of worker processes.
+    Every worker keeps its browser alive for the URLs it gets.
+    A JSON line is written to the manifest file as soon as each URL is done.
+
+    :param urls: The URLs to analyze
+    :param workers: Number of worker processes (defaults to the number of CPUs)
+    :param manifest_path: Path of the manifest file
+    :param chromedriver_path: ChromeDriver path
+    :param verbose: Verbose mode for the workers
+    :param optimize: Optimize the images of every URL
+    :param concurrent: Overlap the stages of every URL that don't need the same resources
+    :param recycle: Number of URLs after which a worker restarts its browser (0 for never)
+    :param wait_strategy: How the analyzers wait for page changes (`poll` or `mutation`)
+    :param formats: Formats of the optimized images
+    :param capture_method: How the analyzers take the screenshots (`full` or `clip`)
+    :param stages: Names of the stages to run
+    :param trace_path: JSON lines file the workers append the tracing spans of every URL to
+    :param profile: Names of the stages to run under cProfile
+    :param max_age: Reuse the outputs of stages that finished less than this many seconds ago
+    :param block_requests: Block the requests the browser stages don't need
+    :param tabs: Number of browser stages every worker runs at the same time in tabs of its browser
+    :param deadline: Time budget of every URL in seconds
+    :param stage_timeouts: Time budgets of the stages in seconds (see `main.STAGE_TIMEOUTS`)
+    :param hedge_after: Send the lookups that haven't answered after this many seconds again (0 for never)
+    :return: Yields the manifest records in the order they are finished
+    """
+    workers = max(1, min(workers or os.cpu_count() or 1, len(urls) or 1))
+
+    # Decode the templates and fonts and map the GeoIP database once, so the forked workers share them
+    asset_registry.preload()
+    geoip.get_database()
+
+    with open(manifest_path, 'a', encoding='utf-8') as manifest:
+        options = {'verbose': verbose, 'optimize': optimize, 'concurrent': concurrent,
+                   'wait_strategy': wait_strategy, 'formats': formats, 'capture_method': capture_method,
+                   'stages': tuple(stages), 'trace_path': trace_path, 'profile': tuple(profile),
+                   'max_age': max_age, 'block_requests': block_requests, 'tabs': tabs, 'deadline': deadline,
+                   'stage_timeouts': stage_timeouts, 'hedge_after': hedge_after}
+        pool = multiprocessing.Pool(workers, initializer=init_worker, initargs=(chromedriver_path, recycle, options))
+        try:
+            for record in pool.imap_unordered(_analyze, enumerate(urls)):
+                manifest.write(json.dumps(record) + '\n')
+                manifest.flush()
+                yield record
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
@@ -0,0 +1,78 @@
+"""
+Measures how many cards per second `cards.render_records` renders from stored records,
+in this process and on process pools of different sizes.
+
+    python benchmarks/bench_cards.py [--records 300] [--workers 1 2 4] [--cards whois amp ssl] [--json results.json]
+
+The records are synthetic (with a flag and a favicon like the ones of the stand-ins); no network is used.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stand_ins import make_png  # noqa: E402
+
+
+def make_records(count: int) -> list:
+    from cards import CardRecord, CARDS
+
+    flag = make_png(640, 480)
+    favicon = make_png(16, 16, (30, 30, 200))
+    return [CardRecord(f'https://site-{i}.example.com/', register_status='client transfer prohibited',
+                       name_servers='ns1.example.com\nns2.example.com',
+                       dates='2010-05-04 10:00:00\n2030-05-04 10:00:00\n2024-01-02 03:04:05',
+                       ip_address=f'10.0.{i // 256 % 256}.{i % 256}', hosted_website=f'host-{i}.example.net',
+                       ip_location='Iran - Tehran', title=f'Example Site {i}', page_title=f'Example Site {i}',
+                       flag=flag, favicon=favicon, cards=CARDS)
+            for i in range(count)]
+
+
+def bench(records: list, cards: list, workers: int, root: str) -> dict:
+    from cards import render_records
+
+    start = time.perf_counter()
+    rendered = 0
+    failed = 0
+    for result in render_records(records, cards, workers, root):
+        rendered += len(result['cards'])
+        failed += result['status'] != 'ok'
+    seconds = time.perf_counter() - start
+    shutil.rmtree(root, ignore_errors=True)
+
+    return {'workers': workers, 'records': len(records), 'cards': rendered, 'failed': failed,
+            'seconds': round(seconds, 3), 'cards_per_second': round(rendered / seconds, 1)}
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=300)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--cards', nargs='+', default=['whois', 'amp', 'ssl'])
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp(prefix='bench-cards-')
+    records = make_records(args.records)
+    results = {'cpus': os.cpu_count(), 'runs': []}
+    for workers in args.workers:
+        result = bench(records, args.cards, workers, os.path.join(temp_dir, f'save-{workers}'))
+        results['runs'].append(result)
+        print(f"{workers} workers: {result['cards']} cards in {result['seconds']} s "
+              f"({result['cards_per_second']} cards/s, {result['failed']} failed)")
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
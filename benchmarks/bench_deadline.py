@@ -0,0 +1,86 @@
+"""
+Measures how the time budgets and the hedged lookups bound the tail latency of the network stages
+when some of the API calls stall (every `--stall-every`th request to each stand-in API takes `--stall` seconds longer).
+
+    python benchmarks/bench_deadline.py [--runs 40] [--stages get_whois] [--stall-every 5] [--stall 3]
+                                        [--hedge 0.2] [--stage-timeout 1] [--json results.json]
+
+Every run is repeated as is, with hedged lookups and with a stage budget; the lookup cache is cleared between runs.
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stand_ins import StandIns  # noqa: E402
+from bench_stages import percentile  # noqa: E402
+
+
+def bench(url: str, stages: list, runs: int, **options) -> dict:
+    from main import Analyzer
+    from lookup_cache import get_cache
+
+    seconds = {stage: [] for stage in stages}
+    statuses = {}
+    for _ in range(runs):
+        get_cache().clear()
+        analyzer = Analyzer(url, 'bench-deadline', **options)
+        report = analyzer.run_stages(stages)
+        analyzer.close()
+        for stage, result in report.results.items():
+            seconds[stage].append(result['seconds'])
+            statuses[result['status']] = statuses.get(result['status'], 0) + 1
+
+    return {
+        'statuses': statuses,
+        'stages': {stage: {'p50': percentile(values, 50), 'p95': percentile(values, 95), 'max': max(values)}
+                   for stage, values in seconds.items()},
+    }
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=40)
+    parser.add_argument('--stages', nargs='+', default=['get_whois'])
+    parser.add_argument('--latency', type=float, default=0.02, help='Latency of the stand-ins in seconds')
+    parser.add_argument('--stall-every', type=int, default=5)
+    parser.add_argument('--stall', type=float, default=3.0)
+    parser.add_argument('--hedge', type=float, default=0.2, help='Hedge the lookups after this many seconds')
+    parser.add_argument('--stage-timeout', type=float, default=1.0, help='Time budget of every stage in seconds')
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp(prefix='bench-deadline-')
+    results = {'stages': args.stages, 'runs': args.runs, 'stall_every': args.stall_every, 'stall': args.stall}
+    with StandIns(latency=args.latency, stall_every=args.stall_every, stall=args.stall) as stand_ins:
+        os.environ.update(stand_ins.environment())
+        os.environ.update(LOOKUP_CACHE=os.path.join(temp_dir, 'lookups.db'),
+                          STAGE_CACHE=os.path.join(temp_dir, 'stages.db'), OUTPUT_ROOT=os.path.join(temp_dir, 'save'))
+        # The stand-ins serve all the APIs from one host; the real ones don't share their connection limit
+        os.environ.setdefault('HTTP_MAX_CONNECTIONS_PER_HOST', '16')
+        url = stand_ins.site_url()
+
+        for name, options in (('baseline', {'hedge_after': 0}),
+                              ('hedged', {'hedge_after': args.hedge}),
+                              ('budget', {'hedge_after': 0,
+                                          'stage_timeouts': dict.fromkeys(args.stages, args.stage_timeout)})):
+            results[name] = bench(url, args.stages, args.runs, **options)
+            for stage, stats in results[name]['stages'].items():
+                print(f"{name:>8} {stage}: p50 {stats['p50']:.3f} s, p95 {stats['p95']:.3f} s, "
+                      f"max {stats['max']:.3f} s {results[name]['statuses']}")
+
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
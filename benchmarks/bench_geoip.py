@@ -0,0 +1,145 @@
+"""
+Measures the local GeoIP lookups of `geoip.py`: the build time and size of a database, the latency of its lookups,
+the memory it takes once mapped, and the latency of the cached resolver, compared to the ip-api.com stand-in.
+
+    python benchmarks/bench_geoip.py [--ranges 1000000] [--v6-ranges 100000] [--locations 5000]
+                                     [--lookups 200000] [--latency 0.02] [--json results.json]
+
+The database is synthetic (random ranges of about the size of the free city databases); no internet access is needed.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stand_ins import StandIns  # noqa: E402
+from bench_stages import percentile  # noqa: E402
+
+
+def rss_mib() -> float:
+    """Resident set size of this process in MiB (Linux only, 0 elsewhere)."""
+    try:
+        with open('/proc/self/statm') as file:
+            return round(int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20, 1)
+    except (OSError, ValueError, AttributeError):
+        return 0.0
+
+
+def make_ranges(count: int, v6_count: int, locations: int, seed: int = 0):
+    rng = random.Random(seed)
+    places = [(f'C{i % 250:03d}', f'Country {i % 250}', f'City {i}') for i in range(locations)]
+    starts = sorted(rng.sample(range(2 ** 32 - 1), count))
+    for start, next_start in zip(starts, starts[1:] + [2 ** 32]):
+        yield 4, start, next_start - 1, rng.choice(places)
+    step = 2 ** 128 // (v6_count + 1)
+    for i in range(v6_count):
+        yield 6, i * step, i * step + step // 2, rng.choice(places)
+
+
+def bench_lookups(path: str, lookups: int) -> dict:
+    import geoip
+
+    rng = random.Random(1)
+    addresses = ['.'.join(str(rng.randrange(256)) for _ in range(4)) for _ in range(lookups)]
+    before = rss_mib()
+    database = geoip.GeoIPDatabase(path)
+    opened = rss_mib()
+
+    start = time.perf_counter()
+    found = sum(database.lookup(address) is not None for address in addresses)
+    total = time.perf_counter() - start
+
+    samples = []
+    for address in addresses[:20000]:
+        lookup_start = time.perf_counter()
+        database.lookup(address)
+        samples.append((time.perf_counter() - lookup_start) * 1e6)
+    v6_start = time.perf_counter()
+    for i in range(20000):
+        database.lookup(f'{i % 65536:x}:{rng.randrange(65536):x}::1')
+    v6_total = time.perf_counter() - v6_start
+    after = rss_mib()
+    database.close()
+
+    return {'lookups': lookups, 'found': found, 'mean_us': round(total / lookups * 1e6, 2),
+            'p50_us': round(percentile(samples, 50), 2), 'p99_us': round(percentile(samples, 99), 2),
+            'v6_mean_us': round(v6_total / 20000 * 1e6, 2),
+            'rss_mib': {'before': before, 'opened': opened, 'after_lookups': after}}
+
+
+def bench_resolver(runs: int = 1000) -> dict:
+    from geoip import Resolver
+
+    resolver = Resolver()
+    start = time.perf_counter()
+    resolver.resolve('localhost')
+    uncached = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(runs):
+        resolver.resolve('localhost')
+    cached = (time.perf_counter() - start) / runs
+    return {'uncached_us': round(uncached * 1e6, 1), 'cached_us': round(cached * 1e6, 2)}
+
+
+def bench_ip_api(latency: float, runs: int = 50) -> dict:
+    import requests
+
+    with StandIns(latency=latency) as stand_ins:
+        url = stand_ins.environment()['IP_API_URL'].format(domain='example.com')
+        session = requests.Session()
+        seconds = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            session.get(url).json()
+            seconds.append(time.perf_counter() - start)
+    return {'latency': latency, 'p50_ms': round(percentile(seconds, 50) * 1000, 2),
+            'p99_ms': round(percentile(seconds, 99) * 1000, 2)}
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ranges', type=int, default=1_000_000)
+    parser.add_argument('--v6-ranges', type=int, default=100_000)
+    parser.add_argument('--locations', type=int, default=5000)
+    parser.add_argument('--lookups', type=int, default=200_000)
+    parser.add_argument('--latency', type=float, default=0.02, help='Latency of the ip-api stand-in in seconds')
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    from geoip import build_database
+
+    temp_dir = tempfile.mkdtemp(prefix='bench-geoip-')
+    path = os.path.join(temp_dir, 'geoip.bin')
+    start = time.perf_counter()
+    stats = build_database(make_ranges(args.ranges, args.v6_ranges, args.locations), path)
+    results = {'build': dict(stats, seconds=round(time.perf_counter() - start, 2))}
+    print(f"build: {stats['v4']} IPv4 and {stats['v6']} IPv6 ranges, {stats['bytes'] / 2 ** 20:.1f} MiB "
+          f"in {results['build']['seconds']} s")
+
+    results['lookups'] = lookups = bench_lookups(path, args.lookups)
+    print(f"lookup: mean {lookups['mean_us']} us, p50 {lookups['p50_us']} us, p99 {lookups['p99_us']} us "
+          f"(IPv6 mean {lookups['v6_mean_us']} us); RSS {lookups['rss_mib']['before']} MiB -> "
+          f"{lookups['rss_mib']['opened']} MiB mapped -> {lookups['rss_mib']['after_lookups']} MiB after the lookups")
+
+    results['resolver'] = resolver = bench_resolver()
+    print(f"resolver: {resolver['uncached_us']} us uncached, {resolver['cached_us']} us cached")
+
+    results['ip_api'] = ip_api = bench_ip_api(args.latency)
+    print(f"ip-api stand-in ({args.latency} s latency): p50 {ip_api['p50_ms']} ms, p99 {ip_api['p99_ms']} ms")
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Compares the local image optimizer with the imagecompressor.com round-trip.
+
+    python benchmarks/bench_optimize.py save/Analyzer [--formats png webp] [--workers 4] [--remote]
+
+The images of the given output directory are copied to temporary directories, so the directory itself
+is not changed. `--remote` also runs `Analyzer.optimize_remote` (needs Chrome and internet access).
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from optimizer import optimize_directory, IMAGES, FORMATS  # noqa: E402
+
+
+def copy_images(source: str) -> str:
+    target = tempfile.mkdtemp(prefix='bench-optimize-')
+    for name in IMAGES:
+        path = os.path.join(source, f'{name}.png')
+        if os.path.isfile(path):
+            shutil.copy2(path, target)
+    return target
+
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, f'{name}.png')) for name in IMAGES
+               if os.path.isfile(os.path.join(path, f'{name}.png')))
+
+
+def bench_local(source: str, formats, workers: int):
+    target = copy_images(source)
+    try:
+        start = time.perf_counter()
+        report = optimize_directory(target, formats=formats, workers=workers)
+        seconds = time.perf_counter() - start
+        return report['original'], report['optimized'], seconds
+    finally:
+        shutil.rmtree(target)
+
+
+def bench_remote(source: str):
+    from main import Analyzer
+
+    target = copy_images(source)
+    analyzer = Analyzer('https://example.com', 'bench-optimize')
+    try:
+        shutil.rmtree(analyzer.saved_path)
+        analyzer.saved_path = target
+        original = directory_size(target)
+        start = time.perf_counter()
+        analyzer.optimize_remote()
+        seconds = time.perf_counter() - start
+        return original, directory_size(target), seconds
+    finally:
+        analyzer.close()
+        shutil.rmtree(target)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', help='An Analyzer output directory')
+    parser.add_argument('--formats', nargs='+', choices=FORMATS)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--remote', action='store_true', help='Also run the imagecompressor.com path')
+    args = parser.parse_args()
+
+    rows = [('local', *bench_local(args.directory, args.formats, args.workers))]
+    if args.remote:
+        rows.append(('remote', *bench_remote(args.directory)))
+
+    print(f'{"method":>8} {"original":>10} {"optimized":>10} {"saved %":>8} {"seconds":>8}')
+    for name, original, optimized, seconds in rows:
+        saved = 100 * (original - optimized) / original if original else 0
+        print(f'{name:>8} {original:>10} {optimized:>10} {saved:>8.1f} {seconds:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
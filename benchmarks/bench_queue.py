@@ -0,0 +1,114 @@
+"""
+Measures the throughput of the job queue workers against the local stand-ins
+and checks that no job is lost when a worker is killed in the middle of a job.
+
+    python benchmarks/bench_queue.py [--jobs 40] [--workers 1 2 4] [--stages get_whois get_amp]
+                                     [--latency 0.05] [--json results.json]
+
+Every run starts `worker.py work -w N -e` on a new queue and times it until the queue is empty.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stand_ins import StandIns  # noqa: E402
+
+PROJECT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_PATH)
+
+
+def worker_command(queue_url: str, *args: str) -> list:
+    return [sys.executable, os.path.join(PROJECT_PATH, 'worker.py'), '-Q', queue_url, *args]
+
+
+def bench_workers(env: dict, temp_dir: str, urls: list, stages: list, workers: int) -> dict:
+    from job_queue import open_queue
+
+    queue_url = 'sqlite:///' + os.path.join(temp_dir, f'queue-{workers}.sqlite3')
+    queue = open_queue(queue_url)
+    queue.enqueue(urls, stages)
+    start = time.perf_counter()
+    subprocess.run(worker_command(queue_url, 'work', '-w', str(workers), '-e', '-a', '0'), cwd=PROJECT_PATH, env=env,
+                   check=True, capture_output=True)
+    seconds = time.perf_counter() - start
+    stats = queue.stats()
+    queue.close()
+
+    return {'workers': workers, 'jobs': len(urls), 'seconds': round(seconds, 3),
+            'throughput': round(len(urls) / seconds, 3), 'statuses': stats}
+
+
+def crash_test(env: dict, temp_dir: str, urls: list, stages: list) -> dict:
+    """Kills a worker while it's running jobs; a second worker must finish all of them after the lease expires."""
+    from job_queue import open_queue
+
+    queue_url = 'sqlite:///' + os.path.join(temp_dir, 'queue-crash.sqlite3')
+    queue = open_queue(queue_url)
+    queue.enqueue(urls, stages)
+
+    victim = subprocess.Popen(worker_command(queue_url, 'work', '-l', '2', '-a', '0'), cwd=PROJECT_PATH, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    while not queue.stats()['done']:
+        time.sleep(0.05)
+    victim.send_signal(signal.SIGKILL)
+    victim.wait()
+    killed = queue.stats()
+
+    start = time.perf_counter()
+    subprocess.run(worker_command(queue_url, 'work', '-l', '2', '-e', '-a', '0'), cwd=PROJECT_PATH, env=env,
+                   check=True, capture_output=True)
+    recovered = queue.stats()
+    retried = sum(job.attempts > 1 for job in queue.jobs())
+    queue.close()
+
+    return {'after_kill': killed, 'after_recovery': recovered, 'retried_jobs': retried,
+            'recovery_seconds': round(time.perf_counter() - start, 3),
+            'lost': len(urls) - recovered['done'] - recovered['dead']}
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=40)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--stages', nargs='+', default=['get_whois', 'get_amp'])
+    parser.add_argument('--latency', type=float, default=0.05, help='Latency of the stand-ins in seconds')
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp(prefix='bench-queue-')
+    results = {'stages': args.stages, 'runs': []}
+    with StandIns(latency=args.latency) as stand_ins:
+        env = dict(os.environ, **stand_ins.environment())
+        env.update(LOOKUP_CACHE=os.path.join(temp_dir, 'lookups.db'), STAGE_CACHE=os.path.join(temp_dir, 'stages.db'),
+                   OUTPUT_ROOT=os.path.join(temp_dir, 'save'))
+        urls = [stand_ins.site_url(i) for i in range(args.jobs)]
+
+        for workers in args.workers:
+            result = bench_workers(env, temp_dir, urls, args.stages, workers)
+            results['runs'].append(result)
+            print(f"{workers} workers: {result['jobs']} jobs in {result['seconds']} s "
+                  f"({result['throughput']} jobs/s) {result['statuses']}")
+
+        results['crash'] = crash_test(env, temp_dir, urls, args.stages)
+        print(f"Killed a worker: {results['crash']['after_kill']}")
+        print(f"After recovery: {results['crash']['after_recovery']}, {results['crash']['retried_jobs']} jobs "
+              f"retried, {results['crash']['lost']} lost")
+
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Compares the time to the first artifact (the first saved output image) of the HTTP service with warm workers
+against a cold `run.py` run, using the local stand-ins.
+
+    python benchmarks/bench_server.py [--runs 10] [--stages get_whois get_amp] [--workers 2]
+                                      [--latency 0.05] [--json results.json]
+
+The CLI time is measured from the start of the process to the first output file in its save path;
+the server time from sending `POST /jobs?stream=1` to the first streamed stage event with an artifact.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import statistics
+import tempfile
+import subprocess
+import http.client
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stand_ins import StandIns  # noqa: E402
+
+PROJECT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def cli_first_artifact(env: dict, url: str, stages: list, output_root: str) -> float:
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(PROJECT_PATH, 'run.py'), '-u', url, '-a', '0', '-q',
+                                '-S', *stages], cwd=PROJECT_PATH, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    first = None
+    while first is None:
+        if any(name.endswith('.png') for _, _, names in os.walk(output_root) for name in names):
+            first = time.perf_counter() - start
+        elif process.poll() is not None:
+            raise RuntimeError(f'run.py exited with {process.returncode} without saving an output')
+        else:
+            time.sleep(0.005)
+    process.wait()
+    shutil.rmtree(output_root, ignore_errors=True)
+    return first
+
+
+def server_first_artifact(port: int, url: str, stages: list) -> tuple:
+    """:return: The time to the first artifact and the time to the end of the job"""
+    start = time.perf_counter()
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    connection.request('POST', '/jobs?stream=1', json.dumps({'url': url, 'stages': stages}),
+                       {'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    if response.status != 202:
+        raise RuntimeError(f'The server answered {response.status}: {response.read()}')
+    first = None
+    for line in response:
+        event = json.loads(line)
+        if first is None and event.get('artifacts'):
+            first = time.perf_counter() - start
+        if event['event'] == 'done':
+            break
+    connection.close()
+    return first, time.perf_counter() - start
+
+
+def wait_for_server(port: int, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'server.py exited with {process.returncode}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/health')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("The server didn't start")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--stages', nargs='+', default=['get_whois', 'get_amp'])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=0.05, help='Latency of the stand-ins in seconds')
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp(prefix='bench-server-')
+    results = {'stages': args.stages, 'runs': args.runs}
+    with StandIns(latency=args.latency) as stand_ins:
+        env = dict(os.environ, **stand_ins.environment())
+        env.update(LOOKUP_CACHE=os.path.join(temp_dir, 'lookups.db'), STAGE_CACHE=os.path.join(temp_dir, 'stages.db'))
+        urls = [stand_ins.site_url(i) for i in range(args.runs)]
+
+        cli = []
+        for i, url in enumerate(urls):
+            output_root = os.path.join(temp_dir, f'cli-{i}')
+            cli.append(cli_first_artifact(dict(env, OUTPUT_ROOT=output_root), url, args.stages, output_root))
+
+        port = free_port()
+        server = subprocess.Popen([sys.executable, os.path.join(PROJECT_PATH, 'server.py'), '-p', str(port),
+                                   '-w', str(args.workers), '-a', '0'], cwd=PROJECT_PATH,
+                                  env=dict(env, OUTPUT_ROOT=os.path.join(temp_dir, 'server')),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_server(port, server)
+            served = [server_first_artifact(port, url, args.stages) for url in urls]
+        finally:
+            server.terminate()
+            server.wait()
+
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+    results['cli_p50'] = round(statistics.median(cli), 3)
+    results['server_p50'] = round(statistics.median(first for first, _ in served), 3)
+    results['server_job_p50'] = round(statistics.median(total for _, total in served), 3)
+    print(f"Time to the first artifact (p50 of {args.runs} runs): CLI {results['cli_p50']} s, "
+          f"server {results['server_p50']} s ({results['server_p50'] / results['cli_p50']:.0%} of the CLI); "
+          f"whole job on the server: {results['server_job_p50']} s")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
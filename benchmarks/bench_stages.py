@@ -0,0 +1,247 @@
+"""
+Runs the Analyzer stages against the local stand-ins and reports per-stage latency percentiles,
+peak RSS and throughput for single-URL and batch runs.
+
+    python benchmarks/bench_stages.py [--runs 5] [--batch 20] [--workers 4] [--stages get_whois get_amp]
+                                      [--latency 0.02] [--warm-cache] [--tabs 3] [--json results.json]
+
+With --tabs, the single-URL runs are repeated with the browser stages in tabs of one browser,
+and the peak memory of the browser is compared to running them one after another.
+
+No internet access is needed, but the browser stages need Chrome and ChromeDriver.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stand_ins import StandIns  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def peak_rss() -> Dict[str, float]:
+    """Peak resident set size of this process and of its largest child (e.g. Chrome) in MiB."""
+    if resource is None:
+        return {}
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return {
+        'self_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2 ** 20, 1),
+        'children_mib': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 2 ** 20, 1),
+    }
+
+
+def process_tree_rss(pid: int) -> Optional[int]:
+    """Resident set size of a process and all its descendants in bytes (Linux only)."""
+    children: Dict[int, List[int]] = {}
+    rss = {}
+    try:
+        names = os.listdir('/proc')
+    except OSError:
+        return None
+    for name in names:
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as file:
+                # The name of the process (in parentheses) can have spaces
+                fields = file.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        children.setdefault(int(fields[1]), []).append(int(name))
+        rss[int(name)] = int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        total += rss.get(current, 0)
+        stack += children.get(current, [])
+    return total
+
+
+class PeakMemory:
+    def __init__(self, get_pid: Callable[[], Optional[int]], interval: float = 0.1):
+        """
+        Samples the memory of a process tree (e.g. ChromeDriver and its Chrome) in the background.
+
+        :param get_pid: Returns the root process, or None while it's not started
+        :param interval: Seconds between the samples
+        """
+        self.get_pid = get_pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            pid = self.get_pid()
+            if pid:
+                self.peak = max(self.peak, process_tree_rss(pid) or 0)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+
+def browser_pid(analyzer) -> Optional[int]:
+    driver = analyzer._driver if analyzer is not None else None
+    try:
+        return driver.service.process.pid
+    except AttributeError:
+        return None
+
+
+def summarize(durations: Dict[str, List[float]]) -> Dict[str, dict]:
+    return {stage: {'n': len(values), 'p50': round(percentile(values, 50), 3), 'p90': round(percentile(values, 90), 3),
+                    'p99': round(percentile(values, 99), 3), 'max': round(max(values), 3)}
+            for stage, values in durations.items() if values}
+
+
+def bench_single(stand_ins: StandIns, stages, runs: int, warm_cache: bool, tabs: int = 1) -> dict:
+    from main import Analyzer
+    from lookup_cache import get_cache
+
+    durations: Dict[str, List[float]] = {stage: [] for stage in stages}
+    durations['total'] = []
+    errors = {}
+    analyzer = None
+    start = time.perf_counter()
+    with PeakMemory(lambda: browser_pid(analyzer)) as memory:
+        for i in range(runs):
+            if not warm_cache:
+                get_cache().clear()
+            run_start = time.perf_counter()
+            if analyzer is None:
+                analyzer = Analyzer(stand_ins.site_url(i), 'bench')
+            else:
+                analyzer.load(stand_ins.site_url(i), 'bench')
+            report = analyzer.run_stages(stages, tabs=tabs)
+            durations['total'].append(time.perf_counter() - run_start)
+            for stage, result in report.results.items():
+                durations[stage].append(result['seconds'])
+                if result['status'] != 'ok':
+                    errors[stage] = result.get('error')
+            shutil.rmtree(analyzer.saved_path, ignore_errors=True)
+        seconds = time.perf_counter() - start
+    if analyzer is not None:
+        analyzer.close()
+
+    return {'runs': runs, 'tabs': tabs, 'seconds': round(seconds, 3), 'throughput': round(runs / seconds, 3),
+            'browser_peak_mib': round(memory.peak / 2 ** 20, 1), 'stages': summarize(durations), 'errors': errors}
+
+
+def bench_batch(stand_ins: StandIns, stages, urls: int, workers: int) -> dict:
+    from batch import run_batch
+
+    durations: Dict[str, List[float]] = {stage: [] for stage in stages}
+    durations['total'] = []
+    statuses = {}
+    manifest = tempfile.NamedTemporaryFile(suffix='.jsonl', delete=False)
+    manifest.close()
+    start = time.perf_counter()
+    try:
+        for record in run_batch([stand_ins.site_url(i) for i in range(urls)], workers, manifest.name,
+                                stages=stages):
+            statuses[record['status']] = statuses.get(record['status'], 0) + 1
+            durations['total'].append(record['seconds'])
+            for stage, result in record.get('stages', {}).items():
+                durations[stage].append(result['seconds'])
+            if record.get('saved_path'):
+                shutil.rmtree(record['saved_path'], ignore_errors=True)
+    finally:
+        os.remove(manifest.name)
+    seconds = time.perf_counter() - start
+
+    return {'urls': urls, 'workers': workers, 'seconds': round(seconds, 3),
+            'throughput': round(urls / seconds, 3), 'statuses': statuses, 'stages': summarize(durations)}
+
+
+def print_table(title: str, result: dict):
+    print(f"\n{title}: {result.get('runs', result.get('urls'))} URLs in {result['seconds']} s "
+          f"({result['throughput']} URLs/s)")
+    print(f'{"stage":>16} {"n":>4} {"p50":>8} {"p90":>8} {"p99":>8} {"max":>8}')
+    for stage, stats in result['stages'].items():
+        print(f"{stage:>16} {stats['n']:>4} {stats['p50']:>8.3f} {stats['p90']:>8.3f} {stats['p99']:>8.3f} "
+              f"{stats['max']:>8.3f}")
+    if result.get('browser_peak_mib'):
+        print(f"  peak browser memory: {result['browser_peak_mib']} MiB")
+    for stage, error in result.get('errors', {}).items():
+        print(f'  {stage} failed: {error}')
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='Number of single-URL runs')
+    parser.add_argument('--batch', type=int, default=0, help='Number of URLs of the batch run (0 to skip)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--stages', nargs='+')
+    parser.add_argument('--latency', type=float, default=0.0, help='Latency of the stand-ins in seconds')
+    parser.add_argument('--analyze-ms', type=int, default=1500, help='How long the GTMetrix stand-in analyzes')
+    parser.add_argument('--tabs', type=int, default=1, help='Also run the browser stages in this many tabs')
+    parser.add_argument('--warm-cache', action='store_true', help="Don't clear the lookup cache between runs")
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    with StandIns(latency=args.latency, analyze_ms=args.analyze_ms) as stand_ins:
+        # The endpoints are read when the Analyzer is imported
+        os.environ.update(stand_ins.environment())
+        cache_dir = tempfile.mkdtemp(prefix='bench-cache-')
+        os.environ.setdefault('LOOKUP_CACHE', os.path.join(cache_dir, 'lookups.db'))
+        os.environ.setdefault('STAGE_CACHE', os.path.join(cache_dir, 'stages.db'))
+        os.environ.setdefault('OUTPUT_ROOT', os.path.join(cache_dir, 'save'))
+        # The stand-in login is kept apart from the real GTMetrix session
+        os.environ.setdefault('GTMETRIX_SESSION', os.path.join(cache_dir, 'gtmetrix-session.bin'))
+
+        from main import STAGES
+
+        stages = tuple(args.stages or STAGES)
+        results = {'stages': stages}
+        if args.runs:
+            results['single'] = bench_single(stand_ins, stages, args.runs, args.warm_cache)
+            print_table('Single URL', results['single'])
+        if args.runs and args.tabs > 1:
+            results['tabs'] = bench_single(stand_ins, stages, args.runs, args.warm_cache, args.tabs)
+            print_table(f'Single URL ({args.tabs} tabs)', results['tabs'])
+            one, many = results['single'], results['tabs']
+            print(f"  {one['seconds'] / many['seconds']:.2f}x as fast, "
+                  f"{many['browser_peak_mib'] - one['browser_peak_mib']:+.1f} MiB of browser memory")
+        if args.batch:
+            results['batch'] = bench_batch(stand_ins, stages, args.batch, args.workers)
+            print_table(f'Batch ({args.workers} workers)', results['batch'])
+        results['peak_rss'] = peak_rss()
+        print(f"\nPeak RSS: {results['peak_rss']}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
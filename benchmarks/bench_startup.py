@@ -0,0 +1,116 @@
+"""
+Measures how fast a run starts: the import time of `main` and the time from a cold process to
+finished WHOIS and AMP cards (stages that don't need the browser), against the local stand-ins.
+
+    python benchmarks/bench_startup.py [--runs 5] [--stages get_whois get_amp] [--importtime 10]
+
+Every run is a new Python process, so nothing is imported or cached in memory beforehand.
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stand_ins import StandIns  # noqa: E402
+
+PROJECT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child process; prints the timings as JSON
+CHILD_SCRIPT = '''
+import sys, time, json, shutil
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+analyzer = main.Analyzer(sys.argv[1], 'bench-startup')
+report = analyzer.run_stages(json.loads(sys.argv[2]))
+done = time.perf_counter()
+analyzer.close()
+shutil.rmtree(analyzer.saved_path, ignore_errors=True)
+print(json.dumps({
+    'import': imported - start, 'total': done - start,
+    'statuses': {stage: result['status'] for stage, result in report.results.items()},
+    'browser_imported': 'selenium.webdriver.remote.webdriver' in sys.modules,
+    'whois21_imported': 'whois21' in sys.modules,
+}))
+'''
+
+
+def median(values: List[float]) -> float:
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+def import_times(env: dict, top: int) -> List[tuple]:
+    """The modules that take the longest to import (cumulative microseconds, from `python -X importtime`)."""
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=PROJECT_PATH, env=env,
+                            capture_output=True, text=True).stderr
+    times = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times.append((int(cumulative), name.strip()))
+
+    return sorted(times, reverse=True)[:top]
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--stages', nargs='+', default=['get_whois', 'get_amp'])
+    parser.add_argument('--importtime', type=int, default=10, help='Show the N slowest imports (0 to skip)')
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp(prefix='bench-startup-')
+    with StandIns() as stand_ins:
+        env = dict(os.environ, **stand_ins.environment())
+        env.update(STAGE_CACHE=os.path.join(temp_dir, 'stages.db'), OUTPUT_ROOT=os.path.join(temp_dir, 'save'))
+
+        runs = []
+        for i in range(args.runs):
+            # A new lookup cache every run, so the lookups are not cached either
+            env['LOOKUP_CACHE'] = os.path.join(temp_dir, f'lookups-{i}.db')
+            command = [sys.executable, '-c', CHILD_SCRIPT, stand_ins.site_url(i), json.dumps(args.stages)]
+            output = subprocess.run(command, cwd=PROJECT_PATH, env=env, capture_output=True, text=True)
+            if output.returncode:
+                sys.exit(output.stderr)
+            runs.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+        results = {
+            'stages': args.stages,
+            'runs': runs,
+            'import_median': round(median([run['import'] for run in runs]), 3),
+            'total_median': round(median([run['total'] for run in runs]), 3),
+        }
+        print(f"{len(runs)} cold runs of {' + '.join(args.stages)}:")
+        print(f"  import main: {results['import_median']:.3f} s (median)")
+        print(f"  import + run: {results['total_median']:.3f} s (median)")
+        print(f"  statuses: {runs[-1]['statuses']}")
+        print(f"  browser imported: {runs[-1]['browser_imported']}, "
+              f"whois21 imported: {runs[-1]['whois21_imported']}")
+
+        if args.importtime:
+            results['slowest_imports'] = import_times(env, args.importtime)
+            print('\nSlowest imports (cumulative):')
+            for microseconds, name in results['slowest_imports']:
+                print(f'  {microseconds / 1000:>8.1f} ms  {name}')
+
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Compares the streaming title extractor of `http_client` with downloading and parsing the whole page.
+
+    python benchmarks/bench_title.py [--sizes 100000 2000000 8000000] [--repeat 10]
+"""
+import os
+import sys
+import time
+import statistics
+import threading
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import http_client  # noqa: E402
+
+TITLE = 'Fixture page &amp; a title – ünïcödé'
+
+
+def make_page(size: int) -> bytes:
+    """Makes a landing-page-like HTML document of about `size` bytes."""
+    head = (f'<!DOCTYPE html><html><head><meta charset="utf-8">'
+            f'<script>{"var x = 1;" * 200}</script><title>{TITLE}</title>'
+            f'<link rel="stylesheet" href="/style.css"></head><body>').encode()
+    block = b'<div class="card"><img src="/image.png"><p>' + b'Lorem ipsum dolor sit amet. ' * 30 + b'</p></div>\n'
+    body = block * max(1, (size - len(head)) // len(block))
+    return head + body + b'</body></html>'
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    pages = {}
+
+    def do_GET(self):
+        page = self.pages[int(self.path.strip('/'))]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(page)))
+        self.end_headers()
+        try:
+            for i in range(0, len(page), 64 * 1024):
+                self.wfile.write(page[i:i + 64 * 1024])
+        except (BrokenPipeError, ConnectionResetError):
+            # The streaming extractor hung up early
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def full_parse(url: str) -> str:
+    res = requests.get(url)
+    soup = BeautifulSoup(res.content, 'html.parser')
+    return soup.find('title').text
+
+
+def streaming(url: str) -> str:
+    return http_client.fetch_title(url)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 2_000_000, 8_000_000])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    FixtureHandler.pages = {size: make_page(size) for size in args.sizes}
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    print(f'{"page size":>12} {"method":>12} {"median ms":>10} {"p95 ms":>8}')
+    for size in args.sizes:
+        url = f'{base_url}/{size}'
+        for name, func in (('full parse', full_parse), ('streaming', streaming)):
+            # Warm up and check the result
+            assert func(url) == 'Fixture page & a title – ünïcödé', func(url)
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                func(url)
+                times.append((time.perf_counter() - start) * 1000)
+            times.sort()
+            p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+            print(f'{size:>12} {name:>12} {statistics.median(times):>10.2f} {p95:>8.2f}')
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
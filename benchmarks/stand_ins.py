@@ -0,0 +1,280 @@
+"""
+Local stand-ins for the services the Analyzer uses.
+
+Every page reproduces the parts of the DOM the stage relies on (the same ids, names and XPaths),
+and the API endpoints answer with canned data, so the whole pipeline can run offline.
+
+    python benchmarks/stand_ins.py [--port 8021] [--latency 0.05] [--stall-every 10 --stall 5]
+
+prints the environment variables that point the Analyzer to the stand-ins and serves until interrupted.
+"""
+import json
+import time
+import zlib
+import struct
+import threading
+import urllib.parse
+
+from typing import Dict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+RESPONSIVE_PAGE = '''<!DOCTYPE html>
+<html><head><title>Am I Responsive?</title></head>
+<body>
+<main role="main" style="display: block; background: #eee; height: 900px">
+  <form onsubmit="event.preventDefault(); show(this.site.value);">
+    <input name="site" type="text"><button type="submit">GO</button>
+  </form>
+  <div class="devices">
+    <blockquote>Ad banner</blockquote>
+    <iframe id="desktop" style="width: 640px; height: 400px; border: 12px solid #333"></iframe>
+    <iframe id="mobile" style="width: 160px; height: 300px; border: 8px solid #333"></iframe>
+  </div>
+</main>
+<script>
+function show(site) {
+  document.getElementById('desktop').src = site;
+  document.getElementById('mobile').src = site;
+}
+</script>
+</body></html>'''
+
+GTMETRIX_PAGE = '''<!DOCTYPE html>
+<html><head><title>GTmetrix</title></head>
+<body>
+<div id="page">
+  <header>
+    <ul><li id="user-nav-login"><a href="#" onclick="showLogin(); return false;">Log In</a></li></ul>
+    <div id="menu-site-nav">
+      <div></div>
+      <div><div>
+        <form id="login" style="display: none" onsubmit="return false;">
+          <div><input name="email" type="email"></div>
+          <div><input name="password" type="password"></div>
+          <div></div>
+          <div><button type="button" onclick="logIn()">Log In</button></div>
+        </form>
+      </div></div>
+    </div>
+  </header>
+  <main><article>
+    <form onsubmit="return false;">
+      <div>
+        <div><div><input name="url" type="url"></div></div>
+        <div><button type="button" onclick="analyze()">Test your site</button></div>
+      </div>
+    </form>
+  </article></main>
+</div>
+<script>
+function showLogin() { document.getElementById('login').style.display = 'block'; }
+function logIn() {
+  document.getElementById('login').style.display = 'none';
+  document.cookie = 'session=stand-in; path=/; max-age=86400';
+  document.getElementById('user-nav-login').remove();
+}
+// Logged-in users don't see the login link
+if (document.cookie.includes('session=')) { document.getElementById('user-nav-login').remove(); }
+function analyze() {
+  const article = document.querySelector('main article');
+  const url = article.querySelector('input').value;
+  const heading = document.createElement('h1');
+  heading.textContent = 'Analyzing ' + url;
+  article.prepend(heading);
+  setTimeout(() => {
+    article.innerHTML = '<h2>Performance Report for: ' + url + '</h2>' +
+      '<div style="display: flex"><div style="width: 300px; height: 200px; background: #4a4">A</div>' +
+      '<div style="width: 300px; height: 200px; background: #aa4">90%%</div></div>';
+    const banner = document.createElement('div');
+    banner.id = 'summer';
+    banner.textContent = 'Summer sale!';
+    document.body.prepend(banner);
+  }, %(analyze_ms)d);
+}
+</script>
+</body></html>'''
+
+BACKLINKS_PAGE = '''<!DOCTYPE html>
+<html><head><title>Inbound Link Checker</title></head>
+<body>
+<div id="cookiePopup">We use cookies</div>
+<div id="frm-wrap">
+  <form onsubmit="event.preventDefault(); check(this.url.value);"><input name="url" type="text"></form>
+</div>
+<div id="result" style="height: 600px"></div>
+<script>
+function check(url) {
+  const rows = [];
+  for (let i = 1; i <= 10; i++) rows.push('<tr><td>https://linking-site-' + i + '.example/</td><td>' + i + '</td></tr>');
+  document.getElementById('result').innerHTML = '<h2>' + url + '</h2><table>' + rows.join('') + '</table>';
+}
+</script>
+</body></html>'''
+
+SITE_PAGE = '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Stand-in Site %(id)s</title></head>
+<body><h1>Stand-in site %(id)s</h1>%(padding)s</body></html>'''
+
+
+def make_png(width: int, height: int, color=(200, 30, 30)) -> bytes:
+    """Makes a solid-color RGB PNG without any imaging library."""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    row = b'\x00' + bytes(color) * width
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(row * height)) + chunk(b'IEND', b''))
+
+
+API_ROUTES = ('ip-api', 'flag', 'favicon', 'rdap')
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    analyze_ms = 1500
+    # Every `stall_every`th request to the APIs takes `stall` seconds longer (like a congested upstream)
+    stall_every = 0
+    stall = 0.0
+    site_padding = 50_000
+    requests: Dict[str, int] = {}
+    _lock = threading.Lock()
+
+    def _send(self, body: bytes, content_type: str, status: int = 200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+        url = urllib.parse.urlsplit(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        route = parts[0] if parts else ''
+        with self._lock:
+            StandInHandler.requests[route] = count = StandInHandler.requests.get(route, 0) + 1
+        if self.stall_every and route in API_ROUTES and count % self.stall_every == 0:
+            time.sleep(self.stall)
+
+        try:
+            if route == 'amiresponsive':
+                self._send(RESPONSIVE_PAGE.encode(), 'text/html; charset=utf-8')
+            elif route == 'gtmetrix':
+                self._send((GTMETRIX_PAGE % {'analyze_ms': self.analyze_ms}).encode(), 'text/html; charset=utf-8')
+            elif route == 'backlinks':
+                self._send(BACKLINKS_PAGE.encode(), 'text/html; charset=utf-8')
+            elif route == 'site':
+                page = SITE_PAGE % {'id': parts[1] if len(parts) > 1 else '0',
+                                    'padding': '<p>' + 'Lorem ipsum dolor sit amet. ' * (self.site_padding // 28)}
+                self._send(page.encode(), 'text/html; charset=utf-8')
+            elif route == 'ip-api':
+                domain = parts[-1] if len(parts) > 2 else 'localhost'
+                self._send(json.dumps({
+                    'status': 'success', 'query': '127.0.0.1', 'reverse': 'localhost', 'country': 'Iran',
+                    'countryCode': 'IR', 'city': 'Tehran', 'domain': domain,
+                }).encode(), 'application/json')
+            elif route == 'flag':
+                self._send(make_png(640, 480), 'image/png')
+            elif route == 'favicon':
+                self._send(make_png(16, 16, (30, 30, 200)), 'image/png')
+            elif route == 'rdap':
+                self._send(json.dumps({
+                    'objectClassName': 'domain', 'ldhName': parts[-1] if len(parts) > 2 else 'example.com',
+                    'status': ['client transfer prohibited'],
+                    'nameservers': [{'ldhName': 'ns1.example.com'}, {'ldhName': 'ns2.example.com'}],
+                    'events': [
+                        {'eventAction': 'registration', 'eventDate': '2010-05-04T10:00:00Z'},
+                        {'eventAction': 'expiration', 'eventDate': '2030-05-04T10:00:00Z'},
+                        {'eventAction': 'last changed', 'eventDate': '2024-01-02T03:04:05Z'},
+                    ],
+                }).encode(), 'application/rdap+json')
+            else:
+                self._send(b'Not Found', 'text/plain', 404)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class StandIns:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, analyze_ms: int = 1500,
+                 stall_every: int = 0, stall: float = 0.0):
+        """
+        Serves the stand-ins on a background thread.
+
+        :param host: Address to listen on
+        :param port: Port to listen on (0 for a free port)
+        :param latency: Seconds to wait before answering every request
+        :param analyze_ms: How long the GTMetrix stand-in "analyzes" a site
+        :param stall_every: Every this many requests to each API stall (0 for never)
+        :param stall: Extra seconds a stalled request takes
+        """
+        StandInHandler.latency = latency
+        StandInHandler.analyze_ms = analyze_ms
+        StandInHandler.stall_every = stall_every
+        StandInHandler.stall = stall
+        StandInHandler.requests = {}
+        self.server = ThreadingHTTPServer((host, port), StandInHandler)
+        self.server.daemon_threads = True
+        self.base_url = f'http://{host}:{self.server.server_port}'
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def environment(self) -> Dict[str, str]:
+        """The environment variables that point the Analyzer to the stand-ins."""
+        return {
+            'AMIRESPONSIVE_URL': f'{self.base_url}/amiresponsive/',
+            'GTMETRIX_URL': f'{self.base_url}/gtmetrix/',
+            'BACKLINKS_URL': f'{self.base_url}/backlinks/',
+            'IP_API_URL': self.base_url + '/ip-api/json/{domain}',
+            'FLAG_URL': self.base_url + '/flag/png/{country_code}',
+            'FAVICON_URL': self.base_url + '/favicon?domain={url}',
+            'RDAP_URL': self.base_url + '/rdap/domain/{domain}',
+            'EMAIL': 'bench@example.com',
+            'PASSWORD': 'bench',
+        }
+
+    def site_url(self, i: int = 0) -> str:
+        """URL of a stand-in website to analyze."""
+        return f'{self.base_url}/site/{i}'
+
+    def start(self) -> 'StandIns':
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8021)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--stall-every', type=int, default=0)
+    parser.add_argument('--stall', type=float, default=0.0)
+    args = parser.parse_args()
+
+    stand_ins = StandIns(args.host, args.port, args.latency, stall_every=args.stall_every, stall=args.stall)
+    for key, value in stand_ins.environment().items():
+        print(f'{key}={value}')
+    print(f'# Example site: {stand_ins.site_url()}')
+    try:
+        stand_ins.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import io
+import os
+import base64
+import tempfile
+
+from typing import Optional, Tuple, Union
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from PIL import Image
+
+from tracing import tracer, in_context
+
+# How to take the screenshots
+FULL = 'full'  # Screenshot the whole window as bytes and crop it in memory
+CLIP = 'clip'  # Let Chrome capture only the target rectangle (Chrome DevTools Protocol)
+METHODS = (FULL, CLIP)
+
+Box = Tuple[int, int, int, int]
+
+
+def _write_atomic(path: str, data: Union[bytes, Image.Image]):
+    with tracer.span('encode', image=os.path.basename(path)):
+        _write(path, data)
+
+
+def _write(path: str, data: Union[bytes, Image.Image]):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            if isinstance(data, Image.Image):
+                data.save(file, 'PNG')
+            else:
+                file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+class ImageWriter:
+    def __init__(self, background: bool = True):
+        """
+        Saves images as PNG, either right away or on a background thread.
+
+        :param background: If True, `save` returns immediately and the encoding happens on another thread
+        """
+        self.background = background
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def save(self, data: Union[bytes, Image.Image], path: Union[str, os.PathLike]) -> Future:
+        """
+        Saves an image (or already encoded PNG bytes).
+
+        :param data: The image or the PNG bytes
+        :param path: Path of the file
+        :return: A future that is done when the file is written
+        """
+        path = os.fspath(path)
+        if not self.background:
+            future = Future()
+            try:
+                _write_atomic(path, data)
+                future.set_result(path)
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ImageWriter')
+        return self._executor.submit(in_context(lambda: _write_atomic(path, data) or path))
+
+    def close(self):
+        """Waits for the pending images and stops the background thread."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+def capture(driver, path: Union[str, os.PathLike], box: Box, method: str = FULL,
+            writer: ImageWriter = None) -> Future:
+    """
+    Saves a region of the current window as a PNG with a single encode.
+
+    :param driver: The driver
+    :param path: Path of the image
+    :param box: The (left, upper, right, lower) region of the window in screenshot pixels
+    :param method: `full` crops a full-window screenshot in memory, `clip` asks Chrome for the region only
+    :param writer: The ImageWriter to save the image with (defaults to saving right away)
+    :return: A future that is done when the file is written
+    """
+    writer = writer or ImageWriter(background=False)
+
+    with tracer.span('screenshot', image=os.path.basename(path), method=method):
+        data = _screenshot(driver, box, method)
+
+    return writer.save(data, path)
+
+
+def _screenshot(driver, box: Box, method: str) -> Union[bytes, Image.Image]:
+    if method == CLIP:
+        scroll_x, scroll_y, ratio = driver.execute_script(
+            'return [window.scrollX, window.scrollY, window.devicePixelRatio]')
+        left, upper, right, lower = box
+        # The clip is in CSS pixels of the page, not of the window
+        clip = {
+            'x': left / ratio + scroll_x,
+            'y': upper / ratio + scroll_y,
+            'width': (right - left) / ratio,
+            'height': (lower - upper) / ratio,
+            'scale': 1,
+        }
+        result = driver.execute_cdp_cmd('Page.captureScreenshot', {'format': 'png', 'clip': clip})
+        return base64.b64decode(result['data'])
+
+    if method != FULL:
+        raise ValueError(f'Unknown capture method: {method}')
+
+    image = Image.open(io.BytesIO(driver.get_screenshot_as_png()))
+    return image.crop(box)
@@ -0,0 +1,410 @@
+"""
+Renders the WHOIS, AMP and SSL cards from structured records, without any network access.
+
+The Analyzer gathers a CardRecord while it runs and saves it as `card.json` in the output directory,
+so the cards of past runs can be rendered again (e.g. after a template change) without repeating the lookups:
+
+    python cards.py -i save/ [-c whois amp ssl] [-w 4]
+
+renders the cards of every `card.json` under `save/` (or of the records of a JSON lines file) into new
+output directories, on a process pool that shares the decoded templates.
+"""
+import io
+import os
+import sys
+import json
+import time
+import base64
+import functools
+import urllib.parse
+import multiprocessing
+
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+import log21
+
+from PIL import Image, ImageDraw
+
+import asset_registry
+from asset_registry import get_image, get_font, get_flag
+from output_store import OutputStore, get_store
+
+logger = log21.get_logger()
+
+RECORD_NAME = 'card.json'
+# Fields that hold images (PNG or any format Pillow reads); they are base64 in the JSON of a record
+BINARY_FIELDS = ('flag', 'favicon')
+
+# Per-process state of the render workers
+_store: Optional[OutputStore] = None
+
+
+class CardRecord:
+    FIELDS = ('url', 'register_status', 'name_servers', 'dates', 'ip_address', 'hosted_website', 'ip_location',
+              'country_code', 'title', 'page_title', 'flag', 'favicon', 'cards')
+
+    def __init__(self, url: str, register_status: str = '', name_servers: str = '', dates: str = '',
+                 ip_address: str = '', hosted_website: str = '', ip_location: str = '', country_code: str = '',
+                 title: str = '', page_title: str = '', flag: bytes = None, favicon: bytes = None,
+                 cards: Iterable[str] = ()):
+        """
+        Everything the cards of a website show.
+
+        :param url: URL of the website
+        :param register_status: Registrar status from WHOIS
+        :param name_servers: Name servers (one per line)
+        :param dates: Registration, expiration and update dates (one per line)
+        :param ip_address: IP address of the domain
+        :param hosted_website: Reverse DNS name of the IP address
+        :param ip_location: Country (and city) of the IP address
+        :param country_code: ISO code of the country of the IP address (its flag is taken from the flag atlas)
+        :param title: Title of the home page (WHOIS card)
+        :param page_title: Title of the page as the browser shows it (SSL card)
+        :param flag: The full-size country flag image, for the countries the flag atlas doesn't have
+        :param favicon: The favicon image
+        :param cards: The cards the record has the data of
+        """
+        self.url = url
+        self.register_status = register_status
+        self.name_servers = name_servers
+        self.dates = dates
+        self.ip_address = ip_address
+        self.hosted_website = hosted_website
+        self.ip_location = ip_location
+        self.country_code = country_code
+        self.title = title
+        self.page_title = page_title
+        self.flag = flag
+        self.favicon = favicon
+        self.cards = list(cards)
+
+    @property
+    def domain(self) -> str:
+        return urllib.parse.urlsplit(self.url).netloc
+
+    @property
+    def scheme(self) -> str:
+        return urllib.parse.urlsplit(self.url).scheme
+
+    def to_dict(self) -> dict:
+        data = {field: getattr(self, field) for field in self.FIELDS}
+        for field in BINARY_FIELDS:
+            if data[field] is not None:
+                data[field] = base64.b64encode(data[field]).decode('ascii')
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'CardRecord':
+        data = {field: data[field] for field in cls.FIELDS if data.get(field) is not None}
+        for field in BINARY_FIELDS:
+            if field in data:
+                data[field] = base64.b64decode(data[field])
+        # A record without `cards` has the data of all of them
+        data.setdefault('cards', CARDS)
+        return cls(**data)
+
+    def merge(self, other: 'CardRecord', card: str):
+        """
+        Copies the data of a card from another record of the website (e.g. the record of a run whose output is reused).
+
+        :param other: The other record
+        :param card: `whois`, `amp` or `ssl`
+        :raise ValueError: If the other record doesn't have the data of the card
+        """
+        if card not in other.cards:
+            raise ValueError(f'The record has no {card} card')
+        for field in CARD_FIELDS[card]:
+            setattr(self, field, getattr(other, field))
+        if card not in self.cards:
+            self.cards.append(card)
+
+    def save(self, path: Union[str, os.PathLike]):
+        """Writes the record as JSON (e.g. to `<output directory>/card.json`)."""
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.to_dict(), file)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: Union[str, os.PathLike]) -> 'CardRecord':
+        with open(path, 'r', encoding='utf-8') as file:
+            return cls.from_dict(json.load(file))
+
+    def __repr__(self):
+        return f'CardRecord({self.url!r}, cards={self.cards})'
+
+
+# Number of decoded flags and favicons kept (the same few flags are on most of the cards)
+IMAGE_CACHE_SIZE = 256
+
+
+@functools.lru_cache(maxsize=IMAGE_CACHE_SIZE)
+def open_image(data: bytes, scale: int = 1) -> Image.Image:
+    """
+    Decodes an image of a record (the images are only pasted, so the decoded ones are shared).
+
+    :param data: The encoded image
+    :param scale: Shrink the image by this factor
+    :return: The RGBA image
+    """
+    image = Image.open(io.BytesIO(data)).convert('RGBA')
+    if scale != 1:
+        image = image.resize((image.width // scale, image.height // scale))
+    return image
+
+
+def render_whois(record: CardRecord) -> Image.Image:
+    """
+    Draws the WHOIS card: the registration, the name servers, the IP, its location and the title of the website.
+
+    :param record: The record
+    :return: The card
+    """
+    # Load raw whois image
+    whois_image = get_image('whois')
+
+    # Make image editable
+    editable = ImageDraw.Draw(whois_image)
+
+    # Load fonts
+    font = get_font('Lato-Regular', 10)
+    domain_font = get_font('Lato-Regular', 20)
+    title_font = get_font('Vazirmatn-Regular', 10)
+
+    # Set colors
+    color = (90, 90, 90)
+    domain_color = (70, 70, 70)
+
+    # Add text to raw image
+    editable.text((165, 0), record.domain, domain_color, font=domain_font)  # Domain name
+    editable.text((120, 65), record.register_status, color, font=font)  # Registrar status
+    editable.text((120, 90), record.name_servers, color, font=font)  # Name servers
+    editable.text((120, 152), record.dates, color, font=font)  # Dates
+    editable.text((120, 250), record.ip_address, color, font=font)  # IP address
+    editable.text((195, 250), record.hosted_website, color, font=font)  # Hosted websites
+    editable.text((140, 273), record.ip_location, color, font=font)  # IP location
+    editable.text((120, 330), record.title, color, font=title_font)  # Website title
+
+    # Add the flag, cut out of the flag atlas or resized for the card
+    flag = get_flag(record.country_code)
+    if flag is None and record.flag:
+        flag = open_image(record.flag, 20)
+    if flag is not None:
+        whois_image.paste(flag, (120, 275), flag)
+
+    return whois_image
+
+
+def render_amp(record: CardRecord) -> Image.Image:
+    """
+    Draws the AMP card: the URL of the website.
+
+    :param record: The record
+    :return: The card
+    """
+    # Load the raw image
+    raw_amp = get_image('AMP')
+
+    # Make image editable
+    image_editable = ImageDraw.Draw(raw_amp)
+
+    # Put the URL in image
+    image_editable.text((80, 28), record.url, (255, 255, 255), font=get_font('Roboto-Medium', 21))
+
+    return raw_amp
+
+
+def render_ssl(record: CardRecord) -> Image.Image:
+    """
+    Draws the SSL card: a browser tab with the favicon, the title and the URL (with or without the lock).
+
+    :param record: The record
+    :return: The card
+    """
+    protocol = record.scheme
+
+    # Load the raw image
+    raw_https = get_image(protocol, "RGBA")
+
+    # Paste favicon on https raw image
+    if record.favicon:
+        favicon = open_image(record.favicon)
+        raw_https.paste(favicon, (17, 8), favicon)
+
+    # Make https raw image editable
+    editable = ImageDraw.Draw(raw_https)
+
+    # Add Font to our text
+    font = get_font('Vazirmatn-Regular', 14)
+
+    # Draw URL text in the raw image
+    url_coordination = (172, 42) if protocol == 'https' else (260, 42)
+    editable.text(url_coordination, record.url, (255, 255, 255), font=font)
+
+    # Draw the title of the page in the tab
+    title = record.page_title
+    title = (title[:20] + '...') if len(title) > 20 else title
+    editable.text((41, 7), title, (255, 255, 255), font=font)
+
+    return raw_https
+
+
+# Name, output file and renderer of every card
+CARD_RENDERERS: Dict[str, Tuple[str, Callable[[CardRecord], Image.Image]]] = {
+    'whois': ('whois.png', render_whois),
+    'amp': ('AMP.png', render_amp),
+    'ssl': ('ssl.png', render_ssl),
+}
+CARDS = tuple(CARD_RENDERERS)
+# The fields of the record every card shows besides the URL
+CARD_FIELDS: Dict[str, Tuple[str, ...]] = {
+    'whois': ('register_status', 'name_servers', 'dates', 'ip_address', 'hosted_website', 'ip_location',
+              'country_code', 'title', 'flag'),
+    'amp': (),
+    'ssl': ('page_title', 'favicon'),
+}
+
+
+def render_card(record: CardRecord, card: str, directory: Union[str, os.PathLike]) -> str:
+    """
+    Renders a card and saves it in a directory.
+
+    :param record: The record
+    :param card: `whois`, `amp` or `ssl`
+    :param directory: The directory (e.g. the output directory of a run)
+    :return: Path of the image
+    """
+    filename, renderer = CARD_RENDERERS[card]
+    path = os.path.join(directory, filename)
+    renderer(record).save(path, format='png')
+    return path
+
+
+def _init_renderer(root: Optional[str]):
+    global _store
+    _store = OutputStore(root) if root else get_store()
+
+
+def _render(job: Tuple[int, dict, Tuple[str, ...]]) -> dict:
+    """
+    Renders the cards of a record in a new output directory.
+
+    :param job: Index of the record, the record as a dictionary and the cards to render
+    :return: The result of the record
+    """
+    index, data, cards = job
+    start = time.perf_counter()
+    result = {'index': index, 'url': data.get('url'), 'cards': []}
+    try:
+        record = CardRecord.from_dict(data)
+        name = record.domain.replace(':', '_') or 'Analyzer'
+        result['saved_path'] = path = _store.reserve(name, record.url)
+        for card in cards:
+            if card in record.cards:
+                render_card(record, card, path)
+                result['cards'].append(card)
+        result['status'] = 'ok'
+    except Exception as e:
+        result.update(status='failed', error=f'{e.__class__.__name__}: {str(e)}')
+    result['seconds'] = round(time.perf_counter() - start, 4)
+    return result
+
+
+def render_records(records: Iterable[CardRecord], cards: Iterable[str] = CARDS, workers: int = None,
+                   root: Union[str, os.PathLike] = None, chunk_size: int = 16) -> Iterator[dict]:
+    """
+    Renders the cards of many records on a process pool.
+    The templates and fonts are decoded once, before the workers are forked, so they share them.
+    Every record gets a new output directory in the output store, written as soon as its cards are rendered.
+
+    :param records: The records
+    :param cards: The cards to render (a record only gets the cards it has the data of)
+    :param workers: Number of processes (defaults to the number of CPUs; 1 renders in this process)
+    :param root: Root directory of the output store (defaults to `OUTPUT_ROOT`)
+    :param chunk_size: Number of records sent to a worker at once
+    :return: Yields the results of the records in the order they are finished
+    """
+    cards = tuple(cards)
+    for card in cards:
+        if card not in CARD_RENDERERS:
+            raise ValueError(f'Unknown card: {card}')
+    jobs = ((i, record.to_dict(), cards) for i, record in enumerate(records))
+    workers = workers or os.cpu_count() or 1
+
+    asset_registry.preload()
+    if workers == 1:
+        _init_renderer(os.fspath(root) if root else None)
+        yield from map(_render, jobs)
+        return
+
+    with multiprocessing.Pool(workers, initializer=_init_renderer,
+                              initargs=(os.fspath(root) if root else None,)) as pool:
+        yield from pool.imap_unordered(_render, jobs, chunk_size)
+
+
+def read_records(paths: Iterable[Union[str, os.PathLike]]) -> Iterator[CardRecord]:
+    """
+    Reads records from `card.json` files, directories (searched for `card.json` files) and JSON lines files.
+
+    :param paths: The paths
+    :return: Yields the records
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in sorted(os.walk(path)):
+                if RECORD_NAME in names:
+                    yield CardRecord.load(os.path.join(directory, RECORD_NAME))
+        elif os.path.basename(path) == RECORD_NAME:
+            yield CardRecord.load(path)
+        else:
+            with open(path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    if line.strip():
+                        yield CardRecord.from_dict(json.loads(line))
+
+
+def main():
+    parser = log21.ColorizingArgumentParser()
+    parser.add_argument('-i', '--input', help='Output directories, card.json files or JSON lines files of records',
+                        nargs='*', required=True, metavar='PATH')
+    parser.add_argument('-c', '--cards', help=f'Cards to render ({", ".join(CARDS)})', nargs='*', choices=CARDS,
+                        default=list(CARDS), metavar='CARD')
+    parser.add_argument('-w', '--workers', help='Number of worker processes', type=int)
+    parser.add_argument('-o', '--output', help='Root directory of the new output directories (defaults to '
+                        'OUTPUT_ROOT)')
+    parser.add_argument('-v', '--verbose', help='Verbose mode', action='store_true')
+    args = parser.parse_args()
+
+    if not args.input:
+        parser.error('-i/--input needs at least one path')
+    if not args.cards:
+        parser.error('-c/--cards needs at least one card')
+    if args.workers is not None and args.workers < 1:
+        parser.error('Number of workers must be at least 1')
+    if args.verbose:
+        log21.basic_config(level=log21.DEBUG)
+
+    start = time.perf_counter()
+    statuses: Dict[str, int] = {}
+    rendered = 0
+    for result in render_records(read_records(args.input), args.cards, args.workers, args.output):
+        statuses[result['status']] = statuses.get(result['status'], 0) + 1
+        rendered += len(result['cards'])
+        if result['status'] == 'ok':
+            log21.debug(f"{result['url']}: {', '.join(result['cards'])} -> {result['saved_path']}")
+        else:
+            logger.error(f"{result['url']}: {result['error']}")
+    seconds = time.perf_counter() - start
+
+    logger.info(f'Rendered {rendered} cards of {sum(statuses.values())} records in {seconds:.2f} seconds '
+                f'({rendered / seconds if seconds else 0:.1f} cards/s): '
+                + (', '.join(f'{count} {status}' for status, count in statuses.items()) or 'no records'))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        logger.clear_line()
+        logger.error("KeyboardInterrupt: Exiting...")
+        sys.exit(0)
@@ -0,0 +1,222 @@
+"""
+Time budgets for the analysis.
+
+A budget is entered with `budget(seconds)` and applies to everything that runs in its context (including
+functions bound with `tracing.in_context` on other threads). Nested budgets never outlive the outer ones.
+The blocking calls (page loads, element waits, HTTP requests) ask `limit(timeout)` how long they may take,
+so a stage stops by itself when its time is up instead of blocking its worker.
+"""
+import time
+import threading
+import contextvars
+
+from typing import Callable, Optional, Tuple, TypeVar, Union
+from contextlib import contextmanager
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+import log21
+
+from tracing import tracer, in_context
+
+T = TypeVar('T')
+Timeout = Union[None, float, Tuple[float, float]]
+
+# The shortest timeout a call gets while its budget isn't spent (so it can still fail with its own error)
+MIN_TIMEOUT = 0.1
+_current: contextvars.ContextVar[Optional['Deadline']] = contextvars.ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class Deadline:
+    def __init__(self, seconds: Optional[float], label: str = 'deadline', parent: 'Deadline' = None):
+        """
+        A point in time some work must be finished by.
+
+        :param seconds: The budget in seconds from now (None for no limit of its own)
+        :param label: Name of the budget for the errors
+        :param parent: The enclosing deadline; the earlier of the two applies
+        """
+        self.seconds = seconds
+        self.label = label
+        self.expires = None if seconds is None else time.monotonic() + seconds
+        # An outer deadline that expires first is the one that is reported
+        if parent is not None and parent.expires is not None and (self.expires is None
+                                                                   or parent.expires < self.expires):
+            self.seconds = parent.seconds
+            self.label = parent.label
+            self.expires = parent.expires
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left (None if there's no limit)."""
+        return None if self.expires is None else self.expires - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.expires is not None and time.monotonic() >= self.expires
+
+    def check(self):
+        """
+        :raise DeadlineExceeded: If the deadline has passed
+        """
+        if self.expired:
+            raise DeadlineExceeded(f'{self.label}: the budget of {self.seconds:g} seconds is spent')
+
+    def limit(self, timeout: Optional[float]) -> Optional[float]:
+        """
+        Shortens a timeout to the time left.
+
+        :param timeout: The timeout of the call (None for no limit)
+        :return: The timeout the call gets
+        :raise DeadlineExceeded: If the deadline has passed
+        """
+        self.check()
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        remaining = max(remaining, MIN_TIMEOUT)
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def __repr__(self):
+        return f'Deadline({self.label!r}, remaining={self.remaining()})'
+
+
+def current() -> Optional[Deadline]:
+    """Gets the deadline of the current context."""
+    return _current.get()
+
+
+@contextmanager
+def budget(seconds: Optional[float], label: str = 'deadline'):
+    """
+    Runs the enclosed code under a time budget (nested in the current one).
+
+    :param seconds: The budget in seconds (None only keeps the current deadline)
+    :param label: Name of the budget for the errors
+    """
+    deadline = Deadline(seconds, label, current())
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def unbounded():
+    """Runs the enclosed code without a deadline (e.g. the clean-up after a deadline has passed)."""
+    token = _current.set(None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def limit(timeout: Timeout) -> Timeout:
+    """
+    Shortens a timeout (or a `(connect, read)` timeout of requests) to the time left in the current context.
+
+    :param timeout: The timeout of the call
+    :return: The timeout the call gets
+    :raise DeadlineExceeded: If the deadline has passed
+    """
+    deadline = current()
+    if deadline is None:
+        return timeout
+    if isinstance(timeout, tuple):
+        return tuple(deadline.limit(part) for part in timeout)
+    return deadline.limit(timeout)
+
+
+def check():
+    """
+    :raise DeadlineExceeded: If the deadline of the current context has passed
+    """
+    deadline = current()
+    if deadline is not None:
+        deadline.check()
+
+
+def _start(func: Callable[[], T]) -> Future:
+    """
+    Calls a function on a thread of its own.
+    (The copies that lose the race may be stuck for a long time, so they don't hold the threads of a pool.)
+    """
+    future = Future()
+    func = in_context(func)
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func())
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name='hedge', daemon=True).start()
+    return future
+
+
+def bounded(func: Callable[[], T], timeout: Optional[float], label: str = 'call') -> T:
+    """
+    Calls a blocking function that takes no timeout of its own (e.g. `socket.getaddrinfo`) on a thread of its own
+    and waits for it no longer than the timeout (shortened to the time left in the current context).
+    A call that doesn't answer in time is left running and its result is ignored.
+
+    :param func: The function (without arguments)
+    :param timeout: Seconds to wait for the call (None for no limit of its own)
+    :param label: Name of the call for the errors
+    :return: The result of the call
+    :raise DeadlineExceeded: If the call doesn't answer in time
+    """
+    timeout = limit(timeout)
+    future = _start(func)
+    if not wait([future], timeout).done:
+        raise DeadlineExceeded(f'{label}: no answer after {timeout:g} seconds')
+    return future.result()
+
+
+def hedged(func: Callable[[], T], hedge_after: float, copies: int = 2, label: str = 'request') -> T:
+    """
+    Calls an idempotent function and, if it hasn't answered after `hedge_after` seconds (or has failed),
+    calls it again; the first successful answer wins and the slower copies are ignored.
+    Only use it for calls that are safe to repeat (e.g. lookups).
+
+    :param func: The function (without arguments)
+    :param hedge_after: Seconds to wait for a copy before starting the next one
+    :param copies: Maximum number of calls
+    :param label: Name of the call for the logs and the spans
+    :return: The result of the first successful copy
+    :raise DeadlineExceeded: If the deadline passes before any copy has answered
+    """
+    start = last = time.perf_counter()
+    futures = [_start(func)]
+    try:
+        while True:
+            for i, future in enumerate(futures):
+                if future.done() and future.exception() is None:
+                    outcome = 'ok' if i == 0 else f'copy {i + 1} won'
+                    tracer.record('hedge', time.perf_counter() - start, outcome, label=label, copies=len(futures))
+                    return future.result()
+
+            pending = [future for future in futures if not future.done()]
+            if not pending and len(futures) >= copies:
+                raise futures[-1].exception()
+            # Another copy when all the copies have failed or the last one hasn't answered in time
+            if len(futures) < copies and (not pending or time.perf_counter() - last >= hedge_after):
+                check()
+                log21.debug(f'{label}: sending another request after {time.perf_counter() - start:.2f} seconds')
+                futures.append(_start(func))
+                last = time.perf_counter()
+                continue
+
+            timeout = max(0.0, hedge_after - (time.perf_counter() - last)) if len(futures) < copies else None
+            deadline = current()
+            if deadline is not None:
+                timeout = deadline.limit(timeout)
+            wait(pending, timeout, FIRST_COMPLETED)
+    finally:
+        for future in futures:
+            future.cancel()
@@ -1,16 +1,92 @@
 import re
 import os
+import stat
+import shutil
+import hashlib
 import zipfile
 import platform
 
 import requests
 
-from typing import Tuple, Union, Callable
+from typing import Optional, Tuple, Union, Callable
+from contextlib import contextmanager
 
-from bs4 import BeautifulSoup
+from decouple import config
+
+import endpoints
+from lookup_cache import user_cache_dir
 
 latest_version_pattern = re.compile(r'Latest stable release: ChromeDriver (\d+\.\d+\.\d+\.\d+)')
 
+# Versioned drivers are kept in `<CACHE_DIR>/<version>/<platform>/`
+CACHE_DIR = config('CHROMEDRIVER_CACHE', default=os.path.join(user_cache_dir(), 'chromedriver'))
+# A directory with `<version>/<zip name>` files (and optional `.sha256` files next to them) to install from offline
+MIRROR_DIR = config('CHROMEDRIVER_MIRROR', default='')
+# Install this version instead of looking up the latest one
+PINNED_VERSION = config('CHROMEDRIVER_VERSION', default='')
+# Link (or, where links are not supported, file containing the path) to the driver in use
+CURRENT_NAME = 'current'
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def _zip_name() -> str:
+    # Windows
+    if platform.system() == 'Windows':
+        return 'chromedriver_win32.zip'
+    # Linux
+    elif platform.system() == 'Linux':
+        return 'chromedriver_linux64.zip'
+    # Mac
+    elif platform.system() == 'Darwin':
+        return 'chromedriver_mac64.zip'
+    raise Exception(f'Unsupported platform: {platform.system()}! Please download ChromeDriver manually.')
+
+
+def _executable_name() -> str:
+    return 'chromedriver.exe' if platform.system() == 'Windows' else 'chromedriver'
+
+
+def file_sha256(path: Union[str, os.PathLike]) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextmanager
+def file_lock(path: Union[str, os.PathLike]):
+    """
+    Holds an exclusive lock on a file, so only one process (e.g. one of the batch workers) installs a driver.
+
+    :param path: Path of the lock file
+    """
+    with open(path, 'a+b') as file:
+        if os.name == 'nt':
+            import msvcrt
+
+            while True:
+                try:
+                    file.seek(0)
+                    msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after 10 seconds
+                    pass
+            try:
+                yield
+            finally:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
 
 def get_chrome_driver_latest_version() -> Union[None, str]:
     """
@@ -18,8 +94,9 @@ def get_chrome_driver_latest_version() -> Union[None, str]:
 
     :return: The latest version of Chrome Driver.
     """
-    url = 'https://chromedriver.chromium.org/'
-    res = requests.get(url)
+    from bs4 import BeautifulSoup
+
+    res = requests.get(endpoints.CHROMEDRIVER_VERSION_URL)
     soup = BeautifulSoup(res.text, 'html.parser')
     for a in soup.find_all('a'):
         if 'ChromeDriver' in a.text:
@@ -27,61 +104,230 @@ def get_chrome_driver_latest_version() -> Union[None, str]:
                 return version.group(1)
 
 
-def download_chrome_driver(path: Union[str, os.PathLike] = None, remove_zip: bool = False,
-                           progress_callback: Callable = lambda downloaded, total_size: None) -> Tuple[str, str]:
+def _version_key(version: str) -> Tuple[int, ...]:
+    return tuple(int(part) for part in version.split('.') if part.isdigit())
+
+
+def get_mirror_version(mirror: Union[str, os.PathLike] = MIRROR_DIR) -> Optional[str]:
     """
-    Download the latest version of Chrome Driver.
+    Gets the latest version in a local mirror that has a driver for this platform.
 
-    :param path: The path to save the Chrome Driver.
-    :param remove_zip: If True, it will remove the zip file after extracting.
-    :param progress_callback: A callback function that will be called when downloading.
-    :return: The version and path of the Chrome Driver.
+    :param mirror: The mirror directory
+    :return: The version or None
     """
-    version = get_chrome_driver_latest_version()
-    # Windows
-    if platform.system() == 'Windows':
-        name = 'chromedriver_win32.zip'
-    # Linux
-    elif platform.system() == 'Linux':
-        name = 'chromedriver_linux64.zip'
-    # Mac
-    elif platform.system() == 'Darwin':
-        name = 'chromedriver_mac64.zip'
-    else:
-        raise Exception(f'Unsupported platform: {platform.system()}! Please download ChromeDriver manually.')
+    if not mirror or not os.path.isdir(mirror):
+        return None
+    name = _zip_name()
+    versions = [version for version in os.listdir(mirror) if os.path.isfile(os.path.join(mirror, version, name))]
+    return max(versions, key=_version_key) if versions else None
 
-    url = f'https://chromedriver.storage.googleapis.com/{version}/{name}'
 
-    # Download the file
-    res = requests.get(url, stream=True)
-    total_size = int(res.headers.get('content-length', 0))
+def _download(url: str, path: str, progress_callback: Callable):
+    """
+    Downloads a file through a `.part` file.
+    An interrupted download is resumed from where it stopped if the server supports ranges.
+    """
+    part_path = path + '.part'
+    done = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {'Range': f'bytes={done}-'} if done else {}
 
-    if res.status_code != 200:
-        raise requests.HTTPError(f'Failed to download ChromeDriver: Error {res.status_code}')
+    res = requests.get(url, stream=True, headers=headers, timeout=(10, 60))
+    if res.status_code == 416:
+        # The part file is already complete
+        res.close()
+    else:
+        if res.status_code not in (200, 206):
+            raise requests.HTTPError(f'Failed to download ChromeDriver: Error {res.status_code}')
+        if res.status_code == 200:
+            # The server ignored the range, start over
+            done = 0
+        total_size = done + int(res.headers.get('content-length', 0))
 
-    with open(name, 'wb') as f:
-        if not total_size:
-            f.write(res.content)
-        else:
-            for chunk in res.iter_content(chunk_size=1024):
+        with open(part_path, 'ab' if done else 'wb') as f:
+            for chunk in res.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
                 if chunk:
                     f.write(chunk)
                     progress_callback(f.tell(), total_size)
 
-    # Extract the file
-    with zipfile.ZipFile(name, 'r') as zip_file:
-        filename = zip_file.filelist[0].filename
-        zip_file.extractall()
+    os.replace(part_path, path)
+
+
+def _check_zip(path: str, expected_sha256: Optional[str]):
+    if expected_sha256 and file_sha256(path) != expected_sha256:
+        raise ValueError(f'Checksum mismatch: {path}')
+    with zipfile.ZipFile(path, 'r') as zip_file:
+        if (broken := zip_file.testzip()) is not None:
+            raise zipfile.BadZipFile(f'Corrupted file in {path}: {broken}')
+
+
+def _read_checksum(path: str) -> Optional[str]:
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as file:
+        return file.read().split()[0].lower()
+
+
+class DriverCache:
+    def __init__(self, cache_dir: Union[str, os.PathLike] = CACHE_DIR, mirror: Union[str, os.PathLike] = MIRROR_DIR,
+                 version: str = PINNED_VERSION):
+        """
+        A versioned ChromeDriver cache in the user cache directory.
+        Drivers are installed once under a file lock, checked against their checksums and switched to atomically,
+        so parallel workers never see a half-written driver. Once a driver is installed, finding it is a single stat.
+
+        :param cache_dir: The cache directory
+        :param mirror: A local directory with `<version>/<zip name>` files to install from without network
+        :param version: The version to install (defaults to the mirror's latest version or the latest release)
+        """
+        self.cache_dir = os.fspath(cache_dir)
+        self.mirror = os.fspath(mirror) if mirror else ''
+        self.version = version
+        self.current_path = os.path.join(self.cache_dir, CURRENT_NAME)
+
+    def driver_path(self, version: str) -> str:
+        return os.path.join(self.cache_dir, version, platform.system().lower(), _executable_name())
+
+    def lookup(self) -> Optional[str]:
+        """
+        Gets the installed driver (of the pinned version, if any) without touching the network.
+
+        :return: Path of the driver or None if it's not installed
+        """
+        if not self.version:
+            return self.current()
+
+        path = self.driver_path(self.version)
+        try:
+            # The checksum file is written after the driver, so it only exists for complete installs
+            os.stat(path + '.sha256')
+        except OSError:
+            return None
+        return path
+
+    def current(self) -> Optional[str]:
+        """
+        Gets the current driver.
+
+        :return: Path of the driver or None if no driver is installed
+        """
+        try:
+            # `current` is a link to the driver, so this follows it and checks the driver in one call
+            mode = os.stat(self.current_path).st_mode
+        except OSError:
+            return None
+        if mode & stat.S_IXUSR:
+            return self.current_path
+
+        # Where links are not supported, `current` contains the path of the driver
+        with open(self.current_path, 'r', encoding='utf-8') as file:
+            path = file.read().strip()
+        return path if os.path.isfile(path) else None
+
+    def _set_current(self, path: str):
+        temp_path = f'{self.current_path}.{os.getpid()}.tmp'
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        try:
+            os.symlink(os.path.relpath(path, self.cache_dir), temp_path)
+        except (OSError, NotImplementedError):
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                file.write(path)
+        os.replace(temp_path, self.current_path)
+
+    def _installed(self, path: str) -> bool:
+        checksum = _read_checksum(path + '.sha256')
+        return os.path.isfile(path) and checksum is not None and file_sha256(path) == checksum
 
-    # Remove the zip file
-    if remove_zip:
-        os.remove(name)
+    def install(self, force: bool = False, remove_zip: bool = False,
+                progress_callback: Callable = lambda downloaded, total_size: None) -> Tuple[str, str]:
+        """
+        Installs a driver (from the mirror or the web) if it's not installed yet and makes it the current one.
 
-    # Move the Chrome Driver to the specified path
+        :param force: Install the driver again even if it's already installed
+        :param remove_zip: Remove the downloaded zip file after extracting it
+        :param progress_callback: A callback function that will be called when downloading
+        :return: The version and path of the driver
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with file_lock(os.path.join(self.cache_dir, '.lock')):
+            # Another process may have installed it while this one was waiting for the lock
+            if not force and (installed := self.lookup()):
+                return os.path.basename(os.path.dirname(os.path.dirname(os.path.realpath(installed)))), installed
+
+            version = self.version or get_mirror_version(self.mirror) or get_chrome_driver_latest_version()
+            if not version:
+                raise Exception("Couldn't find the latest version of ChromeDriver! Please download it manually.")
+
+            path = self.driver_path(version)
+            if force or not self._installed(path):
+                self._extract(self._fetch_zip(version, progress_callback), path)
+                if remove_zip:
+                    zip_path = os.path.join(self.cache_dir, 'downloads', version, _zip_name())
+                    if os.path.exists(zip_path):
+                        os.remove(zip_path)
+            self._set_current(path)
+
+        return version, path
+
+    def _fetch_zip(self, version: str, progress_callback: Callable) -> str:
+        """Gets the zip of a version from the mirror, or downloads it to the cache."""
+        name = _zip_name()
+        if self.mirror:
+            mirror_path = os.path.join(self.mirror, version, name)
+            if os.path.isfile(mirror_path):
+                _check_zip(mirror_path, _read_checksum(mirror_path + '.sha256'))
+                return mirror_path
+
+        zip_path = os.path.join(self.cache_dir, 'downloads', version, name)
+        os.makedirs(os.path.dirname(zip_path), exist_ok=True)
+        if not os.path.isfile(zip_path):
+            _download(endpoints.CHROMEDRIVER_DOWNLOAD_URL.format(version=version, name=name), zip_path,
+                      progress_callback)
+        try:
+            _check_zip(zip_path, None)
+        except (zipfile.BadZipFile, ValueError):
+            os.remove(zip_path)
+            raise
+
+        return zip_path
+
+    @staticmethod
+    def _extract(zip_path: str, path: str):
+        """Extracts the driver next to its final path and moves it there atomically."""
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        executable = _executable_name()
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with zipfile.ZipFile(zip_path, 'r') as zip_file:
+            member = next((info for info in zip_file.infolist()
+                           if os.path.basename(info.filename) == executable), zip_file.infolist()[0])
+            with zip_file.open(member) as source, open(temp_path, 'wb') as destination:
+                shutil.copyfileobj(source, destination)
+        os.chmod(temp_path, 0o755)
+
+        checksum_path = path + '.sha256'
+        with open(checksum_path + '.tmp', 'w', encoding='utf-8') as file:
+            file.write(f'{file_sha256(temp_path)}  {executable}\n')
+        os.replace(temp_path, path)
+        os.replace(checksum_path + '.tmp', checksum_path)
+
+
+def download_chrome_driver(path: Union[str, os.PathLike] = None, remove_zip: bool = False,
+                           progress_callback: Callable = lambda downloaded, total_size: None) -> Tuple[str, str]:
+    """
+    Download the latest version of Chrome Driver (to the driver cache).
+
+    :param path: The path to copy the Chrome Driver to.
+    :param remove_zip: If True, it will remove the zip file after extracting.
+    :param progress_callback: A callback function that will be called when downloading.
+    :return: The version and path of the Chrome Driver.
+    """
+    version, cached_path = DriverCache().install(force=True, remove_zip=remove_zip,
+                                                 progress_callback=progress_callback)
     if path:
-        os.rename(filename, path)
+        shutil.copy2(cached_path, path)
 
-    return version, path or filename
+    return version, path or cached_path
 
 
 def get_chrome_driver(path: Union[str, os.PathLike] = None, force_download: bool = False, remove_zip: bool = False,
@@ -89,18 +335,26 @@ def get_chrome_driver(path: Union[str, os.PathLike] = None, force_download: bool
     """
     Get the latest version of Chrome Driver.
 
-    :param path: The path to save the Chrome Driver.
+    :param path: The path of the Chrome Driver (used as is if it exists).
     :param force_download: If True, it won't check if a driver is already downloaded.
     :param remove_zip: If True, it will remove the zip file after extracting.
     :param progress_callback: A callback function that will be called when downloading.
     :return: The path of the Chrome Driver.
     """
-    if not force_download:
-        path = 'chromedriver'
-        if platform.system() == 'Windows':
-            path += '.exe'
+    if force_download:
+        return download_chrome_driver(path, remove_zip, progress_callback)[-1]
+    if path and os.path.exists(path):
+        return os.fspath(path)
 
-        if os.path.exists(path):
-            return path
+    cache = DriverCache()
+    if installed := cache.lookup():
+        return installed
+    # A driver downloaded manually to the working directory
+    if not path and os.path.exists(_executable_name()):
+        return _executable_name()
 
-    return download_chrome_driver(path, remove_zip, progress_callback)[-1]
+    cached_path = cache.install(remove_zip=remove_zip, progress_callback=progress_callback)[-1]
+    if path:
+        shutil.copy2(cached_path, path)
+        return os.fspath(path)
+    return cached_path
@@ -0,0 +1,241 @@
+import os
+import queue
+import threading
+
+from typing import Callable, Dict, Union
+from contextlib import contextmanager
+
+import log21
+
+from selenium import webdriver
+from selenium.common import WebDriverException
+from selenium.webdriver.chrome.service import Service as ChromeService
+
+WINDOW_SIZE = (1280, 1024)
+PAGE_LOAD_TIMEOUT = 300
+SCRIPT_TIMEOUT = 30
+# `driver.get` returns when the DOM is ready; the stages wait for the elements they need
+# and the screenshots wait for the page to finish loading
+PAGE_LOAD_STRATEGY = 'eager'
+
+
+def make_chrome_options(verbose: bool = False) -> webdriver.ChromeOptions:
+    """
+    Makes the Chrome options every Analyzer driver uses.
+
+    :param verbose: If False, Chrome logs only fatal errors
+    :return: The Chrome options
+    """
+    options = webdriver.ChromeOptions()
+    options.add_argument(f"--window-size={WINDOW_SIZE[0]},{WINDOW_SIZE[1]}")
+    prefs = {"download.default_directory": os.getcwd()}
+    options.add_experimental_option("prefs", prefs)
+    options.add_experimental_option('excludeSwitches', ['enable-logging'])
+    options.add_argument('--headless')
+    options.page_load_strategy = PAGE_LOAD_STRATEGY
+    # The network events of the stages are read from the performance log
+    options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+    if not verbose:
+        options.add_argument('log-level=3')
+
+    return options
+
+
+def create_driver(chromedriver_path: Union[str, os.PathLike] = None, verbose: bool = False,
+                  options: webdriver.ChromeOptions = None) -> webdriver.Chrome:
+    """
+    Launches a new Chrome session.
+
+    :param chromedriver_path: ChromeDriver path
+    :param verbose: Verbose mode for Chrome
+    :param options: Chrome options (defaults to `make_chrome_options(verbose)`)
+    :return: The driver
+    """
+    # The downloader (and BeautifulSoup) is only needed when a browser is started
+    from driver_downloader import get_chrome_driver
+
+    service = ChromeService(get_chrome_driver(remove_zip=True, path=chromedriver_path))
+    return webdriver.Chrome(options=options or make_chrome_options(verbose), service=service)
+
+
+def reset_driver(driver: webdriver.Chrome):
+    """
+    Brings a used driver back to a clean state: one blank tab, no cookies or storage,
+    the default window size and the default timeouts.
+
+    :param driver: The driver to reset
+    """
+    # Close the extra tabs
+    handles = driver.window_handles
+    for handle in handles[1:]:
+        driver.switch_to.window(handle)
+        driver.close()
+    driver.switch_to.window(handles[0])
+
+    # Clear the storage of the last page before leaving it
+    try:
+        driver.execute_script('window.localStorage.clear(); window.sessionStorage.clear();')
+    except WebDriverException:
+        # Pages like about:blank don't have any storage
+        pass
+    driver.get('about:blank')
+
+    # Unblock the requests of the last stage and drop its network events
+    try:
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': []})
+        driver.get_log('performance')
+    except WebDriverException:
+        pass
+
+    # `delete_all_cookies` only deletes the cookies of the current domain
+    try:
+        driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+    except WebDriverException:
+        driver.delete_all_cookies()
+
+    driver.set_window_size(*WINDOW_SIZE)
+    driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+    driver.set_script_timeout(SCRIPT_TIMEOUT)
+    driver.implicitly_wait(0)
+
+
+def is_healthy(driver: webdriver.Chrome) -> bool:
+    """
+    Checks if the browser of the driver still responds.
+
+    :param driver: The driver to check
+    :return: True if the driver is usable
+    """
+    try:
+        return bool(driver.window_handles) and driver.execute_script('return 1') == 1
+    except WebDriverException:
+        return False
+
+
+class DriverPool:
+    def __init__(self, size: int = 1, chromedriver_path: Union[str, os.PathLike] = None, verbose: bool = False,
+                 max_uses: int = 50, driver_factory: Callable[[], webdriver.Chrome] = None):
+        """
+        A pool of warm Chrome sessions that can be shared between Analyzer instances.
+        Sessions are created on demand (up to `size`), reset when they are given back,
+        replaced if they fail the health check and recycled after `max_uses` borrows.
+
+        :param size: Maximum number of sessions
+        :param chromedriver_path: ChromeDriver path
+        :param verbose: Verbose mode for Chrome
+        :param max_uses: Number of borrows after which a session is quit and replaced (0 for no limit)
+        :param driver_factory: A function that launches a new session (defaults to `create_driver`)
+        """
+        if size < 1:
+            raise ValueError('Size of the pool must be at least 1')
+
+        self.size = size
+        self.max_uses = max_uses
+        self._driver_factory = driver_factory or (lambda: create_driver(chromedriver_path, verbose))
+        self._idle = queue.LifoQueue()
+        self._uses: Dict[int, int] = {}
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _quit(self, driver: webdriver.Chrome):
+        with self._lock:
+            self._uses.pop(id(driver), None)
+            self._created -= 1
+        try:
+            driver.quit()
+        except Exception as e:
+            log21.debug(f'DriverPool: Error while quitting a driver: {e.__class__.__name__}: {str(e)}')
+
+    def acquire(self, timeout: float = None) -> webdriver.Chrome:
+        """
+        Borrows a session from the pool.
+        Blocks if all the sessions are in use.
+
+        :param timeout: Maximum number of seconds to wait for a free session
+        :return: The driver
+        """
+        if self._closed:
+            raise RuntimeError('DriverPool is closed')
+
+        while True:
+            with self._lock:
+                create = self._idle.empty() and self._created < self.size
+                if create:
+                    self._created += 1
+
+            if create:
+                try:
+                    driver = self._driver_factory()
+                except BaseException:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+                log21.debug('DriverPool: Launched a new session')
+                with self._lock:
+                    self._uses[id(driver)] = 0
+            else:
+                try:
+                    driver = self._idle.get(timeout=timeout)
+                except queue.Empty:
+                    raise TimeoutError('No free driver in the pool')
+                if not is_healthy(driver):
+                    log21.debug('DriverPool: Replacing an unhealthy session')
+                    self._quit(driver)
+                    continue
+
+            with self._lock:
+                self._uses[id(driver)] += 1
+            return driver
+
+    def release(self, driver: webdriver.Chrome, broken: bool = False):
+        """
+        Gives a borrowed session back to the pool.
+
+        :param driver: The driver
+        :param broken: If True, the session is quit instead of being reused
+        """
+        if not broken and not self._closed and (not self.max_uses or self._uses.get(id(driver), 0) < self.max_uses):
+            try:
+                reset_driver(driver)
+                self._idle.put(driver)
+                return
+            except WebDriverException as e:
+                log21.debug(f'DriverPool: Could not reset a session: {e.__class__.__name__}: {str(e)}')
+
+        self._quit(driver)
+
+    @contextmanager
+    def borrow(self, timeout: float = None):
+        """
+        Borrows a session for a `with` block.
+
+        :param timeout: Maximum number of seconds to wait for a free session
+        """
+        driver = self.acquire(timeout)
+        try:
+            yield driver
+        except BaseException:
+            self.release(driver, broken=not is_healthy(driver))
+            raise
+        else:
+            self.release(driver)
+
+    def close(self):
+        """Quits all the idle sessions. Borrowed sessions are quit when they are released."""
+        self._closed = True
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._quit(driver)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,26 @@
+"""
+Addresses of the third-party services the Analyzer uses.
+Every one of them can be changed with an environment variable (or in the `.env` file),
+e.g. to point the Analyzer to the local stand-ins of `benchmarks/stand_ins.py`.
+"""
+from decouple import config
+
+AMIRESPONSIVE_URL = config('AMIRESPONSIVE_URL', default='https://amiresponsive.co.uk/')
+GTMETRIX_URL = config('GTMETRIX_URL', default='https://gtmetrix.com/')
+BACKLINKS_URL = config('BACKLINKS_URL', default='https://lxrmarketplace.com/seo-inbound-link-checker-tool.html')
+IMAGE_COMPRESSOR_URL = config('IMAGE_COMPRESSOR_URL', default='https://imagecompressor.com/')
+
+# Formatted with the domain
+IP_API_URL = config('IP_API_URL', default='http://ip-api.com/json/{domain}?fields=66846719')
+# Formatted with the ISO code of the country
+FLAG_URL = config('FLAG_URL', default='https://countryflagsapi.com/png/{country_code}')
+# Formatted with the URL of the website
+FAVICON_URL = config('FAVICON_URL', default='http://www.google.com/s2/favicons?domain={url}')
+# If set, WHOIS information is read from this RDAP service (formatted with the domain) instead of whois21
+RDAP_URL = config('RDAP_URL', default='')
+
+# The page the latest ChromeDriver version is read from and where the drivers are downloaded from
+# (formatted with the version and the name of the platform's zip file)
+CHROMEDRIVER_VERSION_URL = config('CHROMEDRIVER_VERSION_URL', default='https://chromedriver.chromium.org/')
+CHROMEDRIVER_DOWNLOAD_URL = config('CHROMEDRIVER_DOWNLOAD_URL',
+                                   default='https://chromedriver.storage.googleapis.com/{version}/{name}')
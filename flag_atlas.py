@@ -0,0 +1,196 @@
+"""
+Builds the flag atlas of the WHOIS card: the flag of every country, already shrunk to the size the card shows it,
+packed into `assets/images/flags.png` with the boxes of the flags in `assets/images/flags.json`.
+The Analyzer cuts the flags out of the atlas instead of downloading and shrinking a full-size flag for every domain.
+
+    python flag_atlas.py [-c IR US ...] [-i DIRECTORY] [-s SCALE] [-o assets/images]
+
+The flags are downloaded from FLAG_URL (see `endpoints.py`), or read from `<DIRECTORY>/<code>.png` (or `.gif`) files.
+The bundled atlas is made of the 16x11 famfamfam flag icons (public domain, as shipped in the `django-countries`
+package), which fit in front of the IP location on the card:
+
+    python flag_atlas.py -i django_countries/static/flags -s 1
+"""
+import io
+import os
+import sys
+import json
+import time
+
+from typing import Callable, Dict, Iterable, Optional, Tuple, Union
+
+import log21
+
+from PIL import Image
+
+import endpoints
+import http_client
+from asset_registry import FLAG_ATLAS, FLAG_INDEX, asset_path
+
+logger = log21.get_logger()
+
+# The flags are shown at 1/20 of the size of the flags of FLAG_URL
+FLAG_SCALE = 20
+# Width of the atlas image; the flags are packed in rows
+ATLAS_WIDTH = 512
+# ISO 3166-1 alpha-2 codes of the countries and territories
+COUNTRY_CODES = (
+    'AD', 'AE', 'AF', 'AG', 'AI', 'AL', 'AM', 'AO', 'AQ', 'AR', 'AS', 'AT', 'AU', 'AW', 'AX', 'AZ', 'BA', 'BB', 'BD',
+    'BE', 'BF', 'BG', 'BH', 'BI', 'BJ', 'BL', 'BM', 'BN', 'BO', 'BQ', 'BR', 'BS', 'BT', 'BV', 'BW', 'BY', 'BZ', 'CA',
+    'CC', 'CD', 'CF', 'CG', 'CH', 'CI', 'CK', 'CL', 'CM', 'CN', 'CO', 'CR', 'CU', 'CV', 'CW', 'CX', 'CY', 'CZ', 'DE',
+    'DJ', 'DK', 'DM', 'DO', 'DZ', 'EC', 'EE', 'EG', 'EH', 'ER', 'ES', 'ET', 'FI', 'FJ', 'FK', 'FM', 'FO', 'FR', 'GA',
+    'GB', 'GD', 'GE', 'GF', 'GG', 'GH', 'GI', 'GL', 'GM', 'GN', 'GP', 'GQ', 'GR', 'GS', 'GT', 'GU', 'GW', 'GY', 'HK',
+    'HM', 'HN', 'HR', 'HT', 'HU', 'ID', 'IE', 'IL', 'IM', 'IN', 'IO', 'IQ', 'IR', 'IS', 'IT', 'JE', 'JM', 'JO', 'JP',
+    'KE', 'KG', 'KH', 'KI', 'KM', 'KN', 'KP', 'KR', 'KW', 'KY', 'KZ', 'LA', 'LB', 'LC', 'LI', 'LK', 'LR', 'LS', 'LT',
+    'LU', 'LV', 'LY', 'MA', 'MC', 'MD', 'ME', 'MF', 'MG', 'MH', 'MK', 'ML', 'MM', 'MN', 'MO', 'MP', 'MQ', 'MR', 'MS',
+    'MT', 'MU', 'MV', 'MW', 'MX', 'MY', 'MZ', 'NA', 'NC', 'NE', 'NF', 'NG', 'NI', 'NL', 'NO', 'NP', 'NR', 'NU', 'NZ',
+    'OM', 'PA', 'PE', 'PF', 'PG', 'PH', 'PK', 'PL', 'PM', 'PN', 'PR', 'PS', 'PT', 'PW', 'PY', 'QA', 'RE', 'RO', 'RS',
+    'RU', 'RW', 'SA', 'SB', 'SC', 'SD', 'SE', 'SG', 'SH', 'SI', 'SJ', 'SK', 'SL', 'SM', 'SN', 'SO', 'SR', 'SS', 'ST',
+    'SV', 'SX', 'SY', 'SZ', 'TC', 'TD', 'TF', 'TG', 'TH', 'TJ', 'TK', 'TL', 'TM', 'TN', 'TO', 'TR', 'TT', 'TV', 'TW',
+    'TZ', 'UA', 'UG', 'UM', 'US', 'UY', 'UZ', 'VA', 'VC', 'VE', 'VG', 'VI', 'VN', 'VU', 'WF', 'WS', 'XK', 'YE', 'YT',
+    'ZA', 'ZM', 'ZW',
+)
+
+
+def shrink_flag(data: bytes, scale: int = FLAG_SCALE) -> Image.Image:
+    """
+    Shrinks a full-size flag like the WHOIS card always did, so the atlas gives the same pixels.
+
+    :param data: The encoded flag
+    :param scale: The width and height are divided by this
+    :return: The RGBA flag
+    """
+    image = Image.open(io.BytesIO(data)).convert('RGBA')
+    if scale == 1:
+        return image
+    return image.resize((image.width // scale, image.height // scale))
+
+
+def download_flag(country_code: str) -> bytes:
+    """
+    Downloads the full-size flag of a country from FLAG_URL.
+
+    :param country_code: ISO code of the country
+    :return: The flag image
+    """
+    return http_client.get_content(endpoints.FLAG_URL.format(country_code=country_code))
+
+
+def pack(flags: Dict[str, Image.Image], width: int = ATLAS_WIDTH) -> Tuple[Image.Image, Dict[str, list]]:
+    """
+    Packs images into rows of one image.
+
+    :param flags: {country code: flag}
+    :param width: Width of the atlas (widened to the widest flag)
+    :return: The atlas and {country code: [x, y, width, height]}
+    """
+    width = max([width] + [flag.width for flag in flags.values()])
+    boxes = {}
+    x = y = row_height = 0
+    # The tallest flags first, so the rows waste less space
+    for code, flag in sorted(flags.items(), key=lambda item: (-item[1].height, item[0])):
+        if x + flag.width > width:
+            x, y, row_height = 0, y + row_height, 0
+        boxes[code] = [x, y, flag.width, flag.height]
+        x += flag.width
+        row_height = max(row_height, flag.height)
+
+    atlas = Image.new('RGBA', (width, max(1, y + row_height)), (0, 0, 0, 0))
+    for code, (x, y, _, _) in boxes.items():
+        atlas.paste(flags[code], (x, y))
+
+    return atlas, dict(sorted(boxes.items()))
+
+
+def build_atlas(country_codes: Iterable[str] = COUNTRY_CODES, directory: Union[str, os.PathLike] = None,
+                source: Optional[Callable[[str], bytes]] = None, scale: int = FLAG_SCALE) -> dict:
+    """
+    Builds the flag atlas and its index.
+    The countries whose flag can't be fetched are left out (their flags are downloaded when they are needed).
+
+    :param country_codes: ISO codes of the countries
+    :param directory: Where to write the atlas and the index (defaults to `assets/images`)
+    :param source: A function that gets the full-size flag of a country code (defaults to downloading it)
+    :param scale: The flags are shrunk to 1/scale of their size (1 for flags that already have the size of the card)
+    :return: {'flags': number of flags, 'missing': [country codes], 'bytes': size of the atlas}
+    :raise RuntimeError: If none of the flags could be fetched (the current atlas is kept)
+    """
+    directory = directory or asset_path('images')
+    source = source or download_flag
+    flags = {}
+    missing = []
+    for code in country_codes:
+        code = code.upper()
+        try:
+            flags[code] = shrink_flag(source(code), scale)
+        except Exception as e:
+            log21.debug(f'{code}: {e.__class__.__name__}: {str(e)}')
+            missing.append(code)
+
+    if not flags:
+        raise RuntimeError(f"Couldn't get any of the {len(missing)} flags")
+
+    atlas, boxes = pack(flags)
+    os.makedirs(directory, exist_ok=True)
+    atlas_path = os.path.join(directory, FLAG_ATLAS)
+    index_path = os.path.join(directory, FLAG_INDEX)
+    atlas.save(atlas_path + '.tmp', format='png', optimize=True)
+    with open(index_path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump({'scale': scale, 'flags': boxes}, file, separators=(',', ':'))
+    os.replace(atlas_path + '.tmp', atlas_path)
+    os.replace(index_path + '.tmp', index_path)
+
+    return {'flags': len(flags), 'missing': missing, 'bytes': os.path.getsize(atlas_path)}
+
+
+def read_flag(directory: Union[str, os.PathLike]) -> Callable[[str], bytes]:
+    """Makes a flag source that reads `<directory>/<code>.png` or `.gif` (or the lower-case names)."""
+    def source(country_code: str) -> bytes:
+        for name in (country_code, country_code.lower()):
+            for extension in ('png', 'gif'):
+                path = os.path.join(directory, f'{name}.{extension}')
+                if os.path.exists(path):
+                    with open(path, 'rb') as file:
+                        return file.read()
+        raise FileNotFoundError(f'No flag file for {country_code} in {directory}')
+
+    return source
+
+
+def main():
+    parser = log21.ColorizingArgumentParser()
+    parser.add_argument('-c', '--countries', help='ISO codes of the countries (defaults to all of them)', nargs='*',
+                        metavar='CODE')
+    parser.add_argument('-i', '--input', help='Read the flags from <code>.png (or .gif) files of this directory '
+                        'instead of downloading them')
+    parser.add_argument('-s', '--scale', help='Shrink the flags to 1/SCALE of their size (1 to keep their size)',
+                        type=int, default=FLAG_SCALE)
+    parser.add_argument('-o', '--output', help='Where to write the atlas and its index',
+                        default=asset_path('images'))
+    parser.add_argument('-v', '--verbose', help='Verbose mode', action='store_true')
+    args = parser.parse_args()
+    if args.scale < 1:
+        parser.error('Scale must be at least 1')
+    if args.verbose:
+        log21.basic_config(level=log21.DEBUG)
+
+    start = time.perf_counter()
+    try:
+        stats = build_atlas(args.countries or COUNTRY_CODES, args.output,
+                            read_flag(args.input) if args.input else None, args.scale)
+    except RuntimeError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    logger.info(f"Packed {stats['flags']} flags ({stats['bytes'] / 1024:.1f} KiB) into "
+                f"{os.path.join(args.output, FLAG_ATLAS)} in {time.perf_counter() - start:.2f} seconds")
+    if stats['missing']:
+        logger.warning(f"Couldn't get the flags of {', '.join(stats['missing'])}")
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        logger.clear_line()
+        logger.error("KeyboardInterrupt: Exiting...")
+        sys.exit(0)
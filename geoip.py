@@ -0,0 +1,561 @@
+"""
+Locates the IP address of a domain without asking ip-api.com.
+
+The domain is resolved by a caching DNS resolver and its address is looked up in a local GeoIP database,
+which is memory-mapped, so a lookup is a binary search over the pages of the file the OS already has in memory
+(and the forked workers share them). Two kinds of databases are read:
+
+* the sorted-range format of this module, built from a CSV file of IP ranges:
+
+      python geoip.py build -i IP2LOCATION-LITE-DB3.CSV -f ip2location [-o geoip.bin]
+      python geoip.py build -i ranges.csv  # start,end,country_code,country,city
+
+* MaxMind `.mmdb` files (GeoLite2-City, DB-IP lite, ...), if the optional `maxminddb` package is installed.
+
+Without a database (or for the addresses it doesn't know), the Analyzer falls back to ip-api.com.
+
+    python geoip.py lookup example.com 8.8.8.8
+"""
+import io
+import os
+import csv
+import sys
+import mmap
+import time
+import socket
+import struct
+import bisect
+import tempfile
+import threading
+import collections
+import urllib.parse
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import log21
+
+from decouple import config
+
+from deadline import DeadlineExceeded, bounded, check
+from lookup_cache import user_cache_dir
+
+logger = log21.get_logger()
+
+GEOIP_DATABASE = config('GEOIP_DATABASE', default=os.path.join(user_cache_dir(), 'geoip.bin'))
+# Seconds a resolved address is reused for (the system resolver doesn't say the TTL of the records)
+DNS_TTL = config('DNS_TTL', default=300, cast=float)
+# Seconds a failed resolution is remembered for
+DNS_NEGATIVE_TTL = config('DNS_NEGATIVE_TTL', default=30, cast=float)
+DNS_CACHE_SIZE = config('DNS_CACHE_SIZE', default=4096, cast=int)
+# Seconds to wait for the system resolver, which has no timeout of its own (the stage budget can make it shorter)
+DNS_TIMEOUT = config('DNS_TIMEOUT', default=5, cast=float)
+# Whether to look up the host name of the address (the PTR record shown as the hosted website on the WHOIS card)
+GEOIP_REVERSE = config('GEOIP_REVERSE', default=True, cast=bool)
+
+MAGIC = b'WAGEOIP1'
+# Magic, number of IPv4 ranges, number of IPv6 ranges, number of locations, size of the location strings
+HEADER = struct.Struct('<8sIIII')
+V6_SIZE = 16
+# Country code, country and city of a location are stored as one UTF-8 string separated by tabs
+SEPARATOR = '\t'
+
+RANGES = 'ranges'
+IP2LOCATION = 'ip2location'
+FORMATS = (RANGES, IP2LOCATION)
+
+Location = Dict[str, str]
+
+_resolver: Optional['Resolver'] = None
+_database: Union['GeoIPDatabase', 'MaxMindDatabase', None] = None
+_database_loaded = False
+_database_lock = threading.Lock()
+
+
+class Resolver:
+    def __init__(self, ttl: float = DNS_TTL, negative_ttl: float = DNS_NEGATIVE_TTL, max_size: int = DNS_CACHE_SIZE,
+                 timeout: float = DNS_TIMEOUT):
+        """
+        Resolves host names (and addresses to host names) with the system resolver
+        and keeps the answers in memory for `ttl` seconds.
+        The lookups run on a thread of their own, so they don't block longer than `timeout`
+        or the time left in the current context (see `deadline.py`).
+
+        :param ttl: Seconds an answer is reused for
+        :param negative_ttl: Seconds a failed lookup is remembered for
+        :param max_size: Maximum number of cached answers (the least recently used ones are dropped)
+        :param timeout: Seconds to wait for a lookup
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'collections.OrderedDict[Tuple[str, str], Tuple[float, Optional[str]]]' = \
+            collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, kind: str, key: str, func) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((kind, key))
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end((kind, key))
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        try:
+            value = bounded(lambda: func(key), self.timeout, f'{kind} {key}')
+        except DeadlineExceeded as e:
+            # A slow answer isn't remembered as a failure, but a spent budget still stops the caller
+            check()
+            log21.debug(f'{kind}: {key}: {str(e)}')
+            return None
+        except (OSError, UnicodeError) as e:
+            log21.debug(f'{kind}: {key}: {e.__class__.__name__}: {str(e)}')
+            value = None
+
+        with self._lock:
+            self._entries[(kind, key)] = (now + (self.ttl if value else self.negative_ttl), value)
+            self._entries.move_to_end((kind, key))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return value
+
+    @staticmethod
+    def _resolve(host: str) -> Optional[str]:
+        addresses = socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)
+        # Prefer IPv4 like ip-api.com does
+        for family, _, _, _, address in addresses:
+            if family == socket.AF_INET:
+                return address[0]
+        return addresses[0][4][0] if addresses else None
+
+    def resolve(self, host: str) -> Optional[str]:
+        """
+        Gets an IP address of a host.
+
+        :param host: The host name
+        :return: The address (an IPv4 one if the host has any) or None if it doesn't resolve
+        """
+        return self._cached('resolve', host.lower().rstrip('.'), self._resolve)
+
+    def reverse(self, address: str) -> Optional[str]:
+        """
+        Gets the host name of an IP address (its PTR record).
+
+        :param address: The IP address
+        :return: The host name or None if the address has none
+        """
+        return self._cached('reverse', address, lambda key: socket.gethostbyaddr(key)[0])
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def pack_address(address: str) -> Tuple[int, Union[int, bytes]]:
+    """
+    Converts an IP address to the keys of the database.
+
+    :param address: An IPv4 or IPv6 address
+    :return: (4, the address as an integer) or (6, the address as 16 big-endian bytes)
+    :raise ValueError: If it's not an IP address
+    """
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, address), 'big')
+    except OSError:
+        pass
+    try:
+        packed = socket.inet_pton(socket.AF_INET6, address)
+    except (OSError, TypeError):
+        raise ValueError(f'Not an IP address: {address!r}')
+    # IPv4-mapped addresses (::ffff:1.2.3.4) are looked up as IPv4
+    if packed[:12] == b'\0' * 10 + b'\xff\xff':
+        return 4, int.from_bytes(packed[12:], 'big')
+    return 6, packed
+
+
+class _V6Keys:
+    """A sequence view of 16-byte keys in a buffer, for `bisect`."""
+
+    def __init__(self, buffer: memoryview, count: int):
+        self.buffer = buffer
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> bytes:
+        return self.buffer[index * V6_SIZE:(index + 1) * V6_SIZE].tobytes()
+
+
+class GeoIPDatabase:
+    def __init__(self, path: Union[str, os.PathLike]):
+        """
+        A memory-mapped database of IP ranges in the format `build_database` writes.
+
+        The file is a header followed by the sorted, non-overlapping IPv4 ranges (start, end and location index
+        as little-endian uint32 arrays), the IPv6 ranges (starts and ends as 16-byte big-endian keys and uint32
+        location indexes) and the locations (uint32 offsets into a block of UTF-8 strings).
+
+        :param path: Path of the file
+        :raise ValueError: If it's not a database of this format
+        """
+        self.path = os.fspath(path)
+        with open(self.path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, v4_count, v6_count, location_count, strings_size = HEADER.unpack_from(self._mmap)
+        except struct.error:
+            magic = None
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError(f'{self.path} is not a GeoIP database of this format')
+
+        size = HEADER.size + 12 * v4_count + (2 * V6_SIZE + 4) * v6_count + 4 * (location_count + 1) + strings_size
+        if len(self._mmap) < size:
+            self._mmap.close()
+            raise ValueError(f'{self.path} is truncated')
+
+        self.v4_count = v4_count
+        self.v6_count = v6_count
+        self.location_count = location_count
+        view = memoryview(self._mmap)
+        self._views = [view]
+        offset = HEADER.size
+
+        def take(size: int, typecode: str = None) -> memoryview:
+            nonlocal offset
+            part = view[offset:offset + size]
+            offset += size
+            if typecode:
+                part = part.cast(typecode) if sys.byteorder == 'little' else _swapped(part, typecode)
+            self._views.append(part)
+            return part
+
+        self._v4_starts = take(4 * v4_count, 'I')
+        self._v4_ends = take(4 * v4_count, 'I')
+        self._v4_locations = take(4 * v4_count, 'I')
+        self._v6_starts = _V6Keys(take(V6_SIZE * v6_count), v6_count)
+        self._v6_ends = _V6Keys(take(V6_SIZE * v6_count), v6_count)
+        self._v6_locations = take(4 * v6_count, 'I')
+        self._location_offsets = take(4 * (location_count + 1), 'I')
+        self._strings = take(strings_size)
+        self._locations: Dict[int, Location] = {}
+
+    def _location(self, index: int) -> Location:
+        location = self._locations.get(index)
+        if location is None:
+            data = self._strings[self._location_offsets[index]:self._location_offsets[index + 1]]
+            country_code, country, city = (bytes(data).decode() + SEPARATOR * 2).split(SEPARATOR)[:3]
+            location = {'countryCode': country_code, 'country': country or country_code, 'city': city}
+            self._locations[index] = location
+        return location
+
+    def lookup(self, address: str) -> Optional[Location]:
+        """
+        Gets the location of an IP address.
+
+        :param address: An IPv4 or IPv6 address
+        :return: {'countryCode': ..., 'country': ..., 'city': ...} or None if the address isn't in the database
+        :raise ValueError: If it's not an IP address
+        """
+        version, key = pack_address(address)
+        if version == 4:
+            starts, ends, locations = self._v4_starts, self._v4_ends, self._v4_locations
+        else:
+            starts, ends, locations = self._v6_starts, self._v6_ends, self._v6_locations
+
+        index = bisect.bisect_right(starts, key) - 1
+        if index < 0 or ends[index] < key:
+            return None
+        return self._location(locations[index])
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+
+def _swapped(part: memoryview, typecode: str) -> memoryview:
+    """Reads a little-endian array on a big-endian machine (a copy instead of a view of the file)."""
+    import array
+
+    values = array.array(typecode, part.tobytes())
+    values.byteswap()
+    return memoryview(values)
+
+
+class MaxMindDatabase:
+    def __init__(self, path: Union[str, os.PathLike]):
+        """
+        A MaxMind DB (`.mmdb`) file, memory-mapped by the `maxminddb` package.
+
+        :param path: Path of the file
+        :raise ImportError: If `maxminddb` isn't installed
+        """
+        import maxminddb
+
+        self.path = os.fspath(path)
+        self._reader = maxminddb.open_database(self.path, maxminddb.MODE_MMAP)
+
+    def lookup(self, address: str) -> Optional[Location]:
+        """
+        Gets the location of an IP address.
+
+        :param address: An IPv4 or IPv6 address
+        :return: {'countryCode': ..., 'country': ..., 'city': ...} or None if the address isn't in the database
+        """
+        record = self._reader.get(address)
+        if not record:
+            return None
+        country = record.get('country') or record.get('registered_country') or {}
+        country_code = country.get('iso_code', '')
+        return {'countryCode': country_code, 'country': country.get('names', {}).get('en', country_code),
+                'city': (record.get('city') or {}).get('names', {}).get('en', '')}
+
+    def close(self):
+        self._reader.close()
+
+
+def open_database(path: Union[str, os.PathLike]) -> Union[GeoIPDatabase, MaxMindDatabase]:
+    """
+    Opens a GeoIP database of either format.
+
+    :param path: Path of the file (`.mmdb` files are read with `maxminddb`)
+    :return: The database
+    """
+    if os.fspath(path).endswith('.mmdb'):
+        return MaxMindDatabase(path)
+    return GeoIPDatabase(path)
+
+
+def _parse_address(value: str) -> Tuple[int, int]:
+    """Parses an address of a CSV file: an IP address or its integer (as IP2Location writes them)."""
+    value = value.strip()
+    if value.isdigit():
+        number = int(value)
+        return (4 if number < 2 ** 32 else 6), number
+    version, key = pack_address(value)
+    return version, key if version == 4 else int.from_bytes(key, 'big')
+
+
+def read_ranges(file: Iterable[str], file_format: str = RANGES) -> Iterator[Tuple[int, int, int, Tuple[str, ...]]]:
+    """
+    Reads the IP ranges of a CSV file.
+
+    :param file: Lines of the CSV file
+    :param file_format: `ranges` (start, end, country_code[, country[, city]], addresses or integers)
+        or `ip2location` (the LITE DB1/DB3/DB5/DB11 CSV files: from, to, country_code, country[, region, city, ...])
+    :return: Yields (version, start, end, (country_code, country, city)) of every range
+    """
+    if file_format not in FORMATS:
+        raise ValueError(f'Unknown GeoIP CSV format: {file_format}')
+    city_column = 5 if file_format == IP2LOCATION else 4
+
+    for row in csv.reader(file):
+        if not row or row[0].startswith('#'):
+            continue
+        try:
+            start_version, start = _parse_address(row[0])
+            end_version, end = _parse_address(row[1])
+        except (ValueError, IndexError):
+            # A header line
+            continue
+        if start_version != end_version or start > end:
+            raise ValueError(f'Invalid range: {row[0]} - {row[1]}')
+
+        country_code = row[2].strip() if len(row) > 2 else ''
+        if country_code == '-':
+            continue
+        country = row[3].strip() if len(row) > 3 else ''
+        city = row[city_column].strip() if len(row) > city_column else ''
+        yield start_version, start, end, (country_code, country, city)
+
+
+def build_database(ranges: Iterable[Tuple[int, int, int, Tuple[str, ...]]], path: Union[str, os.PathLike]) -> dict:
+    """
+    Writes a database of IP ranges that `GeoIPDatabase` reads.
+    Adjacent ranges of the same location are merged; the file is replaced atomically.
+
+    :param ranges: (version, start, end, (country_code, country, city)) of the ranges (in any order)
+    :param path: Path of the database
+    :return: {'v4': number of IPv4 ranges, 'v6': number of IPv6 ranges, 'locations': ..., 'bytes': ...}
+    """
+    import array
+
+    locations: Dict[str, int] = {}
+    tables: Dict[int, List[Tuple[int, int, int]]] = {4: [], 6: []}
+    for version, start, end, location in ranges:
+        key = SEPARATOR.join(part.replace(SEPARATOR, ' ') for part in location)
+        tables[version].append((start, end, locations.setdefault(key, len(locations))))
+
+    for version, table in tables.items():
+        table.sort()
+        merged = []
+        for start, end, location in table:
+            if merged and start <= merged[-1][1]:
+                raise ValueError(f'Overlapping IPv{version} ranges at {start}')
+            if merged and merged[-1][2] == location and merged[-1][1] + 1 == start:
+                merged[-1] = (merged[-1][0], end, location)
+            else:
+                merged.append((start, end, location))
+        tables[version] = merged
+
+    strings = bytearray()
+    offsets = array.array('I', [0])
+    for key in locations:
+        strings += key.encode()
+        offsets.append(len(strings))
+
+    def uint32(values: Iterable[int]) -> bytes:
+        values = array.array('I', values)
+        if sys.byteorder != 'little':
+            values.byteswap()
+        return values.tobytes()
+
+    v4, v6 = tables[4], tables[6]
+    data = io.BytesIO()
+    data.write(HEADER.pack(MAGIC, len(v4), len(v6), len(locations), len(strings)))
+    data.write(uint32(start for start, _, _ in v4))
+    data.write(uint32(end for _, end, _ in v4))
+    data.write(uint32(location for _, _, location in v4))
+    data.write(b''.join(start.to_bytes(V6_SIZE, 'big') for start, _, _ in v6))
+    data.write(b''.join(end.to_bytes(V6_SIZE, 'big') for _, end, _ in v6))
+    data.write(uint32(location for _, _, location in v6))
+    data.write(uint32(offsets))
+    data.write(strings)
+
+    path = os.fspath(path)
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.geoip-')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data.getbuffer())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+    return {'v4': len(v4), 'v6': len(v6), 'locations': len(locations), 'bytes': data.tell()}
+
+
+def get_resolver() -> Resolver:
+    """Gets the shared Resolver of the process."""
+    global _resolver
+    if _resolver is None:
+        _resolver = Resolver()
+    return _resolver
+
+
+def get_database() -> Union[GeoIPDatabase, MaxMindDatabase, None]:
+    """
+    Gets the GeoIP database of the process (the `GEOIP_DATABASE` file).
+
+    :return: The database or None if there is no usable database
+    """
+    global _database, _database_loaded
+    if not _database_loaded:
+        with _database_lock:
+            if not _database_loaded:
+                if os.path.exists(GEOIP_DATABASE):
+                    try:
+                        _database = open_database(GEOIP_DATABASE)
+                    except ImportError:
+                        log21.warning('Install `maxminddb` to read .mmdb GeoIP databases')
+                    except (OSError, ValueError) as e:
+                        log21.warning(f"Couldn't open the GeoIP database: {e.__class__.__name__}: {str(e)}")
+                _database_loaded = True
+    return _database
+
+
+def locate(domain: str) -> Optional[dict]:
+    """
+    Gets the IP information of a domain from the local GeoIP database.
+
+    :param domain: The domain (the netloc of a URL; a port is ignored)
+    :return: The IP information in the format of ip-api.com (`query`, `reverse`, `country`, `countryCode`, `city`)
+        or None if there is no database, the domain doesn't resolve or its address isn't in the database
+    """
+    database = get_database()
+    if database is None:
+        return None
+
+    host = urllib.parse.urlsplit('//' + domain).hostname
+    if not host:
+        return None
+    resolver = get_resolver()
+    address = resolver.resolve(host)
+    if address is None:
+        return None
+    location = database.lookup(address)
+    if location is None:
+        return None
+
+    reverse = resolver.reverse(address) if GEOIP_REVERSE else None
+    return {'status': 'success', 'query': address, 'reverse': reverse or '', **location}
+
+
+def main():
+    parser = log21.ColorizingArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='Build a database from a CSV file of IP ranges')
+    build.add_argument('-i', '--input', help='The CSV file (`-` for stdin)', required=True)
+    build.add_argument('-f', '--format', help='Layout of the CSV file', choices=FORMATS, default=RANGES)
+    build.add_argument('-o', '--output', help='Path of the database', default=GEOIP_DATABASE)
+
+    lookup = commands.add_parser('lookup', help='Look up domains or IP addresses')
+    lookup.add_argument('targets', help='Domains or IP addresses', nargs='*')
+    lookup.add_argument('-d', '--database', help='Path of the database', default=GEOIP_DATABASE)
+
+    parser.add_argument('-v', '--verbose', help='Verbose mode', action='store_true')
+    args = parser.parse_args()
+    if args.verbose:
+        log21.basic_config(level=log21.DEBUG)
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        if args.input == '-':
+            stats = build_database(read_ranges(sys.stdin, args.format), args.output)
+        else:
+            with open(args.input, 'r', encoding='utf-8', newline='') as file:
+                stats = build_database(read_ranges(file, args.format), args.output)
+        logger.info(f"Wrote {stats['v4']} IPv4 and {stats['v6']} IPv6 ranges of {stats['locations']} locations "
+                    f"({stats['bytes'] / 1024 / 1024:.1f} MiB) to {args.output} in "
+                    f"{time.perf_counter() - start:.2f} seconds")
+
+    elif args.command == 'lookup':
+        if not args.targets:
+            parser.error('lookup needs at least one domain or IP address')
+        database = open_database(args.database)
+        resolver = get_resolver()
+        for target in args.targets:
+            try:
+                pack_address(target)
+                address = target
+            except ValueError:
+                address = resolver.resolve(target)
+            location = database.lookup(address) if address else None
+            logger.info(f'{target}: {address or "unresolved"}: '
+                        + (', '.join(filter(None, (location['countryCode'], location['country'], location['city'])))
+                           if location else 'not found'))
+        database.close()
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        logger.clear_line()
+        logger.error("KeyboardInterrupt: Exiting...")
+        sys.exit(0)
@@ -1,21 +1,87 @@
+import os
+import sys
+import shutil
+import tempfile
 import unittest
-from main import Handler, is_valid_url
+from unittest import mock
 
-obj = Handler()
+import endpoints
+import lookup_cache
+import stage_cache
+from cards import CardRecord, RECORD_NAME
+from main import Analyzer, STAGE_OUTPUTS, is_valid_url
+from output_store import OutputStore
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+
+from stand_ins import StandIns  # noqa: E402
 
 
 class TestHandlerFunctions(unittest.TestCase):
 
     def test_url_checker(self):
         self.assertTrue(is_valid_url("https://www.google.com"))
+        self.assertTrue(is_valid_url("http://www.google.com"))
         self.assertFalse(is_valid_url("https;//www.google.com"))
-        self.assertTrue(is_valid_url("google.com"))
-        self.assertTrue(is_valid_url("www.google.com"))
+        self.assertFalse(is_valid_url("google.com"))
+        self.assertFalse(is_valid_url("www.google.com"))
+        self.assertFalse(is_valid_url("ftp://www.google.com"))
+
+
+class TestReusedStages(unittest.TestCase):
+    """Runs the stages that don't need the browser twice against the stand-ins, the second time reusing the first."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='htest-')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        stand_ins = StandIns().start()
+        self.addCleanup(stand_ins.stop)
+        environment = stand_ins.environment()
+        for name in ('IP_API_URL', 'FLAG_URL', 'RDAP_URL'):
+            patcher = mock.patch.object(endpoints, name, environment[name])
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for module, cache in ((lookup_cache, lookup_cache.LookupCache(os.path.join(self.directory, 'lookups.db'))),
+                              (stage_cache, stage_cache.StageCache(os.path.join(self.directory, 'stages.db')))):
+            patcher = mock.patch.object(module, '_cache', cache)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+            self.addCleanup(cache.close)
+        self.url = stand_ins.site_url()
+
+    def run_twice(self, stages):
+        analyzer = Analyzer(self.url, 'htest', store=OutputStore(os.path.join(self.directory, 'save')))
+        self.addCleanup(analyzer.close)
+        reports = []
+        saved_paths = []
+        for _ in range(2):
+            reports.append(analyzer.run_stages(stages, max_age=3600))
+            saved_paths.append(analyzer.saved_path)
+            analyzer.load(self.url)
+        for report in reports:
+            self.assertTrue(all(result['status'] in ('ok', 'cached') for result in report.results.values()),
+                            report.results)
+        self.assertEqual({result['status'] for result in reports[1].results.values()}, {'cached'})
+        return saved_paths
 
-    def test_url_protocol(self):
-        self.assertEqual("https", check_protocol("https://www.google.com"))
-        self.assertEqual("http", check_protocol("http://www.google.com"))
+    def test_reused_cards_are_recorded(self):
+        fresh_path, reused_path = self.run_twice(['get_whois', 'get_amp'])
+        fresh = CardRecord.load(os.path.join(fresh_path, RECORD_NAME))
+        reused = CardRecord.load(os.path.join(reused_path, RECORD_NAME))
+        self.assertEqual(sorted(reused.cards), ['amp', 'whois'])
+        self.assertEqual(reused.to_dict(), dict(fresh.to_dict(), cards=reused.cards))
 
+    def test_reused_outputs_match_fresh_outputs(self):
+        stages = ['get_whois', 'get_amp']
+        fresh_path, reused_path = self.run_twice(stages)
+        for name in [name for stage in stages for name in STAGE_OUTPUTS[stage]]:
+            with open(os.path.join(fresh_path, name), 'rb') as fresh, \
+                    open(os.path.join(reused_path, name), 'rb') as reused:
+                self.assertEqual(fresh.read(), reused.read(), name)
+        # The cards of the reused stages are listed in the order of the stages instead of the order they finished in
+        fresh, reused = (CardRecord.load(os.path.join(path, RECORD_NAME)).to_dict()
+                         for path in (fresh_path, reused_path))
+        self.assertEqual(dict(reused, cards=sorted(reused['cards'])), dict(fresh, cards=sorted(fresh['cards'])))
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,183 @@
+import os
+import re
+import html
+import codecs
+import threading
+import urllib.parse
+
+from typing import Optional, Tuple, Union
+
+import requests
+
+from decouple import config
+from requests.adapters import HTTPAdapter
+from requests.compat import chardet
+
+from tracing import tracer
+from deadline import DeadlineExceeded, current, limit
+
+# (connect timeout, read timeout) in seconds
+DEFAULT_TIMEOUT = (5, 20)
+# Maximum number of open connections to a single host
+MAX_CONNECTIONS_PER_HOST = config('HTTP_MAX_CONNECTIONS_PER_HOST', default=4, cast=int)
+# Maximum number of hosts to keep connections to
+MAX_HOSTS = 32
+# Maximum number of bytes `fetch_title` reads from a page
+MAX_TITLE_BYTES = 512 * 1024
+TITLE_CHUNK_SIZE = 16 * 1024
+
+_title_end_pattern = re.compile(rb'</title\s*>', re.IGNORECASE)
+_title_pattern = re.compile(rb'<title(?:\s[^>]*)?>(.*?)</title\s*>', re.IGNORECASE | re.DOTALL)
+_header_charset_pattern = re.compile(r'charset=["\']?([\w.:-]+)', re.IGNORECASE)
+_meta_charset_pattern = re.compile(rb'<meta[^>]+charset=["\']?([\w.:-]+)', re.IGNORECASE)
+
+_session: Optional['Session'] = None
+_session_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+class Session(requests.Session):
+    def __init__(self, timeout: Union[float, Tuple[float, float]] = DEFAULT_TIMEOUT,
+                 max_connections_per_host: int = MAX_CONNECTIONS_PER_HOST):
+        """
+        A requests Session that keeps the connections alive, limits the connections per host
+        and never waits forever for a response (nor longer than the time budget of the caller).
+
+        :param timeout: Default timeout of the requests
+        :param max_connections_per_host: Maximum number of connections to a single host
+            (more concurrent requests to the same host wait for a free connection)
+        """
+        super().__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=MAX_HOSTS, pool_maxsize=max_connections_per_host, pool_block=True)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs['timeout'] = limit(kwargs.get('timeout', self.timeout))
+        with tracer.span('http', method=method, host=urllib.parse.urlsplit(url).netloc) as span:
+            try:
+                res = super().request(method, url, **kwargs)
+            except requests.Timeout as e:
+                deadline = current()
+                if deadline is not None and deadline.expired:
+                    raise DeadlineExceeded(f'{deadline.label}: the budget of {deadline.seconds:g} seconds is spent '
+                                           f'(HTTP request to {url})') from e
+                raise
+            span.attributes['status'] = res.status_code
+            if res.status_code >= 400:
+                span.outcome = 'error'
+            return res
+
+
+def get_session() -> Session:
+    """
+    Gets the shared Session of the process.
+    A forked process gets its own Session instead of sharing the sockets of the parent.
+
+    :return: The Session
+    """
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _lock:
+            if _session is None or _session_pid != os.getpid():
+                _session = Session()
+                _session_pid = os.getpid()
+
+    return _session
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    """
+    Sends a GET request using the shared Session.
+
+    :param url: The URL
+    :param kwargs: Other arguments of `requests.get`
+    :return: The response
+    """
+    return get_session().get(url, **kwargs)
+
+
+def get_content(url: str, **kwargs) -> bytes:
+    """
+    Downloads the body of a URL using the shared Session.
+
+    :param url: The URL
+    :param kwargs: Other arguments of `requests.get`
+    :return: The body of the response
+    """
+    res = get(url, **kwargs)
+    res.raise_for_status()
+    return res.content
+
+
+def _detect_encoding(content_type: str, body: bytes) -> str:
+    """
+    Finds the encoding of an HTML page using the Content-Type header, the meta tags and finally
+    guessing from the bytes.
+
+    :param content_type: The Content-Type header
+    :param body: The (beginning of the) body
+    :return: Name of a known encoding
+    """
+    candidates = []
+    if match := _header_charset_pattern.search(content_type or ''):
+        candidates.append(match.group(1))
+    if match := _meta_charset_pattern.search(body):
+        candidates.append(match.group(1).decode('ascii', 'ignore'))
+
+    for encoding in candidates:
+        try:
+            return codecs.lookup(encoding).name
+        except LookupError:
+            continue
+
+    # Guessing is slow, so it's only done when the page doesn't declare a known encoding
+    encoding = chardet.detect(body).get('encoding')
+    if encoding:
+        try:
+            return codecs.lookup(encoding).name
+        except LookupError:
+            pass
+
+    return 'utf-8'
+
+
+def fetch_title(url: str, max_bytes: int = MAX_TITLE_BYTES, chunk_size: int = TITLE_CHUNK_SIZE,
+                **kwargs) -> Optional[str]:
+    """
+    Gets the title of a web page without downloading the whole page.
+    The body is read in chunks and the download stops as soon as `</title>` is found
+    or `max_bytes` are read.
+
+    :param url: URL of the page
+    :param max_bytes: Maximum number of bytes to read
+    :param chunk_size: Number of bytes to read at once
+    :param kwargs: Other arguments of `requests.get`
+    :return: The title or None if the page doesn't have a title
+    """
+    body = bytearray()
+    with get(url, stream=True, **kwargs) as res:
+        content_type = res.headers.get('Content-Type', '')
+        for chunk in res.iter_content(chunk_size):
+            # `</title>` may be split between two chunks
+            search_from = max(0, len(body) - 16)
+            body += chunk
+            if _title_end_pattern.search(body, search_from) or len(body) >= max_bytes:
+                break
+
+    match = _title_pattern.search(body)
+    if match is None:
+        return None
+
+    title = match.group(1).decode(_detect_encoding(content_type, bytes(body)), 'replace')
+    return html.unescape(title)
+
+
+def _reset_lock():
+    global _lock
+    _lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_lock)
@@ -0,0 +1,323 @@
+import os
+import json
+import time
+import uuid
+import random
+import sqlite3
+import urllib.parse
+
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+from decouple import config
+
+from lookup_cache import SQLiteConnectionMixin, open_sqlite, user_cache_dir
+
+QUEUE_URL = config('JOB_QUEUE', default='sqlite:///' + os.path.join(user_cache_dir(), 'jobs.sqlite3'))
+# Seconds a claimed job stays with its worker without a heartbeat; then another worker can claim it
+DEFAULT_LEASE = config('JOB_LEASE', default=10 * 60, cast=float)
+DEFAULT_MAX_ATTEMPTS = config('JOB_MAX_ATTEMPTS', default=3, cast=int)
+# Failed jobs are retried after BACKOFF_BASE, 2 * BACKOFF_BASE, 4 * BACKOFF_BASE, ... seconds (up to BACKOFF_MAX)
+BACKOFF_BASE = config('JOB_BACKOFF', default=30, cast=float)
+BACKOFF_MAX = 60 * 60
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+DEAD = 'dead'
+STATUSES = (PENDING, RUNNING, DONE, DEAD)
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY,
+        url TEXT NOT NULL,
+        stages TEXT NOT NULL,
+        priority INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL,
+        max_attempts INTEGER NOT NULL,
+        available REAL NOT NULL,
+        lease_until REAL,
+        token TEXT,
+        worker TEXT,
+        error TEXT,
+        result TEXT,
+        created REAL NOT NULL,
+        updated REAL NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS jobs_next ON jobs (status, priority DESC, id)',
+)
+
+
+class LeaseLost(Exception):
+    """The lease of a job expired and the job was claimed by another worker."""
+
+
+class Job:
+    def __init__(self, id: int, url: str, stages: List[str], priority: int = 0, attempts: int = 0,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, token: str = None, worker: str = None,
+                 status: str = PENDING, error: str = None, result: dict = None):
+        self.id = id
+        self.url = url
+        self.stages = stages
+        self.priority = priority
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+        # Identifies the claim; a worker whose lease was taken over can't finish the job anymore
+        self.token = token
+        self.worker = worker
+        self.status = status
+        self.error = error
+        self.result = result
+
+    def to_dict(self) -> dict:
+        return {'id': self.id, 'url': self.url, 'stages': self.stages, 'priority': self.priority,
+                'attempts': self.attempts, 'max_attempts': self.max_attempts, 'worker': self.worker,
+                'status': self.status, 'error': self.error, 'result': self.result}
+
+    def __repr__(self):
+        return f'Job({self.id}, {self.url!r}, status={self.status!r}, attempts={self.attempts})'
+
+
+def backoff_delay(attempts: int, base: float = BACKOFF_BASE, maximum: float = BACKOFF_MAX) -> float:
+    """
+    Gets the time to wait before retrying a job (exponential, with up to 10% jitter so retries spread out).
+
+    :param attempts: Number of attempts so far
+    :param base: The first delay in seconds
+    :param maximum: The longest delay in seconds
+    :return: The delay in seconds
+    """
+    delay = min(maximum, base * 2 ** max(0, attempts - 1))
+    return delay * (1 + random.random() / 10)
+
+
+class JobQueue:
+    """
+    The interface of the queue backends.
+    A job is claimed under a lease that the worker renews with `heartbeat`;
+    if the worker dies, the lease expires and the job is claimed again, so no job is lost.
+    """
+
+    def enqueue(self, urls: Iterable[str], stages: Iterable[str], priority: int = 0,
+                max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> List[int]:
+        """
+        Adds jobs to the queue.
+
+        :param urls: The URLs to analyze
+        :param stages: Names of the stages to run for every URL
+        :param priority: Jobs with a higher priority are claimed first
+        :param max_attempts: Number of times a job is tried before it's dead-lettered
+        :return: IDs of the jobs
+        """
+        raise NotImplementedError
+
+    def claim(self, worker: str, lease: float = DEFAULT_LEASE) -> Optional[Job]:
+        """
+        Takes the next job.
+
+        :param worker: Name of the worker
+        :param lease: Seconds the job stays with the worker without a heartbeat
+        :return: The job or None if there is no job to do now
+        """
+        raise NotImplementedError
+
+    def heartbeat(self, job: Job, lease: float = DEFAULT_LEASE):
+        """
+        Renews the lease of a job.
+
+        :param job: The claimed job
+        :param lease: Seconds from now
+        :raise LeaseLost: If the job was claimed by another worker
+        """
+        raise NotImplementedError
+
+    def complete(self, job: Job, result: dict):
+        """
+        Records the result of a finished job.
+
+        :param job: The claimed job
+        :param result: The manifest record of the URL
+        :raise LeaseLost: If the job was claimed by another worker
+        """
+        raise NotImplementedError
+
+    def fail(self, job: Job, error: str, result: dict = None, retry: bool = True) -> str:
+        """
+        Records a failed attempt; the job is retried after a backoff or dead-lettered after its last attempt.
+
+        :param job: The claimed job
+        :param error: The error
+        :param result: The manifest record of the attempt (if any)
+        :param retry: If False, the job is dead-lettered right away (e.g. for an invalid URL)
+        :return: The new status of the job (`pending` or `dead`)
+        :raise LeaseLost: If the job was claimed by another worker
+        """
+        raise NotImplementedError
+
+    def jobs(self, status: str = None, limit: int = None) -> List[Job]:
+        """
+        Lists the jobs.
+
+        :param status: Only the jobs of this status
+        :param limit: Maximum number of jobs
+        :return: The jobs, oldest first
+        """
+        raise NotImplementedError
+
+    def requeue(self, ids: Iterable[int] = None) -> int:
+        """
+        Puts dead-lettered jobs back in the queue with their attempts reset.
+
+        :param ids: IDs of the jobs (defaults to all the dead jobs)
+        :return: Number of requeued jobs
+        """
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, int]:
+        """Gets the number of jobs of every status."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SQLiteQueue(SQLiteConnectionMixin, JobQueue):
+    def __init__(self, path: Union[str, os.PathLike]):
+        """
+        A job queue in a SQLite database, for the workers of one host.
+        Claims are made in `BEGIN IMMEDIATE` transactions, so two workers never get the same job.
+
+        :param path: Path of the database
+        """
+        super().__init__()
+        self.path = os.fspath(path)
+
+    def _connect(self) -> sqlite3.Connection:
+        # An acknowledged job must survive a crash of the host too
+        return open_sqlite(self.path, SCHEMA, pragmas=('synchronous=FULL',))
+
+    def _transaction(self, func: Callable[[sqlite3.Connection], object]):
+        connection = self.connection
+        with self._lock:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                value = func(connection)
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+        return value
+
+    @staticmethod
+    def _job(row) -> Job:
+        return Job(row[0], row[1], json.loads(row[2]), row[3], row[5], row[6], row[9], row[10], row[4], row[11],
+                   json.loads(row[12]) if row[12] else None)
+
+    def enqueue(self, urls: Iterable[str], stages: Iterable[str], priority: int = 0,
+                max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> List[int]:
+        now = time.time()
+        stages = json.dumps(list(stages))
+
+        def insert(connection: sqlite3.Connection) -> List[int]:
+            return [connection.execute('''INSERT INTO jobs (url, stages, priority, status, attempts, max_attempts,
+                available, created, updated) VALUES (?, ?, ?, ?, 0, ?, ?, ?, ?)''',
+                                       (url, stages, priority, PENDING, max_attempts, now, now, now)).lastrowid
+                    for url in urls]
+
+        return self._transaction(insert)
+
+    def claim(self, worker: str, lease: float = DEFAULT_LEASE) -> Optional[Job]:
+        def take(connection: sqlite3.Connection) -> Optional[Job]:
+            now = time.time()
+            # The workers of these jobs died (or hung) on their last attempt
+            connection.execute('''UPDATE jobs SET status = ?, error = 'The lease expired on the last attempt',
+                token = NULL, updated = ? WHERE status = ? AND lease_until < ? AND attempts >= max_attempts''',
+                               (DEAD, now, RUNNING, now))
+            row = connection.execute('''SELECT id FROM jobs
+                WHERE (status = ? AND available <= ?) OR (status = ? AND lease_until < ?)
+                ORDER BY priority DESC, id LIMIT 1''', (PENDING, now, RUNNING, now)).fetchone()
+            if row is None:
+                return None
+            connection.execute('''UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, token = ?,
+                worker = ?, updated = ? WHERE id = ?''', (RUNNING, now + lease, uuid.uuid4().hex, worker, now, row[0]))
+            return self._job(connection.execute('SELECT * FROM jobs WHERE id = ?', (row[0],)).fetchone())
+
+        return self._transaction(take)
+
+    def _update(self, job: Job, query: str, parameters: tuple):
+        def update(connection: sqlite3.Connection):
+            if connection.execute(f'UPDATE jobs SET {query} WHERE id = ? AND token = ?',
+                                  parameters + (job.id, job.token)).rowcount != 1:
+                raise LeaseLost(f'Job {job.id} was claimed by another worker')
+
+        self._transaction(update)
+
+    def heartbeat(self, job: Job, lease: float = DEFAULT_LEASE):
+        now = time.time()
+        self._update(job, 'lease_until = ?, updated = ?', (now + lease, now))
+
+    def complete(self, job: Job, result: dict):
+        self._update(job, 'status = ?, token = NULL, lease_until = NULL, error = NULL, result = ?, updated = ?',
+                     (DONE, json.dumps(result), time.time()))
+        job.status = DONE
+
+    def fail(self, job: Job, error: str, result: dict = None, retry: bool = True) -> str:
+        now = time.time()
+        status = PENDING if retry and job.attempts < job.max_attempts else DEAD
+        self._update(job, 'status = ?, token = NULL, lease_until = NULL, error = ?, result = ?, available = ?, '
+                          'updated = ?', (status, error, json.dumps(result) if result else None,
+                                          now + backoff_delay(job.attempts), now))
+        job.status = status
+        return status
+
+    def jobs(self, status: str = None, limit: int = None) -> List[Job]:
+        connection = self.connection
+        with self._lock:
+            rows = connection.execute(
+                'SELECT * FROM jobs WHERE ? IS NULL OR status = ? ORDER BY id LIMIT ?',
+                (status, status, -1 if limit is None else limit)
+            ).fetchall()
+
+        return [self._job(row) for row in rows]
+
+    def requeue(self, ids: Iterable[int] = None) -> int:
+        now = time.time()
+        ids = None if ids is None else list(ids)
+
+        def update(connection: sqlite3.Connection) -> int:
+            query = 'UPDATE jobs SET status = ?, attempts = 0, available = ?, updated = ? WHERE status = ?'
+            if ids is None:
+                return connection.execute(query, (PENDING, now, now, DEAD)).rowcount
+            return sum(connection.execute(query + ' AND id = ?', (PENDING, now, now, DEAD, i)).rowcount for i in ids)
+
+        return self._transaction(update)
+
+    def stats(self) -> Dict[str, int]:
+        connection = self.connection
+        with self._lock:
+            rows = connection.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+
+        stats = dict.fromkeys(STATUSES, 0)
+        stats.update(rows)
+        return stats
+
+
+# Queue backends by the scheme of the queue URL; other backends (e.g. for a shared server) can be added here
+BACKENDS: Dict[str, Callable[[urllib.parse.SplitResult], JobQueue]] = {
+    'sqlite': lambda url: SQLiteQueue(urllib.parse.unquote(url.path)),
+}
+
+
+def open_queue(url: str = QUEUE_URL) -> JobQueue:
+    """
+    Opens a job queue.
+
+    :param url: URL of the queue (e.g. `sqlite:///path/to/jobs.sqlite3`); a plain path is a SQLite queue
+    :return: The queue
+    """
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme not in BACKENDS:
+        if '://' not in url:
+            return SQLiteQueue(url)
+        raise ValueError(f'Unknown queue backend: {parsed.scheme} (supported: {", ".join(BACKENDS)})')
+    return BACKENDS[parsed.scheme](parsed)
@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from typing import Any, Callable, Dict, Iterable, Optional, Union
+
+from decouple import config
+
+
+def user_cache_dir() -> str:
+    """
+    Gets the directory the analyzer keeps its caches in.
+
+    :return: Path of the directory
+    """
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+
+    return os.path.join(base, 'website-analyzer')
+
+
+CACHE_PATH = config('LOOKUP_CACHE', default=os.path.join(user_cache_dir(), 'lookups.sqlite3'))
+# Maximum size of the cached values
+MAX_BYTES = config('LOOKUP_CACHE_MAX_BYTES', default=256 * 1024 * 1024, cast=int)
+
+# Time to live of every kind of lookup in seconds
+DEFAULT_TTLS = {
+    'ip': 24 * 60 * 60,
+    'flag': 30 * 24 * 60 * 60,
+    'favicon': 7 * 24 * 60 * 60,
+    'whois': 24 * 60 * 60,
+    'resource_size': 7 * 24 * 60 * 60,
+}
+DEFAULT_TTL = 24 * 60 * 60
+# Don't write the access time of an entry again if it was accessed less than this many seconds ago
+TOUCH_INTERVAL = 60
+
+_cache: Optional['LookupCache'] = None
+# Guards the shared cache and the resets of the connections in a forked process
+_lock = threading.Lock()
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS entries (
+        kind TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        created REAL NOT NULL,
+        accessed REAL NOT NULL,
+        PRIMARY KEY (kind, key)
+    )''',
+    'CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)',
+)
+
+
+def open_sqlite(path: Union[str, os.PathLike], schema: Iterable[str] = (),
+                pragmas: Iterable[str] = ()) -> sqlite3.Connection:
+    """
+    Opens a SQLite database that several threads and processes can share
+    (in WAL mode and without implicit transactions).
+
+    :param path: Path of the database (its directory is made if it doesn't exist)
+    :param schema: Statements that make the tables and indexes (`CREATE ... IF NOT EXISTS`)
+    :param pragmas: Extra pragmas (e.g. `synchronous=FULL`)
+    :return: The connection
+    """
+    path = os.fspath(path)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+    connection.execute('PRAGMA journal_mode=WAL')
+    for pragma in pragmas:
+        connection.execute(f'PRAGMA {pragma}')
+    for statement in schema:
+        connection.execute(statement)
+    return connection
+
+
+class SQLiteConnectionMixin:
+    """
+    Keeps one SQLite connection (made by `_connect`) per process, opened on first use.
+    A forked process opens its own connection and gets its own lock; `self._lock` guards the connection.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid = os.getpid()
+
+    def _connect(self) -> sqlite3.Connection:
+        raise NotImplementedError
+
+    def _forked(self):
+        """Resets the per-process state of the subclass in a new process."""
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            with _lock:
+                if self._pid != os.getpid():
+                    self._lock = threading.Lock()
+                    self._connection = None
+                    self._forked()
+                    # Set last, so the other threads wait until the state is reset
+                    self._pid = os.getpid()
+        if self._connection is None:
+            with self._lock:
+                if self._connection is None:
+                    self._connection = self._connect()
+
+        return self._connection
+
+    def close(self):
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._connection = None
+
+
+class LookupCache(SQLiteConnectionMixin):
+    def __init__(self, path: Union[str, os.PathLike] = CACHE_PATH, ttls: Dict[str, float] = None,
+                 max_bytes: int = MAX_BYTES):
+        """
+        An on-disk cache for the results of network lookups.
+        Entries are keyed by the kind of the lookup and a key, expire after the TTL of their kind
+        and the least recently used ones are evicted when the cache grows bigger than `max_bytes`.
+        It's safe to use the same file from several threads and processes.
+
+        :param path: Path of the SQLite database
+        :param ttls: Time to live of every kind of lookup in seconds
+        :param max_bytes: Maximum total size of the cached values
+        """
+        super().__init__()
+        self.path = os.fspath(path)
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.max_bytes = max_bytes
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        # Estimate of the total size of the values; it's only summed up again when it passes `max_bytes`
+        self._total: Optional[int] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        return open_sqlite(self.path, SCHEMA)
+
+    def _forked(self):
+        self._total = None
+
+    def get(self, kind: str, key: str) -> Optional[bytes]:
+        """
+        Gets a value from the cache.
+
+        :param kind: Kind of the lookup (e.g. `ip`)
+        :param key: Key of the lookup (e.g. the domain)
+        :return: The value or None if it's not cached or has expired
+        """
+        now = time.time()
+        connection = self.connection
+        with self._lock:
+            row = connection.execute('SELECT value, created, accessed FROM entries WHERE kind = ? AND key = ?',
+                                     (kind, key)).fetchone()
+            if row is None or now - row[1] > self.ttls.get(kind, DEFAULT_TTL):
+                self.misses[kind] = self.misses.get(kind, 0) + 1
+                return None
+
+            if now - row[2] > TOUCH_INTERVAL:
+                connection.execute('UPDATE entries SET accessed = ? WHERE kind = ? AND key = ?',
+                                   (now, kind, key))
+            self.hits[kind] = self.hits.get(kind, 0) + 1
+
+        return row[0]
+
+    def set(self, kind: str, key: str, value: bytes):
+        """
+        Puts a value in the cache.
+
+        :param kind: Kind of the lookup (e.g. `ip`)
+        :param key: Key of the lookup (e.g. the domain)
+        :param value: The value
+        """
+        now = time.time()
+        connection = self.connection
+        with self._lock:
+            connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                               (kind, key, value, len(value), now, now))
+            if self._total is None:
+                self._total = self._sum(connection)
+            else:
+                # Replaced values and the writes of other processes make the estimate drift; it's corrected below
+                self._total += len(value)
+            if self._total > self.max_bytes:
+                self._evict(connection)
+
+    @staticmethod
+    def _sum(connection: sqlite3.Connection) -> int:
+        return connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def _evict(self, connection: sqlite3.Connection):
+        total = self._sum(connection)
+        while total > self.max_bytes:
+            rows = connection.execute('SELECT rowid, size FROM entries ORDER BY accessed LIMIT 64').fetchall()
+            if not rows:
+                break
+            for rowid, size in rows:
+                connection.execute('DELETE FROM entries WHERE rowid = ?', (rowid,))
+                total -= size
+                if total <= self.max_bytes:
+                    break
+        self._total = total
+
+    def get_json(self, kind: str, key: str) -> Any:
+        value = self.get(kind, key)
+        return None if value is None else json.loads(value)
+
+    def set_json(self, kind: str, key: str, value: Any):
+        self.set(kind, key, json.dumps(value).encode())
+
+    def cached(self, kind: str, key: str, func: Callable[[], bytes]) -> bytes:
+        """
+        Gets a value from the cache or computes and caches it.
+
+        :param kind: Kind of the lookup
+        :param key: Key of the lookup
+        :param func: The function that does the lookup
+        :return: The value
+        """
+        value = self.get(kind, key)
+        if value is None:
+            value = func()
+            self.set(kind, key, value)
+        return value
+
+    def cached_json(self, kind: str, key: str, func: Callable[[], Any]) -> Any:
+        value = self.get_json(kind, key)
+        if value is None:
+            value = func()
+            self.set_json(kind, key, value)
+        return value
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Gets the number of hits and misses of every kind of lookup in this process.
+
+        :return: {kind: {'hits': ..., 'misses': ...}}
+        """
+        return {kind: {'hits': self.hits.get(kind, 0), 'misses': self.misses.get(kind, 0)}
+                for kind in sorted(set(self.hits) | set(self.misses))}
+
+    def clear(self):
+        """Removes all the entries."""
+        connection = self.connection
+        with self._lock:
+            connection.execute('DELETE FROM entries')
+            self._total = 0
+
+
+def get_cache() -> LookupCache:
+    """Gets the shared LookupCache of the process."""
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = LookupCache()
+    return _cache
+
+
+def _reset_lock():
+    global _lock
+    _lock = threading.Lock()
+
+
+# A forked child must not inherit a lock held by another thread of the parent
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_lock)
+
+
+def format_stats(stats: Dict[str, Dict[str, int]]) -> str:
+    """
+    Formats the cache stats for the logs.
+
+    :param stats: The output of `LookupCache.stats`
+    :return: e.g. `ip: 3 hits, 1 misses; flag: 4 hits, 0 misses`
+    """
+    return '; '.join(f"{kind}: {counts['hits']} hits, {counts['misses']} misses" for kind, counts in stats.items()) \
+        or 'not used'
@@ -1,19 +1,20 @@
 # Import regex
+import io
 import json
 import os
+import pstats
+import cProfile
 import shutil
+import datetime
 import zipfile
+import threading
 import urllib.parse
 
-from time import sleep
-from typing import Union
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import log21
-import whois21
-import requests
 
-from bs4 import BeautifulSoup
-from PIL import (Image, ImageFont, ImageDraw, )
 from decouple import config
 
 from selenium import webdriver
@@ -24,10 +25,87 @@ from selenium.common import (
 )
 from selenium.webdriver import Keys
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions
 
-from driver_downloader import get_chrome_driver
+from cards import CardRecord, RECORD_NAME, render_card
+from asset_registry import has_flag
+import http_client
+import endpoints
+import geoip
+from lookup_cache import get_cache
+from scheduler import Stage, StageScheduler, ScheduleReport, BROWSER, NETWORK, CPU
+from waiting import wait_for, wait_for_element, WaitRecord, POLL
+from optimizer import optimize_directory
+from capture import capture, ImageWriter, FULL
+from tracing import span, attributes, in_context
+from stage_cache import get_stage_cache
+from output_store import OutputStore, get_store
+from network_policy import STAGE_POLICIES, apply_policy, drain_log, network_stats
+from session_store import SessionStore, get_session_store, get_cookies, set_cookies
+from deadline import DeadlineExceeded, budget, limit, hedged, unbounded
+
+STAGES = ('get_whois', 'get_responsive', 'get_gtmetrix', 'get_backlinks', 'get_amp', 'get_ssl')
+# Short names of the stages (`whois` for `get_whois`, ...)
+STAGE_NAMES = tuple(stage[len('get_'):] for stage in STAGES)
+# Resources every stage needs while it's running
+STAGE_RESOURCES = {
+    'get_whois': (NETWORK, CPU),
+    'get_responsive': (BROWSER,),
+    'get_gtmetrix': (BROWSER,),
+    'get_backlinks': (BROWSER,),
+    'get_amp': (CPU,),
+    'get_ssl': (BROWSER, NETWORK),
+}
+
+
+def normalize_stages(stages: Iterable[str]) -> List[str]:
+    """
+    Converts short stage names to the names of the stages and drops the duplicates.
+
+    :param stages: Names of the stages, with or without the `get_` prefix (e.g. `whois` or `get_whois`)
+    :return: The names of the stages (e.g. `get_whois`) in their first order
+    """
+    return list(dict.fromkeys(stage if stage in STAGES else f'get_{stage}' for stage in stages))
+
+
+def needs_browser(stages: Iterable[str]) -> bool:
+    """
+    Checks if any of the stages uses the browser.
+
+    :param stages: Names of the stages
+    :return: True if a browser has to be started for the stages
+    """
+    return any(BROWSER in STAGE_RESOURCES.get(stage, (BROWSER,)) for stage in stages)
+
+
+# Files every stage saves
+STAGE_OUTPUTS = {
+    'get_whois': ('whois.png',),
+    'get_responsive': ('responsive.png',),
+    'get_gtmetrix': ('gtmetrix.png',),
+    'get_backlinks': ('backlinks.png',),
+    'get_amp': ('AMP.png',),
+    'get_ssl': ('ssl.png',),
+}
+# The card (see `cards.py`) every stage draws
+CARD_STAGES = {'get_whois': 'whois', 'get_amp': 'amp', 'get_ssl': 'ssl'}
+# Seconds to wait for an element to appear
+ELEMENT_TIMEOUT = 10
+# Seconds to wait for an element (e.g. GTMetrix's "analyzing" heading) to go away
+WAIT_UNTIL_TIMEOUT = 300
+# The time budget of every stage in seconds; the page loads, waits and requests of a stage are cut short by it
+STAGE_TIMEOUTS = {
+    'get_whois': 60,
+    'get_responsive': 120,
+    'get_gtmetrix': 480,
+    'get_backlinks': 180,
+    'get_amp': 60,
+    'get_ssl': 120,
+}
+# If set, the lookups (IP, flag, WHOIS over RDAP and favicon) that haven't answered after this many seconds
+# (or have failed) are sent again and the first answer is used
+HEDGE_AFTER = config('HEDGE_AFTER', default=0, cast=float)
+# Seconds to bring the browser back to a blank page after a stage ran out of time
+RECOVERY_TIMEOUT = 10
 
 
 def is_valid_url(url) -> bool:
@@ -52,31 +130,85 @@ def is_valid_url(url) -> bool:
 
 class Analyzer:
     def __init__(self, url, name: str = "Analyzer", chromedriver_path: Union[str, os.PathLike] = None,
-                 verbose: bool = False):
-        # Config Important Options for Webdriver
-        self._options = webdriver.ChromeOptions()
-        self._options.add_argument("--window-size=1280,1024")
-        prefs = {"download.default_directory": os.getcwd()}
-        self._options.add_experimental_option("prefs", prefs)
-        self._options.add_experimental_option('excludeSwitches', ['enable-logging'])
-        self._options.add_argument('--headless')
-        if not verbose:
-            self._options.add_argument('log-level=3')
-
-        self.name = name
+                 verbose: bool = False, driver: 'webdriver.Chrome' = None, wait_strategy: str = POLL,
+                 capture_method: str = FULL, background_encoding: bool = True, store: OutputStore = None,
+                 block_requests: bool = True, stage_timeouts: Dict[str, Optional[float]] = None,
+                 hedge_after: float = HEDGE_AFTER):
+        self.verbose = verbose
+
+        self.file_location = os.path.dirname(__file__)
+        # Where the output directories are reserved
+        self.store = store or get_store()
+        # How to wait for page changes (`poll` or `mutation`) and how long every wait blocked
+        self.wait_strategy = wait_strategy
+        self.waits: List[WaitRecord] = []
+        # How to take the screenshots (`full` or `clip`) and whether to encode them on a background thread
+        self.capture_method = capture_method
+        self._writer = ImageWriter(background_encoding)
+        # Block the requests the browser stages don't need (see network_policy.STAGE_POLICIES)
+        self.block_requests = block_requests
+        # Requests and bytes of the browser stages of the last run
+        self.network: Dict[str, dict] = {}
+        # The time budget of every stage (None for no limit) and when to hedge the lookups (0 for never)
+        self.stage_timeouts = dict(STAGE_TIMEOUTS)
+        self.stage_timeouts.update(stage_timeouts or {})
+        self.hedge_after = hedge_after
+        self._pending_captures: List[Tuple[str, Future]] = []
+        # Stages whose outputs were recorded in the stage cache (and the time they were recorded)
+        self._recorded: Dict[str, float] = {}
+        # A driver that is given to the analyzer (e.g. by a DriverPool) is not quit by it
+        self._owns_driver = driver is None
+        # Otherwise the browser is only started when a stage needs it
+        self._chromedriver_path = chromedriver_path
+        self._driver = driver
+        self._driver_lock = threading.Lock()
+        # The tab of the stage running on each thread when the browser stages run in tabs
+        self._tab = threading.local()
+        self.load(url, name)
+
+    @property
+    def driver(self) -> 'webdriver.Chrome':
+        """The browser (started on first use), or the tab of the running stage."""
+        tab = getattr(self._tab, 'driver', None)
+        if tab is not None:
+            return tab
+        if self._driver is None:
+            with self._driver_lock:
+                if self._driver is None:
+                    # Selenium's WebDriver classes take a while to import, so they are only loaded for the browser
+                    from driver_pool import create_driver
+
+                    self._driver = create_driver(self._chromedriver_path, self.verbose)
+                    self._owns_driver = True
+        return self._driver
+
+    @driver.setter
+    def driver(self, driver: 'webdriver.Chrome'):
+        self._driver = driver
+
+    def load(self, url, name: str = None):
+        """
+        Points the analyzer to a new URL, so the same instance (and its driver) can be reused for many websites.
+
+        :param url: URL you want to analyze
+        :param name: Name of the output directory (keeps the current name if not given)
+        """
+        if name is not None:
+            self.name = name
         self.url = url
         parsed_url = urllib.parse.urlsplit(url)
         self.scheme = parsed_url.scheme
         self.domain = parsed_url.netloc
         self.url_path = parsed_url.path
-        self.file_location = os.path.dirname(__file__)
         self.saved_path = self.set_save_path()
-        self.driver = webdriver.Chrome(get_chrome_driver(remove_zip=True, path=chromedriver_path),
-                                       options=self._options)
+        self._recorded = {}
+        # What the cards show; saved with them, so they can be rendered again without the lookups
+        self.card = CardRecord(url)
 
     def set_save_path(self) -> str:
         """
         Sets the save path for the images.
+        A new directory is reserved in the output store (sharded by date and indexed by URL).
 
         :return: The save path for the images.
         """
@@ -85,16 +217,353 @@ class Analyzer:
         if os.path.isdir(self.saved_path) and not os.listdir(self.saved_path):
             return self.saved_path
 
-        self.saved_path = os.path.join(self.file_location, "save", self.name)
+        self.saved_path = self.store.reserve(self.name, self.url)
 
-        i = 2
-        while os.path.exists(self.saved_path):
-            self.saved_path = os.path.join(self.file_location, "save", f'{self.name}-{i}')
-            i += 1
+        return self.saved_path
 
-        os.makedirs(self.saved_path)
+    def run_stages(self, stages: Iterable[str] = STAGES, concurrent: bool = True,
+                   profile: Iterable[str] = (), max_age: Optional[float] = None, tabs: int = 1,
+                   on_stage: Optional[Callable[[str, dict], None]] = None,
+                   deadline: Optional[float] = None) -> ScheduleReport:
+        """
+        Runs the given analyze stages.
+        Stages that don't need the same resources (e.g. the browser) run at the same time.
+        A failing stage is logged and doesn't stop the other ones.
+        Every stage and its page loads, waits, HTTP calls and image encodes are recorded as tracing spans.
+        The outputs of the successful stages are recorded in the stage cache.
+
+        :param stages: Names of the stages (methods) to run
+        :param concurrent: If False, runs the stages one after another
+        :param profile: Names of the stages to run under cProfile (the stats are saved as `<stage>.prof`)
+        :param max_age: If given, stages whose recorded outputs are younger than this many seconds are not run;
+            their outputs are hard-linked (or copied) into the save path and reported as `cached`
+        :param tabs: Run up to this many browser stages at the same time, each in a tab of the same browser
+            (only with `concurrent`)
+        :param on_stage: Called with the name and the result of every stage as soon as its outputs are saved
+            (from another thread); the result has the paths of the outputs as `artifacts`
+        :param deadline: The time budget of the whole run in seconds; stages that run out of it are reported as
+            `timeout` (like the ones that run out of their own budget, see `stage_timeouts`)
+        :return: The report containing every stage's status, running time and error (if any)
+        """
+        stages = list(stages)
+        reused = self._reuse_outputs(stages, max_age) if max_age else {}
+        notified: List[threading.Event] = []
+        if on_stage:
+            for stage, result in reused.items():
+                notified.append(self._notify(on_stage, stage, result))
+        profile = set(profile)
+        self.network = {}
+        tab_set = None
+        if tabs > 1 and concurrent and needs_browser(stage for stage in stages if stage not in reused):
+            from tabs import TabSet
+
+            tab_set = TabSet(self.driver, tabs)
+
+        def stage_func(stage: str) -> Callable[[], None]:
+            func = self._profiled(stage) if stage in profile else getattr(self, stage)
+            return self._in_tab(tab_set, stage, self._with_budget(stage, self._with_network_policy(stage, func)))
+
+        scheduler = StageScheduler(
+            (Stage(stage, stage_func(stage), STAGE_RESOURCES.get(stage, (BROWSER,)))
+             for stage in stages if stage not in reused),
+            limits={BROWSER: tabs} if tab_set else None, concurrent=concurrent
+        )
+        try:
+            with attributes(url=self.url), budget(deadline, 'run'):
+                report = scheduler.run(
+                    (lambda stage, result: notified.append(self._notify(on_stage, stage, result))) if on_stage else None
+                )
+        finally:
+            if tab_set:
+                tab_set.close()
+        for stage, stats in self.network.items():
+            if stage in report.results:
+                report.results[stage]['network'] = stats
+        self._wait_for_captures(report)
+        if self.card.cards:
+            self.card.save(os.path.join(self.saved_path, RECORD_NAME))
+        self._record_outputs(report)
+        report.results.update(reused)
+        # Every stage is reported before run_stages returns
+        for event in notified:
+            event.wait()
+        log21.debug(f'run_stages: {report.busy_time:.2f} seconds of work done in {report.wall_time:.2f} seconds, '
+                    f'overlapping saved {report.saved_time:.2f} seconds')
+
+        return report
+
+    def _notify(self, on_stage: Callable[[str, dict], None], stage: str, result: dict) -> threading.Event:
+        """
+        Calls `on_stage` for a finished stage once the images it's saving in the background are saved.
 
-        return self.saved_path
+        :param on_stage: The callback of `run_stages`
+        :param stage: Name of the stage
+        :param result: The result of the stage
+        :return: An event that is set once `on_stage` has returned
+        """
+        futures = [future for name, future in self._pending_captures if name == stage]
+        remaining = [len(futures)]
+        lock = threading.Lock()
+        notified = threading.Event()
+
+        def saved(_=None):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            event = dict(result)
+            for future in futures:
+                if future.exception() is not None:
+                    event['status'] = 'error'
+                    event['error'] = f'{future.exception().__class__.__name__}: {str(future.exception())}'
+            event['artifacts'] = [path for path in (os.path.join(self.saved_path, name)
+                                                    for name in STAGE_OUTPUTS.get(stage, ())) if os.path.isfile(path)]
+            try:
+                on_stage(stage, event)
+            except Exception as e:
+                log21.error(f'on_stage of {stage}: {e.__class__.__name__}: {str(e)}')
+            finally:
+                notified.set()
+
+        if not futures:
+            remaining[0] = 1
+            saved()
+        for future in futures:
+            future.add_done_callback(saved)
+        return notified
+
+    def _stage_parameters(self, stage: str) -> dict:
+        """
+        Gets the parameters the outputs of a stage depend on (besides the URL).
+
+        :param stage: Name of the stage
+        :return: The parameters
+        """
+        if stage == 'get_whois':
+            return {'rdap': endpoints.RDAP_URL}
+        if stage in ('get_responsive', 'get_gtmetrix', 'get_backlinks'):
+            service = {'get_responsive': endpoints.AMIRESPONSIVE_URL, 'get_gtmetrix': endpoints.GTMETRIX_URL,
+                       'get_backlinks': endpoints.BACKLINKS_URL}[stage]
+            return {'service': service, 'capture': self.capture_method}
+        return {}
+
+    def _reuse_outputs(self, stages: Iterable[str], max_age: float) -> Dict[str, dict]:
+        """
+        Links the fresh recorded outputs of the stages into the save path
+        and adds the data of their cards to the card record of this run.
+        A card stage whose record can't be read from the earlier run is run again.
+
+        :param stages: Names of the stages
+        :param max_age: Maximum age of the outputs in seconds
+        :return: The report results of the reused stages
+        """
+        cache = get_stage_cache()
+        reused = {}
+        for stage in stages:
+            if stage not in STAGE_OUTPUTS:
+                continue
+            try:
+                entry = cache.lookup(self.url, stage, self._stage_parameters(stage), max_age)
+                if entry is None:
+                    continue
+                if stage in CARD_STAGES:
+                    self.card.merge(CardRecord.load(os.path.join(entry['saved_path'], RECORD_NAME)),
+                                    CARD_STAGES[stage])
+                cache.reuse(entry, self.saved_path)
+            except Exception as e:
+                log21.warning(f"Couldn't reuse the output of {stage}: {e.__class__.__name__}: {str(e)}")
+                continue
+            log21.info(f"{stage}: reusing the output of {int(entry['age'])} seconds ago")
+            reused[stage] = {'status': 'cached', 'start': 0, 'seconds': 0, 'age': round(entry['age'], 3),
+                             'source': entry['saved_path']}
+
+        return reused
+
+    def _record_outputs(self, report: ScheduleReport):
+        """Records the outputs of the successful stages in the stage cache."""
+        cache = get_stage_cache()
+        for stage, result in report.results.items():
+            if result['status'] != 'ok' or stage not in STAGE_OUTPUTS:
+                continue
+            try:
+                self._recorded[stage] = cache.record(self.url, stage, self._stage_parameters(stage), self.saved_path,
+                                                     STAGE_OUTPUTS[stage])
+            except Exception as e:
+                log21.warning(f"Couldn't record the output of {stage}: {e.__class__.__name__}: {str(e)}")
+
+    def _in_tab(self, tab_set, stage: str, func: Callable[[], None]) -> Callable[[], None]:
+        """
+        Wraps a browser stage to run it in a tab of the TabSet; `self.driver` is the tab while it's running.
+
+        :param tab_set: The TabSet (None runs the stage as is)
+        :param stage: Name of the stage
+        :param func: The stage
+        :return: The wrapped stage
+        """
+        if tab_set is None or BROWSER not in STAGE_RESOURCES.get(stage, (BROWSER,)):
+            return func
+
+        def run():
+            with tab_set.tab() as tab:
+                self._tab.driver = tab
+                try:
+                    func()
+                finally:
+                    self._tab.driver = None
+
+        return run
+
+    def _with_budget(self, stage: str, func: Callable[[], None]) -> Callable[[], None]:
+        """
+        Wraps a stage to run it under its time budget.
+        A stage that runs out of time fails with DeadlineExceeded and, if it used the browser,
+        the page it left loading is stopped so the next stage gets a usable browser.
+
+        :param stage: Name of the stage
+        :param func: The stage
+        :return: The wrapped stage
+        """
+        def run():
+            with budget(self.stage_timeouts.get(stage), stage) as deadline:
+                deadline.check()
+                try:
+                    func()
+                except Exception as e:
+                    # A page load or a wait that was cut short by the budget fails with its own error
+                    if not isinstance(e, DeadlineExceeded) and not deadline.expired:
+                        raise
+                    if BROWSER in STAGE_RESOURCES.get(stage, (BROWSER,)):
+                        self._recover_driver(stage)
+                    if isinstance(e, DeadlineExceeded):
+                        raise
+                    raise DeadlineExceeded(f'{deadline.label}: the budget of {deadline.seconds:g} seconds is spent '
+                                           f'({e.__class__.__name__})') from e
+
+        return run
+
+    def _recover_driver(self, stage: str):
+        """Stops whatever the browser is loading after a stage ran out of time and leaves it on a blank page."""
+        from driver_pool import PAGE_LOAD_TIMEOUT
+
+        driver = self.driver
+        with unbounded():
+            try:
+                driver.execute_script('window.stop()')
+                driver.set_page_load_timeout(RECOVERY_TIMEOUT)
+                driver.get('about:blank')
+                driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+            except Exception as e:
+                log21.warning(f"{stage}: Couldn't reset the browser after the timeout: "
+                              f"{e.__class__.__name__}: {str(e)}")
+
+    def _lookup(self, label: str, func: Callable[[], Any]) -> Any:
+        """Runs an idempotent lookup, hedged if `hedge_after` is set."""
+        if not self.hedge_after:
+            return func()
+        return hedged(func, self.hedge_after, label=label)
+
+    def _with_network_policy(self, stage: str, func: Callable[[], None]) -> Callable[[], None]:
+        """
+        Wraps a browser stage to block the requests it doesn't need while it's running
+        and to count the requests and bytes it loaded and avoided.
+
+        :param stage: Name of the stage
+        :param func: The stage
+        :return: The wrapped stage
+        """
+        policy = STAGE_POLICIES.get(stage)
+        if policy is None:
+            return func
+
+        def run():
+            driver = self.driver
+            # Drop the events of whatever the browser did before this stage
+            drain_log(driver)
+            if self.block_requests:
+                apply_policy(driver, policy)
+            try:
+                func()
+            finally:
+                events = drain_log(driver)
+                if self.block_requests:
+                    try:
+                        apply_policy(driver, None)
+                    except Exception as e:
+                        log21.debug(f'{stage}: Could not unblock the requests: {e.__class__.__name__}: {str(e)}')
+                self.network[stage] = stats = network_stats(events, policy)
+                log21.debug(f"{stage}: {stats['requests']} requests ({stats['bytes']} bytes) loaded, "
+                            f"{stats['blocked_requests']} requests (~{stats['blocked_bytes']} bytes) blocked")
+
+        return run
+
+    def _profiled(self, stage: str) -> Callable[[], None]:
+        """
+        Wraps a stage to run it under cProfile.
+        The stats are saved in the save path as `<stage>.prof` and the slowest calls are logged.
+
+        :param stage: Name of the stage
+        :return: The wrapped stage
+        """
+        func = getattr(self, stage)
+
+        def run():
+            profiler = cProfile.Profile()
+            try:
+                profiler.runcall(func)
+            finally:
+                path = os.path.join(self.saved_path, f'{stage}.prof')
+                profiler.dump_stats(path)
+                output = io.StringIO()
+                pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(15)
+                log21.debug(f'{stage}: profile saved in {path}\n{output.getvalue()}')
+
+        return run
+
+    def _get(self, url: str, timeout: float = None):
+        """
+        Loads a page in the browser and records the page load as a span.
+
+        :param url: URL of the page
+        :param timeout: Seconds to wait for the page (defaults to the page load timeout of the pool);
+            it's cut short by the time budget of the stage
+        """
+        from driver_pool import PAGE_LOAD_TIMEOUT
+
+        self.driver.set_page_load_timeout(limit(timeout or PAGE_LOAD_TIMEOUT))
+        with span('page_load', page=url):
+            self.driver.get(url)
+
+    def _capture(self, stage: str, filename: str, box: Tuple[int, int, int, int]):
+        """
+        Saves a region of the browser window in the save path.
+        With background encoding the stage can go on while the image is being saved;
+        `run_stages` waits for the image and reports its errors for the stage.
+
+        :param stage: Name of the stage that takes the screenshot
+        :param filename: Name of the image file
+        :param box: The (left, upper, right, lower) region of the window
+        """
+        # With the eager page load strategy, images and fonts may still be loading
+        try:
+            wait_for(lambda: self.driver.execute_script('return document.readyState') == 'complete',
+                     ELEMENT_TIMEOUT, label=f'{stage}: page load', records=self.waits)
+        except TimeoutException:
+            log21.debug(f'{stage}: The page is still loading, taking the screenshot anyway')
+        future = capture(self.driver, os.path.join(self.saved_path, filename), box, self.capture_method,
+                         self._writer)
+        self._pending_captures.append((stage, future))
+
+    def _wait_for_captures(self, report: ScheduleReport):
+        """Waits for the images that are being saved in the background and adds their errors to the report."""
+        for stage, future in self._pending_captures:
+            try:
+                future.result()
+            except Exception as e:
+                log21.error(f"Error in {stage}: {e.__class__.__name__}: {str(e)}")
+                if stage in report.results:
+                    report.results[stage]['status'] = 'error'
+                    report.results[stage]['error'] = f"{e.__class__.__name__}: {str(e)}"
+        self._pending_captures = []
 
     def _check_exists(self, by, el) -> bool:
         """
@@ -113,28 +582,61 @@ class Analyzer:
             raise e
         return True
 
-    def _wait_until(self, by: str, el: str):
+    def _wait_strategy(self) -> str:
+        # A MutationObserver wait would hold the session, and so the other tabs, until the page changes
+        return POLL if getattr(self._tab, 'driver', None) is not None else self.wait_strategy
+
+    def _wait_for_element(self, by: str, el: str, timeout: float = ELEMENT_TIMEOUT):
+        """
+        Waits until the element exists in page.
+
+        :param by: By what basis to find the element?
+        :param el: The element you want to find on the page
+        :param timeout: Maximum number of seconds to wait
+        :return: The element
+        """
+        return wait_for_element(self.driver, by, el, timeout=timeout, strategy=self._wait_strategy(),
+                                records=self.waits)
+
+    def _wait_until(self, by: str, el: str, timeout: float = WAIT_UNTIL_TIMEOUT):
         """
-        It checks every one second if Element Exists in page or not
-        If Element Exists in page, It checks again else break loop.
+        Waits until the element doesn't exist in page anymore.
 
         (It's good for when you want check is page reloaded or not)
 
         :param by: By what basis to find the element?
         :param el: The element you want to find on the page
+        :param timeout: Maximum number of seconds to wait
         """
-        driver = self.driver
+        wait_for_element(self.driver, by, el, present=False, timeout=timeout, strategy=self._wait_strategy(),
+                         records=self.waits)
+
+    def optimize(self, formats: Iterable[str] = None, workers: int = None) -> dict:
+        """
+        Optimize Images for web (locally, on a process pool)
+
+        :param formats: Formats to write (`png`, `webp`, `avif`), defaults to the per-image options
+        :param workers: Number of processes
+        :return: The sizes of the images and the total number of bytes saved
+        """
+        report = optimize_directory(self.saved_path, formats=formats, workers=workers)
+        log21.info(f"optimize: Saved {report['saved']} bytes "
+                   f"({report['original']} -> {report['optimized']} bytes)")
 
-        while True:
-            sleep(1)
+        # The images changed, so record their new hashes (the time of the run stays the same)
+        cache = get_stage_cache()
+        for stage, created in self._recorded.items():
             try:
-                driver.find_element(by, el)
-            except NoSuchElementException:
-                break
+                cache.record(self.url, stage, self._stage_parameters(stage), self.saved_path, STAGE_OUTPUTS[stage],
+                             created)
+            except Exception as e:
+                log21.warning(f"Couldn't record the output of {stage}: {e.__class__.__name__}: {str(e)}")
 
-    def optimize(self):
+        return report
+
+    def optimize_remote(self):
         """
-        Optimize Images for web
+        Optimize Images for web using imagecompressor.com
 
         :return: Optimized Images
         """
@@ -142,10 +644,9 @@ class Analyzer:
         saved_path = self.saved_path
 
         # Get Image compressor URL
-        driver.get("https://imagecompressor.com/")
+        self._get(endpoints.IMAGE_COMPRESSOR_URL)
 
-        WebDriverWait(driver, 10).until(expected_conditions.presence_of_element_located(
-            (By.XPATH, '//*[@id="fileSelector"]')))
+        self._wait_for_element(By.XPATH, '//*[@id="fileSelector"]')
         # Get Upload Button
         try:
             upload_btn = driver.find_element(By.XPATH, '//*[@id="fileSelector"]')
@@ -209,8 +710,7 @@ class Analyzer:
             pass
 
         # Find and click download button
-        WebDriverWait(driver, 10).until(expected_conditions.presence_of_element_located(
-            (By.XPATH, '//*[@id="app"]/section[1]/div[3]/button')))
+        self._wait_for_element(By.XPATH, '//*[@id="app"]/section[1]/div[3]/button')
         try:
             download_btn = driver.find_element(By.XPATH, '//*[@id="app"]/section[1]/div[3]/button')
         except NoSuchElementException as e:
@@ -247,109 +747,162 @@ class Analyzer:
         except FileNotFoundError:
             pass
 
-    def get_whois(self):
-        # Get the website's title
-        res = requests.get(self.url)
-        soup = BeautifulSoup(res.content, 'html.parser')
-        title = soup.find('title')
-        if title is None:
-            title = "No Title"
-        else:
-            title = title.text
-
-        log21.debug(f'get_whois: Site Title: {title}')
-
-        # Ip information
-        ip_info: dict = requests.get(f"http://ip-api.com/json/{self.domain}?fields=66846719").json()
-
-        ip_address = ip_info.get('query')
-
-        log21.debug(f'get_whois: IP Address: {ip_address}')
-
-        hosted_website = ip_info.get('reverse')
-
-        # Get IP Location
-        ip_city = ' - ' + ip_info.get('city') if ip_info.get('city') else ''
-
-        ip_location = ip_info.get('country') + ip_city
-
-        log21.debug(f'get_whois: IP Location: {ip_location}')
+    def _get_title(self) -> str:
+        """
+        Gets the title of the website.
 
-        # Get country code
-        country_code = ip_info.get('countryCode')
+        :return: The title or `No Title`
+        """
+        title = http_client.fetch_title(self.url)
+        if title is None:
+            return "No Title"
+        return title
 
-        log21.debug(f'get_whois: Country Code: {country_code}')
+    def _get_ip_info(self) -> dict:
+        """
+        Gets the IP information of the domain from the local GeoIP database (see `geoip.py`)
+        or from ip-api.com if the database doesn't know it.
 
-        # Get country flag
-        flag_url = f'https://countryflagsapi.com/png/{country_code}'
-        flag = Image.open(requests.get(flag_url, stream=True).raw)
-        flag = flag.convert("RGBA")
+        :return: The IP information
+        """
+        cache = get_cache()
+        ip_info = cache.get_json('ip', self.domain)
+        if ip_info is None and geoip.get_database() is not None:
+            with span('geoip', domain=self.domain) as geoip_span:
+                ip_info = self._lookup('geoip', lambda: geoip.locate(self.domain))
+                geoip_span.attributes['found'] = ip_info is not None
+        if ip_info is None:
+            ip_url = endpoints.IP_API_URL.format(domain=self.domain)
+            ip_info = self._lookup('ip', lambda: http_client.get(ip_url).json())
+            if ip_info.get('status') == 'success':
+                cache.set_json('ip', self.domain, ip_info)
+
+        return ip_info
+
+    def _get_flag(self, country_code: str) -> bytes:
+        """
+        Downloads the flag of a country.
 
-        # Resize flag
-        (width, height) = (flag.width // 20, flag.height // 20)
-        flag = flag.resize((width, height))
+        :param country_code: ISO code of the country
+        :return: The flag image
+        """
+        flag_url = endpoints.FLAG_URL.format(country_code=country_code)
+        return get_cache().cached('flag', country_code,
+                                  lambda: self._lookup('flag', lambda: http_client.get_content(flag_url)))
 
-        log21.debug(f'get_whois: Got the flag!')
+    @staticmethod
+    def _parse_rdap(data: dict) -> dict:
+        """
+        Formats the response of an RDAP service like the WHOIS information.
 
-        # Get Response for our website from whois API
-        response = whois21.WHOIS(self.domain)
+        :param data: The RDAP response of a domain
+        :return: The WHOIS information formatted for the WHOIS image
+        """
+        events = {}
+        for event in data.get('events', []):
+            date = datetime.datetime.fromisoformat(event['eventDate'].replace('Z', '+00:00'))
+            events[event['eventAction']] = date.strftime("%Y-%m-%d %H:%M:%S")
+
+        return {
+            'register_status': ' '.join(data.get('status', [])).strip(),
+            'name_servers': "\n".join(server['ldhName'] for server in data.get('nameservers', [])).strip(),
+            'dates': "\n".join(events[action] for action in ('registration', 'expiration', 'last changed')
+                               if action in events).strip(),
+        }
+
+    def _get_whois_info(self) -> dict:
+        """
+        Gets the register status, name servers and dates of the domain from WHOIS.
 
-        register_status = ' '.join(
-            response.status if not isinstance(response.status, str) else [response.status]).strip()
+        :return: The WHOIS information formatted for the WHOIS image
+        """
+        def lookup() -> dict:
+            if endpoints.RDAP_URL:
+                rdap_url = endpoints.RDAP_URL.format(domain=self.domain)
+                return self._parse_rdap(self._lookup('whois', lambda: http_client.get(rdap_url).json()))
+
+            # whois21 is slow to import (and does network calls when it's imported)
+            import whois21
+
+            with span('whois', domain=self.domain):
+                response = whois21.WHOIS(self.domain)
+            return {
+                'register_status': ' '.join(
+                    response.status if not isinstance(response.status, str) else [response.status]).strip(),
+                'name_servers': "\n".join(response.name_servers).strip(),
+                'dates': "\n".join(date.strftime("%Y-%m-%d %H:%M:%S") for date in
+                                   [response.creation_date, response.expires_date, response.updated_date]).strip(),
+            }
+
+        return get_cache().cached_json('whois', self.domain, lookup)
 
-        log21.debug('get_whois: Register Status: ' + register_status)
+    def get_whois(self):
+        # Run the independent lookups at the same time
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            title_future = executor.submit(in_context(self._get_title))
+            ip_info_future = executor.submit(in_context(self._get_ip_info))
+            whois_future = executor.submit(in_context(self._get_whois_info))
 
-        name_servers = "\n".join(response.name_servers).strip()
+            # Ip information
+            ip_info: dict = ip_info_future.result()
 
-        log21.debug('get_whois: Name Servers: ' + name_servers)
+            # Get country code
+            country_code = ip_info.get('countryCode')
 
-        dates = "\n".join(date.strftime("%Y-%m-%d %H:%M:%S") for date in
-                          [response.creation_date, response.expires_date, response.updated_date]).strip()
+            log21.debug(f'get_whois: Country Code: {country_code}')
 
-        log21.debug('get_whois: Dates: ' + str(dates.split('\n')))
+            # Get country flag (only if the flag atlas doesn't have it)
+            flag_future = None
+            if not has_flag(country_code):
+                flag_future = executor.submit(in_context(self._get_flag), country_code)
 
-        # Load raw whois image
-        whois_image = Image.open('assets/images/whois.jpg')
+            # Get the website's title
+            title = title_future.result()
 
-        # Make image editable
-        editable = ImageDraw.Draw(whois_image)
+            log21.debug(f'get_whois: Site Title: {title}')
 
-        # Load fonts
-        font = ImageFont.truetype('assets/fonts/Lato-Regular.ttf', 10)
-        domain_font = ImageFont.truetype('assets/fonts/Lato-Regular.ttf', 20)
-        title_font = ImageFont.truetype('assets/fonts/Vazirmatn-Regular.ttf', 10)
+            flag = flag_future.result() if flag_future else None
 
-        # Set colors
-        color = (90, 90, 90)
-        domain_color = (70, 70, 70)
+            log21.debug(f'get_whois: Got the flag{"" if flag_future else " from the atlas"}!')
 
-        # Add text to raw image
-        editable.text((165, 0), self.domain, domain_color, font=domain_font)  # Domain name
-        editable.text((120, 65), register_status, color, font=font)  # Registrar status
-        editable.text((120, 90), name_servers, color, font=font)  # Name servers
-        editable.text((120, 152), dates, color, font=font)  # Dates
-        editable.text((120, 250), ip_address, color, font=font)  # IP address
-        editable.text((195, 250), hosted_website, color, font=font)  # Hosted websites
-        editable.text((140, 273), ip_location, color, font=font)  # IP location
-        editable.text((120, 330), title, color, font=title_font)  # Website title
+            # Get Response for our website from whois API
+            whois_info = whois_future.result()
 
-        # Add flag to raw image
-        whois_image.paste(flag, (120, 275), flag)
+        card = self.card
+        card.ip_address = ip_info.get('query')
+        log21.debug(f'get_whois: IP Address: {card.ip_address}')
+        card.hosted_website = ip_info.get('reverse')
 
-        # Save whois image
-        whois_image.save(f"{self.saved_path}/whois.png")
+        # Get IP Location
+        ip_city = ' - ' + ip_info.get('city') if ip_info.get('city') else ''
+        card.ip_location = ip_info.get('country') + ip_city
+        log21.debug(f'get_whois: IP Location: {card.ip_location}')
+        card.country_code = country_code or ''
+
+        card.register_status = whois_info['register_status']
+        log21.debug('get_whois: Register Status: ' + card.register_status)
+        card.name_servers = whois_info['name_servers']
+        log21.debug('get_whois: Name Servers: ' + card.name_servers)
+        card.dates = whois_info['dates']
+        log21.debug('get_whois: Dates: ' + str(card.dates.split('\n')))
+        card.title = title
+        card.flag = flag
+        card.cards.append('whois')
+
+        # Draw and save the whois image
+        with span('encode', image='whois.png'):
+            render_card(card, 'whois', self.saved_path)
 
     def get_responsive(self):
         driver = self.driver
 
         # Get Responsive website URL
-        driver.get("https://amiresponsive.co.uk/")
+        self._get(endpoints.AMIRESPONSIVE_URL)
 
         # Change window size for image size
         driver.set_window_size(1280, 1024)
 
-        WebDriverWait(driver, 10).until(
-            expected_conditions.presence_of_element_located((By.XPATH, '//input[@name="site"]')))
+        self._wait_for_element(By.XPATH, '//input[@name="site"]')
 
         # Find searchbar in page
         try:
@@ -377,12 +930,89 @@ class Analyzer:
         # Fixing image for good picture by changing style
         driver.execute_script("window.scrollTo({top:70, left:0, behavior: 'auto'})")
 
-        # Save file
-        driver.save_screenshot(f"{self.saved_path}/responsive.png")
-
         # Crop and save the image
-        image = Image.open(f"{self.saved_path}/responsive.png")
-        image.crop((140, 90, 1115, 635)).save(f"{self.saved_path}/responsive.png")
+        self._capture('get_responsive', 'responsive.png', (140, 90, 1115, 635))
+
+    def _gtmetrix_logged_in(self) -> bool:
+        """Checks if the loaded GTMetrix page is of a logged-in user."""
+        try:
+            self._wait_for_element(By.XPATH, '/html/body/div[1]/main/article/form/div[1]/div[1]/div/input')
+        except TimeoutException:
+            return False
+        return not self._check_exists(By.ID, 'user-nav-login')
+
+    def _gtmetrix_login(self, sessions: SessionStore, saved: Optional[dict]):
+        """
+        Logs in to GTMetrix and saves the session.
+        Only one process logs in at a time; if another one has saved a newer session meanwhile, it's used instead.
+
+        :param sessions: The SessionStore
+        :param saved: The session that was restored (if any)
+        """
+        driver = self.driver
+
+        with sessions.lock():
+            latest = sessions.load()
+            if latest is not None and (saved is None or latest['saved'] > saved['saved']) and \
+                    set_cookies(driver, latest['cookies']):
+                self._get(endpoints.GTMETRIX_URL)
+                if self._gtmetrix_logged_in():
+                    sessions.count('reused')
+                    log21.info('get_gtmetrix: Logged in with the session saved by another run')
+                    return
+
+            # === Login Section ===
+            self._wait_for_element(By.ID, 'user-nav-login')
+            # Find login page button
+            try:
+                login_btn = driver.find_element(By.XPATH, '//*[@id="user-nav-login"]/a')
+            except NoSuchElementException as e:
+                e.args += ("Login Button Not Found!",)
+                raise e
+            login_btn.click()
+
+            self._wait_for_element(By.NAME, 'email')
+            # Find email and password field in page
+            try:
+                email = driver.find_element(By.XPATH, '//input[@name="email"]')
+            except NoSuchElementException as e:
+                e.args += ("Email Field Not Found!",)
+                raise e
+
+            self._wait_for_element(By.NAME, 'password')
+            try:
+                password = driver.find_element(By.XPATH, '//input[@name="password"]')
+            except NoSuchElementException as e:
+                e.args += ("Password Field Not Found!",)
+                raise e
+
+            self._wait_for_element(By.ID, 'menu-site-nav')
+            try:
+                submit_login_btn = driver.find_element(By.XPATH,
+                                                       '//*[@id="menu-site-nav"]/div[2]/div[1]/form/div[4]/button'
+                                                       )
+            except NoSuchElementException as e:
+                e.args += ("Submit Login Button Not Found!",)
+                raise e
+
+            # Pass Main URL to responsive website
+            try:
+                email.send_keys(config('EMAIL'))
+                password.send_keys(config('PASSWORD'))
+                submit_login_btn.click()
+            except ElementNotInteractableException as e:
+                e.args += ("Email Field not intractable!",)
+                raise e
+
+            # Check Email and Password valid for login gtmetrix
+            if self._check_exists(By.CLASS_NAME, "tooltip-error"):
+                raise Exception("GTMetrix Login Failed!")
+
+            # Save the session when the logged-in page is loaded
+            self._wait_for_element(By.XPATH, '/html/body/div[1]/main/article/form/div[1]/div[1]/div/input')
+            sessions.save(get_cookies(driver, endpoints.GTMETRIX_URL))
+            sessions.count('logins')
+            log21.info('get_gtmetrix: Logged in and saved the session')
 
     def get_gtmetrix(self):
         driver = self.driver
@@ -390,10 +1020,14 @@ class Analyzer:
         # Delete All Cookies
         driver.delete_all_cookies()
 
+        # Put the cookies of the session saved by an earlier run (or another worker) in the browser
+        sessions = get_session_store()
+        saved = sessions.load()
+        restored = saved is not None and set_cookies(driver, saved['cookies'])
+
         # Get Responsive website URL
         try:
-            driver.get("https://gtmetrix.com/")
-            driver.set_page_load_timeout(400)
+            self._get(endpoints.GTMETRIX_URL, timeout=400)
         except TimeoutException as e:
             e.args += ("Could not get responsive website URL",)
             raise e
@@ -401,58 +1035,16 @@ class Analyzer:
         # Change window size for image size
         driver.set_window_size(1280, 1024)
 
-        # === Login Section ===
-        WebDriverWait(driver, 10).until(
-            expected_conditions.presence_of_element_located((By.ID, 'user-nav-login')))
-        # Find login page button
-        try:
-            login_btn = driver.find_element(By.XPATH, '//*[@id="user-nav-login"]/a')
-        except NoSuchElementException as e:
-            e.args += ("Login Button Not Found!",)
-            raise e
-        login_btn.click()
-
-        WebDriverWait(driver, 10).until(expected_conditions.presence_of_element_located((By.NAME, 'email')))
-        # Find email and password field in page
-        try:
-            email = driver.find_element(By.XPATH, '//input[@name="email"]')
-        except NoSuchElementException as e:
-            e.args += ("Email Field Not Found!",)
-            raise e
-
-        WebDriverWait(driver, 10).until(expected_conditions.presence_of_element_located((By.NAME, 'password')))
-        try:
-            password = driver.find_element(By.XPATH, '//input[@name="password"]')
-        except NoSuchElementException as e:
-            e.args += ("Password Field Not Found!",)
-            raise e
-
-        WebDriverWait(driver, 10).until(
-            expected_conditions.presence_of_element_located((By.ID, 'menu-site-nav')))
-        try:
-            submit_login_btn = driver.find_element(By.XPATH,
-                                                   '//*[@id="menu-site-nav"]/div[2]/div[1]/form/div[4]/button'
-                                                   )
-        except NoSuchElementException as e:
-            e.args += ("Submit Login Button Not Found!",)
-            raise e
-
-        # Pass Main URL to responsive website
-        try:
-            email.send_keys(config('EMAIL'))
-            password.send_keys(config('PASSWORD'))
-            submit_login_btn.click()
-        except ElementNotInteractableException as e:
-            e.args += ("Email Field not intractable!",)
-            raise e
-
-        # Check Email and Password valid for login gtmetrix
-        if self._check_exists(By.CLASS_NAME, "tooltip-error"):
-            raise Exception("GTMetrix Login Failed!")
+        if restored and self._gtmetrix_logged_in():
+            sessions.count('reused')
+            log21.info('get_gtmetrix: Logged in with the saved session')
+        else:
+            if restored:
+                sessions.count('expired')
+            self._gtmetrix_login(sessions, saved)
 
         # Find searchbar in page
-        WebDriverWait(driver, 10).until(expected_conditions.presence_of_element_located(
-            (By.XPATH, '/html/body/div[1]/main/article/form/div[1]/div[1]/div/input')))
+        self._wait_for_element(By.XPATH, '/html/body/div[1]/main/article/form/div[1]/div[1]/div/input')
         try:
             search_bar = driver.find_element(By.XPATH,
                                              '/html/body/div[1]/main/article/form/div[1]/div[1]/div/input')
@@ -468,8 +1060,7 @@ class Analyzer:
             raise e
 
         # Find and submit Main URL to GTMetrix website
-        WebDriverWait(driver, 10).until(expected_conditions.presence_of_element_located(
-            (By.XPATH, '/html/body/div[1]/main/article/form/div[1]/div[2]/button')))
+        self._wait_for_element(By.XPATH, '/html/body/div[1]/main/article/form/div[1]/div[2]/button')
         try:
             submit_url_btn = driver.find_element(By.XPATH,
                                                  '/html/body/div[1]/main/article/form/div[1]/div[2]/button'
@@ -488,20 +1079,15 @@ class Analyzer:
         driver.execute_script("document.body.style.zoom='90%'")
 
         # Delete ADS banner from page
-        WebDriverWait(driver, 10).until(expected_conditions.presence_of_element_located(
-            (By.XPATH, '//div[@id="summer"]')))
+        self._wait_for_element(By.XPATH, '//div[@id="summer"]')
         try:
             banner = driver.find_element(By.XPATH, '//div[@id="summer"]')
             driver.execute_script("arguments[0].remove()", banner)
         except NoSuchElementException:
             pass
 
-        # Save file
-        driver.save_screenshot(f"{self.saved_path}/gtmetrix.png")
-
         # Crop and save the image
-        image = Image.open(f"{self.saved_path}/gtmetrix.png")
-        image.crop((15, 5, 1070, 600)).save(f"{self.saved_path}/gtmetrix.png")
+        self._capture('get_gtmetrix', 'gtmetrix.png', (15, 5, 1070, 600))
 
     def get_backlinks(self):
         driver = self.driver
@@ -510,13 +1096,12 @@ class Analyzer:
         driver.delete_all_cookies()
 
         # Get Responsive website URL
-        driver.get("https://lxrmarketplace.com/seo-inbound-link-checker-tool.html")
+        self._get(endpoints.BACKLINKS_URL)
 
         # Change window size for image size
         driver.set_window_size(1280, 1024)
 
-        WebDriverWait(driver, 10).until(
-            expected_conditions.presence_of_element_located((By.XPATH, '//input[@name="url"]')))
+        self._wait_for_element(By.XPATH, '//input[@name="url"]')
         # Find searchbar in page
         try:
             search_bar = driver.find_element(By.XPATH, '//input[@name="url"]')
@@ -536,81 +1121,51 @@ class Analyzer:
         # Fixing image for good picture by changing style
         driver.execute_script("window.scrollTo({top:30, left:0, behavior: 'auto'})")
 
-        # Save file
-        driver.save_screenshot(f"{self.saved_path}/backlinks.png")
-
         # Crop and save the image
-        image = Image.open(f"{self.saved_path}/backlinks.png")
-        image.crop((90, 130, 1230, 540)).save(f"{self.saved_path}/backlinks.png")
+        self._capture('get_backlinks', 'backlinks.png', (90, 130, 1230, 540))
 
     def get_amp(self):
-        # Get URL
-        url = self.url
-
-        # Load the raw image
-        raw_amp = Image.open('assets/images/AMP.jpg')
-
-        # Make image editable
-        image_editable = ImageDraw.Draw(raw_amp)
-
-        # Load the font
-        title_font = ImageFont.truetype('assets/fonts/Roboto-Medium.ttf', 21)
-
-        # Put the URL in image
-        image_editable.text((80, 28), url, (255, 255, 255), font=title_font)
+        # The AMP image only shows the URL
+        self.card.cards.append('amp')
 
-        # Save the image
-        raw_amp.save(f"{self.saved_path}/AMP.png")
+        # Draw and save the image
+        with span('encode', image='AMP.png'):
+            render_card(self.card, 'amp', self.saved_path)
 
     def get_ssl(self):
         driver = self.driver
-        protocol = self.scheme
 
         # Get URL and SSL
         url = self.url
 
-        # Get website URL
-        driver.get(url)
-
-        # Load the raw image
-        raw_https = Image.open(f'assets/images/{protocol}.jpg')
-        raw_https = raw_https.convert("RGBA")
-
-        # Get Favicon
-        favicon_url = f'http://www.google.com/s2/favicons?domain={url}'
-        favicon = Image.open(requests.get(favicon_url, stream=True).raw)
-        favicon = favicon.convert("RGBA")
-
-        # Paste favicon on https raw image
-        raw_https.paste(favicon, (17, 8), favicon)
-
-        # Make https raw image editable
-        editable = ImageDraw.Draw(raw_https)
-
-        # Add Font to our text
-        font = ImageFont.truetype('assets/fonts/Vazirmatn-Regular.ttf', 14)
+        # Download the favicon while the browser loads the website
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            favicon_url = endpoints.FAVICON_URL.format(url=url)
+            favicon_future = executor.submit(
+                in_context(get_cache().cached), 'favicon', url,
+                lambda: self._lookup('favicon', lambda: http_client.get_content(favicon_url))
+            )
 
-        # Set coordination for URL
-        url_coordination = (172, 42) if protocol == 'https' else (260, 42)
+            # Get website URL
+            self._get(url)
 
-        # Draw URL text in the raw image
-        editable.text(url_coordination, url, (255, 255, 255), font=font)
+            # Get Favicon
+            self.card.favicon = favicon_future.result()
 
         # Get Title from website
-        title = driver.title
-        title = (title[:20] + '...') if len(title) > 20 else title
-        # Set coordination for Page Title
-        title_coordination = (41, 7)
-        # Draw Title text in the raw image
-        editable.text(title_coordination, title, (255, 255, 255), font=font, direction="ltr")
+        self.card.page_title = driver.title
+        self.card.cards.append('ssl')
 
-        # Save the image
-        raw_https.save(f"{self.saved_path}/ssl.png", format='png')
+        # Draw and save the image
+        with span('encode', image='ssl.png'):
+            render_card(self.card, 'ssl', self.saved_path)
 
     def close(self):
-        if self.driver:
-            self.driver.quit()
-            self.driver = None
+        self._writer.close()
+        if self._driver:
+            if self._owns_driver:
+                self._driver.quit()
+            self._driver = None
 
     def __del__(self):
         self.close()
@@ -0,0 +1,164 @@
+import json
+import fnmatch
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import log21
+
+from lookup_cache import get_cache
+
+# Ads, trackers and analytics; they are never a part of a captured region
+TRACKER_PATTERNS = (
+    '*google-analytics.com/*', '*googletagmanager.com/*', '*doubleclick.net/*', '*googlesyndication.com/*',
+    '*googleadservices.com/*', '*adservice.google.*', '*facebook.net/*', '*connect.facebook.com/*',
+    '*hotjar.com/*', '*clarity.ms/*', '*intercom.io/*', '*intercomcdn.com/*', '*amazon-adsystem.com/*',
+    '*adsrvr.org/*', '*criteo.com/*', '*criteo.net/*', '*taboola.com/*', '*outbrain.com/*', '*quantserve.com/*',
+    '*scorecardresearch.com/*', '*crazyegg.com/*', '*pagead2.*',
+)
+
+# Network.setBlockedURLs only takes URL patterns, so the resource types are matched by their file extensions
+RESOURCE_TYPES = {
+    'image': ('png', 'jpg', 'jpeg', 'gif', 'webp', 'avif', 'svg', 'ico', 'bmp'),
+    'font': ('woff', 'woff2', 'ttf', 'otf', 'eot'),
+    'media': ('mp4', 'webm', 'ogg', 'ogv', 'mp3', 'wav', 'm3u8', 'mov'),
+    'stylesheet': ('css',),
+}
+
+# Don't look up the sizes of more blocked requests than this per stage
+MAX_REMEMBERED_SIZES = 200
+
+
+class NetworkPolicy:
+    def __init__(self, block_types: Iterable[str] = (), block_patterns: Iterable[str] = (),
+                 block_trackers: bool = True):
+        """
+        The requests a browser stage doesn't need.
+
+        :param block_types: Resource types to block (`image`, `font`, `media`, `stylesheet`)
+        :param block_patterns: More URL patterns to block (`*` matches anything)
+        :param block_trackers: Block the known ads, trackers and analytics
+        """
+        self.block_types = tuple(block_types)
+        for resource_type in self.block_types:
+            if resource_type not in RESOURCE_TYPES:
+                raise ValueError(f'Unknown resource type: {resource_type}')
+        self.block_patterns = tuple(block_patterns)
+        self.block_trackers = block_trackers
+
+        self.patterns: List[str] = list(TRACKER_PATTERNS) if block_trackers else []
+        for resource_type in self.block_types:
+            for extension in RESOURCE_TYPES[resource_type]:
+                # With and without a query string
+                self.patterns += [f'*.{extension}', f'*.{extension}?*']
+        self.patterns += self.block_patterns
+
+    def matches(self, url: str) -> bool:
+        return any(fnmatch.fnmatchcase(url, pattern) for pattern in self.patterns)
+
+    def __repr__(self):
+        return (f'NetworkPolicy(block_types={self.block_types}, block_patterns={self.block_patterns}, '
+                f'block_trackers={self.block_trackers})')
+
+
+# What every browser stage can do without. The screenshots show the pages' own images and fonts (and, for
+# amiresponsive, the analyzed website itself), so only the SSL stage, which only needs the title, blocks them.
+STAGE_POLICIES: Dict[str, NetworkPolicy] = {
+    'get_responsive': NetworkPolicy(),
+    'get_gtmetrix': NetworkPolicy(block_types=('media',)),
+    'get_backlinks': NetworkPolicy(block_types=('media',)),
+    'get_ssl': NetworkPolicy(block_types=('image', 'font', 'media', 'stylesheet')),
+}
+
+
+def drain_log(driver) -> List[dict]:
+    """
+    Reads (and empties) the performance log of the driver.
+
+    :param driver: The driver (made with `goog:loggingPrefs` `{'performance': 'ALL'}`)
+    :return: The DevTools events in the log, or an empty list if the log is not enabled
+    """
+    try:
+        entries = driver.get_log('performance')
+    except Exception:
+        return []
+    events = []
+    for entry in entries:
+        try:
+            events.append(json.loads(entry['message'])['message'])
+        except (KeyError, ValueError):
+            continue
+    return events
+
+
+def apply_policy(driver, policy: Optional[NetworkPolicy]):
+    """
+    Blocks the requests of a policy in the browser (through the DevTools Protocol).
+
+    :param driver: The driver
+    :param policy: The policy; None unblocks everything
+    """
+    driver.execute_cdp_cmd('Network.enable', {})
+    driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': policy.patterns if policy else []})
+
+
+def network_stats(events: Iterable[dict], policy: Optional[NetworkPolicy] = None) -> dict:
+    """
+    Summarizes the requests of a stage from its DevTools events.
+    The bytes of a blocked request are known if the same URL was loaded before without blocking
+    (e.g. in a run with `--no-block`); their sizes are kept in the lookup cache.
+
+    :param events: The events of `drain_log`
+    :param policy: The policy of the stage, applied or not (to remember the sizes of the resources it blocks)
+    :return: {'requests', 'bytes', 'blocked_requests', 'blocked_bytes', 'blocked_unknown'}
+    """
+    urls: Dict[str, str] = {}
+    stats = {'requests': 0, 'bytes': 0, 'blocked_requests': 0, 'blocked_bytes': 0, 'blocked_unknown': 0}
+    blocked: List[str] = []
+    finished: List[Tuple[str, int]] = []
+    for event in events:
+        method, params = event.get('method'), event.get('params', {})
+        if method == 'Network.requestWillBeSent':
+            urls[params.get('requestId')] = params.get('request', {}).get('url', '')
+        elif method == 'Network.loadingFinished':
+            stats['requests'] += 1
+            stats['bytes'] += int(params.get('encodedDataLength', 0))
+            finished.append((urls.get(params.get('requestId'), ''), int(params.get('encodedDataLength', 0))))
+        elif method == 'Network.loadingFailed' and params.get('blockedReason') == 'inspector':
+            stats['blocked_requests'] += 1
+            blocked.append(urls.get(params.get('requestId'), ''))
+
+    cache = get_cache()
+    try:
+        # Remember the sizes of the resources the policies block, for the runs that block them
+        for url, size in finished:
+            if url and size and policy is not None and policy.matches(url):
+                cache.set_json('resource_size', url, size)
+        for url in blocked[:MAX_REMEMBERED_SIZES]:
+            size = cache.get_json('resource_size', url) if url else None
+            if size is None:
+                stats['blocked_unknown'] += 1
+            else:
+                stats['blocked_bytes'] += size
+        stats['blocked_unknown'] += max(0, len(blocked) - MAX_REMEMBERED_SIZES)
+    except Exception as e:
+        log21.debug(f'network_stats: {e.__class__.__name__}: {str(e)}')
+
+    return stats
+
+
+def format_network(stats: Iterable[dict]) -> str:
+    """
+    Formats the network stats of the stages for the logs.
+
+    :param stats: Outputs of `network_stats`
+    :return: e.g. `52 requests (1830 KB) loaded, 14 requests (~620 KB) blocked`
+    """
+    total = {'requests': 0, 'bytes': 0, 'blocked_requests': 0, 'blocked_bytes': 0, 'blocked_unknown': 0}
+    for stage_stats in stats:
+        for key in total:
+            total[key] += stage_stats.get(key, 0)
+    text = (f"{total['requests']} requests ({total['bytes'] // 1024} KB) loaded, "
+            f"{total['blocked_requests']} requests (~{total['blocked_bytes'] // 1024} KB) blocked")
+    if total['blocked_unknown']:
+        text += f" ({total['blocked_unknown']} of unknown size)"
+    return text
@@ -0,0 +1,153 @@
+import os
+import tempfile
+
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor
+
+import log21
+
+from PIL import Image, features
+
+# The images an Analyzer saves
+IMAGES = ('whois', 'responsive', 'gtmetrix', 'backlinks', 'AMP', 'ssl')
+FORMATS = ('png', 'webp', 'avif')
+
+
+class OptimizeOptions:
+    def __init__(self, colors: Optional[int] = 256, quality: int = 80, formats: Iterable[str] = ('png',)):
+        """
+        How to optimize an image.
+
+        :param colors: Number of palette colors to quantize the PNG to (None keeps it lossless)
+        :param quality: Quality of the WebP and AVIF outputs (1-100)
+        :param formats: Formats to write: `png` replaces the image, `webp` and `avif` are written next to it
+        """
+        self.colors = colors
+        self.quality = quality
+        self.formats = tuple(formats)
+        for image_format in self.formats:
+            if image_format not in FORMATS:
+                raise ValueError(f'Unknown image format: {image_format}')
+
+    def __repr__(self):
+        return f'OptimizeOptions(colors={self.colors}, quality={self.quality}, formats={self.formats})'
+
+
+# Per-image quality targets: the text cards keep their few colors, the screenshots need a full palette
+DEFAULT_OPTIONS = {
+    'whois': OptimizeOptions(colors=64),
+    'AMP': OptimizeOptions(colors=32),
+    'ssl': OptimizeOptions(colors=64),
+}
+
+
+def _save_temp(image: Image.Image, path: str, image_format: str, **params) -> Tuple[str, int]:
+    """
+    Saves an image to a temporary file next to the path.
+
+    :return: Path and size of the temporary file
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            image.save(file, image_format, **params)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    return temp_path, os.path.getsize(temp_path)
+
+
+def _write_atomic(image: Image.Image, path: str, image_format: str, **params) -> int:
+    """
+    Saves an image through a temporary file, so the path never holds a half-written image.
+
+    :return: Size of the written file
+    """
+    temp_path, size = _save_temp(image, path, image_format, **params)
+    os.replace(temp_path, path)
+
+    return size
+
+
+def optimize_image(path: Union[str, os.PathLike], options: OptimizeOptions = None) -> dict:
+    """
+    Optimizes a PNG image in place (and writes its WebP/AVIF versions if asked).
+    The PNG is only replaced if the optimized version is smaller.
+
+    :param path: Path of the image
+    :param options: How to optimize the image
+    :return: The sizes of the original image and the outputs
+    """
+    path = os.fspath(path)
+    options = options or OptimizeOptions()
+    original_size = os.path.getsize(path)
+    result = {'path': path, 'original': original_size, 'outputs': {}}
+
+    with Image.open(path) as image:
+        image.load()
+
+    if 'png' in options.formats:
+        optimized = image
+        if options.colors:
+            if image.mode == 'RGBA':
+                optimized = image.quantize(options.colors, method=Image.Quantize.FASTOCTREE)
+            else:
+                optimized = image.convert('RGB').quantize(options.colors)
+        temp_path, size = _save_temp(optimized, path, 'PNG', optimize=True)
+        if size < original_size:
+            os.replace(temp_path, path)
+        else:
+            os.remove(temp_path)
+            size = original_size
+        result['outputs']['png'] = size
+
+    base = os.path.splitext(path)[0]
+    if 'webp' in options.formats:
+        result['outputs']['webp'] = _write_atomic(image, base + '.webp', 'WEBP', quality=options.quality, method=6)
+    if 'avif' in options.formats:
+        if features.check('avif'):
+            result['outputs']['avif'] = _write_atomic(image, base + '.avif', 'AVIF', quality=options.quality)
+        else:
+            log21.warning('optimize: AVIF is not supported by this Pillow build')
+
+    return result
+
+
+def optimize_directory(saved_path: Union[str, os.PathLike], options: Dict[str, OptimizeOptions] = None,
+                       formats: Iterable[str] = None, workers: int = None) -> dict:
+    """
+    Optimizes the images of an Analyzer's output directory on a process pool.
+
+    :param saved_path: The output directory
+    :param options: Options of every image (by name, without the extension); defaults to DEFAULT_OPTIONS
+    :param formats: Overrides the formats of all the images
+    :param workers: Number of processes (defaults to the number of images or CPUs, whichever is less)
+    :return: The results of the images and the total number of bytes saved
+    """
+    options = dict(DEFAULT_OPTIONS if options is None else options)
+    jobs = []
+    for name in IMAGES:
+        path = os.path.join(saved_path, f'{name}.png')
+        if not os.path.isfile(path):
+            continue
+        image_options = options.get(name) or OptimizeOptions()
+        if formats is not None:
+            image_options = OptimizeOptions(image_options.colors, image_options.quality, formats)
+        jobs.append((path, image_options))
+
+    results: List[dict] = []
+    if jobs:
+        workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+        if workers == 1:
+            results = [optimize_image(path, image_options) for path, image_options in jobs]
+        else:
+            with ProcessPoolExecutor(workers) as executor:
+                results = list(executor.map(optimize_image, *zip(*jobs)))
+
+    original = sum(result['original'] for result in results)
+    optimized = sum(result['outputs'].get('png', result['original']) for result in results)
+    for result in results:
+        log21.debug(f"optimize: {os.path.basename(result['path'])}: {result['original']} -> {result['outputs']}")
+
+    return {'images': results, 'original': original, 'optimized': optimized, 'saved': original - optimized}
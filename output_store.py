@@ -0,0 +1,125 @@
+import os
+import time
+import sqlite3
+import threading
+
+from typing import List, Optional, Union
+
+from decouple import config
+
+from lookup_cache import SQLiteConnectionMixin, open_sqlite
+
+ROOT = config('OUTPUT_ROOT', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'save'))
+INDEX_NAME = 'index.sqlite3'
+
+_store: Optional['OutputStore'] = None
+_lock = threading.Lock()
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY,
+        url TEXT NOT NULL,
+        name TEXT NOT NULL,
+        path TEXT NOT NULL UNIQUE,
+        created REAL NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS runs_url ON runs (url, created)',
+)
+
+
+class OutputStore(SQLiteConnectionMixin):
+    def __init__(self, root: Union[str, os.PathLike] = ROOT, index_path: Union[str, os.PathLike] = None):
+        """
+        Keeps the output directories of the runs, sharded by date (`<root>/YYYY/MM/DD/<name>-HHMMSS`),
+        so no directory grows with the total number of runs.
+        Every run is added to an index, so the runs of a URL can be found without listing directories.
+
+        :param root: The directory the runs are saved in
+        :param index_path: Path of the SQLite index (defaults to `<root>/index.sqlite3`)
+        """
+        super().__init__()
+        self.root = os.path.abspath(root)
+        self.index_path = os.fspath(index_path) if index_path else os.path.join(self.root, INDEX_NAME)
+
+    def _connect(self) -> sqlite3.Connection:
+        return open_sqlite(self.index_path, SCHEMA)
+
+    def reserve(self, name: str, url: str = '') -> str:
+        """
+        Creates a new output directory for a run and adds it to the index.
+        The directory is reserved with a single `os.mkdir`, so analyzers sharing a name never get the same one.
+
+        :param name: Name of the run (e.g. the domain)
+        :param url: The analyzed URL
+        :return: Path of the directory
+        """
+        now = time.time()
+        local = time.localtime(now)
+        shard = os.path.join(self.root, time.strftime('%Y', local), time.strftime('%m', local),
+                             time.strftime('%d', local))
+        os.makedirs(shard, exist_ok=True)
+
+        base = f"{name}-{time.strftime('%H%M%S', local)}"
+        path = os.path.join(shard, base)
+        i = 2
+        while True:
+            try:
+                os.mkdir(path)
+                break
+            except FileExistsError:
+                # Another run of the same name in the same second
+                path = os.path.join(shard, f'{base}-{i}')
+                i += 1
+
+        connection = self.connection
+        with self._lock:
+            # A directory that was deleted can be reserved again, replacing its old run
+            connection.execute('INSERT OR REPLACE INTO runs (url, name, path, created) VALUES (?, ?, ?, ?)',
+                               (url, name, os.path.relpath(path, self.root), now))
+
+        return path
+
+    def runs(self, url: str, limit: int = None) -> List[str]:
+        """
+        Gets the output directories of a URL, newest first.
+
+        :param url: The analyzed URL
+        :param limit: Maximum number of directories
+        :return: Paths of the directories
+        """
+        connection = self.connection
+        with self._lock:
+            rows = connection.execute('SELECT path FROM runs WHERE url = ? ORDER BY created DESC, id DESC LIMIT ?',
+                                      (url, -1 if limit is None else limit)).fetchall()
+
+        return [os.path.join(self.root, row[0]) for row in rows]
+
+    def latest(self, url: str) -> Optional[str]:
+        """
+        Gets the output directory of the latest run of a URL.
+
+        :param url: The analyzed URL
+        :return: Path of the directory or None if the URL was never analyzed
+        """
+        runs = self.runs(url, 1)
+        return runs[0] if runs else None
+
+
+def get_store() -> OutputStore:
+    """Gets the shared OutputStore of the process."""
+    global _store
+    if _store is None:
+        with _lock:
+            if _store is None:
+                _store = OutputStore()
+    return _store
+
+
+def _reset_lock():
+    global _lock
+    _lock = threading.Lock()
+
+
+# A forked child must not inherit a lock held by another thread of the parent
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_lock)
@@ -1,26 +1,86 @@
+import os
 import sys
 import time
+import tempfile
 
 import log21
 
-from main import Analyzer, is_valid_url
+from main import Analyzer, is_valid_url, normalize_stages, STAGES, STAGE_NAMES, HEDGE_AFTER
+from lookup_cache import get_cache, format_stats
+from waiting import STRATEGIES, POLL
+from optimizer import FORMATS
+from capture import METHODS, FULL
+from tracing import tracer, load_jsonl, write_prometheus
+from stage_cache import DEFAULT_MAX_AGE
+from output_store import get_store
+from network_policy import format_network
+from session_store import get_session_store, merge_session_stats, format_session_stats
 
 logger = log21.get_logger()
 
 
 def main():
     parser = log21.ColorizingArgumentParser()
-    parser.add_argument('-u', '--url', help='URL to analyze', required=True)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-u', '--url', help='URL to analyze')
+    source.add_argument('-i', '--input', help='File containing URLs to analyze (one per line, `-` for stdin)')
+    parser.add_argument('-w', '--workers', help='Number of worker processes in batch mode', type=int)
+    parser.add_argument('-m', '--manifest', help='Manifest file of batch mode', default='manifest.jsonl')
+    parser.add_argument('-r', '--recycle', help='Restart the browser of a batch worker after this many URLs',
+                        type=int, default=50)
+    parser.add_argument('-L', '--latest', help='Print the output directory of the latest run of the URL and exit',
+                        action='store_true')
     parser.add_argument('-o', '--output', help='Output directory name', default='Analyzer')
     parser.add_argument('-d', '--driver', help='ChromeDriver path')
     parser.add_argument('-O', '--optimize', help='Optimize images', action='store_true')
+    parser.add_argument('-F', '--formats', help=f'Formats of the optimized images ({", ".join(FORMATS)})',
+                        nargs='*', choices=FORMATS, metavar='FORMAT')
+    parser.add_argument('-S', '--stages', help=f'Stages to run ({", ".join(STAGE_NAMES)}); the browser is only '
+                        'started if a selected stage needs it', nargs='*', choices=STAGES + STAGE_NAMES,
+                        default=list(STAGES), metavar='STAGE')
+    parser.add_argument('-s', '--sequential', help='Run the stages one after another', action='store_true')
+    parser.add_argument('-T', '--tabs', help='Run up to this many browser stages at the same time in tabs of one '
+                        'browser', type=int, default=1)
+    parser.add_argument('-W', '--wait-strategy', help='How to wait for page changes', choices=STRATEGIES,
+                        default=POLL)
+    parser.add_argument('-C', '--capture', help='How to take the screenshots', choices=METHODS, default=FULL)
+    parser.add_argument('-a', '--max-age', help='Reuse the outputs of stages that finished less than this many '
+                        'seconds ago (0 runs every stage)', type=float, default=DEFAULT_MAX_AGE)
+    parser.add_argument('-D', '--deadline', help='Time budget of every URL in seconds (the stages that run out of '
+                        'it are reported as timeout)', type=float)
+    parser.add_argument('-B', '--stage-timeout', help='Time budget of every stage in seconds (instead of the '
+                        'budgets of the stages)', type=float)
+    parser.add_argument('-H', '--hedge', help="Send the lookups that haven't answered after this many seconds "
+                        "again and use the first answer (0 for never)", type=float, default=HEDGE_AFTER)
+    parser.add_argument('-N', '--no-block', help="Don't block the ads, trackers and other requests the browser "
+                        "stages don't need", action='store_true')
+    parser.add_argument('-t', '--trace', help='Append the tracing spans to this JSON lines file')
+    parser.add_argument('-M', '--metrics', help='Write the span metrics to this Prometheus textfile')
+    parser.add_argument('-P', '--profile', help='Run these stages under cProfile (saved as <stage>.prof)',
+                        nargs='*', choices=STAGES, default=(), metavar='STAGE')
     parser.add_argument('-v', '--verbose', help='Verbose mode', action='store_true')
     parser.add_argument('-q', '--quiet', help='Quiet mode', action='store_true')
 
     args = parser.parse_args()
-
-    if not is_valid_url(args.url):
+    # (nargs='+' breaks the help message of log21's parser, so the lists are checked here)
+    if not args.stages:
+        parser.error('-S/--stages needs at least one stage')
+    if args.formats is not None and not args.formats:
+        parser.error('-F/--formats needs at least one format')
+    args.stages = normalize_stages(args.stages)
+
+    if args.url and not is_valid_url(args.url):
         parser.error('Invalid URL')
+    if args.workers is not None and args.workers < 1:
+        parser.error('Number of workers must be at least 1')
+    if args.tabs < 1:
+        parser.error('Number of tabs must be at least 1')
+    if args.tabs > 1 and args.sequential:
+        parser.error('Cannot use both -T/--tabs and -s')
+    for option, value in (('-D/--deadline', args.deadline), ('-B/--stage-timeout', args.stage_timeout)):
+        if value is not None and value <= 0:
+            parser.error(f'{option} must be more than 0 seconds')
+    stage_timeouts = dict.fromkeys(STAGES, args.stage_timeout) if args.stage_timeout else None
 
     if args.verbose and args.quiet:
         parser.error('Cannot use both -v and -q')
@@ -30,39 +90,113 @@ def main():
         log21.basic_config(level=log21.ERROR)
         logger.setLevel(log21.ERROR)
 
-    analyzer = Analyzer(args.url, args.output, args.driver, args.verbose)
+    if args.formats and not args.optimize:
+        parser.error('-F/--formats needs -O/--optimize')
+
+    if args.latest:
+        if not args.url:
+            parser.error('-L/--latest needs -u/--url')
+        latest = get_store().latest(args.url)
+        if latest is None:
+            logger.error(f'{args.url} has not been analyzed yet!')
+            sys.exit(1)
+        print(latest)
+        return
+
+    if args.input:
+        return batch_mode(args, stage_timeouts)
+
+    analyzer = Analyzer(args.url, args.output, args.driver, args.verbose, wait_strategy=args.wait_strategy,
+                        capture_method=args.capture, block_requests=not args.no_block, stage_timeouts=stage_timeouts,
+                        hedge_after=args.hedge)
 
     start_time = time.time()
 
-    funcs = [
-        analyzer.get_whois,
-        analyzer.get_responsive,
-        analyzer.get_gtmetrix,
-        analyzer.get_backlinks,
-        analyzer.get_amp,
-        analyzer.get_ssl
-    ]
-
-    for func in funcs:
-        try:
-            logger.info(f"Starting {func.__name__}...")
-            func()
-            logger.info(f"{func.__name__} finished!")
-        except Exception as e:
-            logger.error(f"Error in {func.__name__}: {e.__class__.__name__}: {str(e)}")
-            continue
+    report = analyzer.run_stages(args.stages, concurrent=not args.sequential, profile=args.profile,
+                                 max_age=args.max_age, tabs=args.tabs, deadline=args.deadline)
 
     # Checking running time
     end_time = time.time()
     logger.info(f'Done in {int(end_time - start_time)} seconds.')
+    if report.saved_time:
+        logger.info(f'Running stages concurrently saved {report.saved_time:.1f} seconds.')
+    timed_out = [stage for stage, result in report.results.items() if result['status'] == 'timeout']
+    if timed_out:
+        logger.warning(f'Ran out of time: {", ".join(timed_out)}')
+    reused = [stage for stage, result in report.results.items() if result['status'] == 'cached']
+    if reused:
+        logger.info(f'Reused the fresh outputs of {len(reused)} stages: {", ".join(reused)}')
+    if analyzer.network:
+        logger.info(f'Network: {format_network(analyzer.network.values())}')
+    logger.info(f'Lookup cache: {format_stats(get_cache().stats())}')
+    if 'get_gtmetrix' in report.results and report.results['get_gtmetrix']['status'] != 'cached':
+        logger.info(f'GTMetrix session: {format_session_stats(get_session_store().stats())}')
 
     # Optimize Images
     if args.optimize:
-        analyzer.optimize()
+        analyzer.optimize(args.formats)
 
     # Close Driver After Analyze
     analyzer.close()
 
+    spans = tracer.pop_spans()
+    if args.trace:
+        tracer.export_jsonl(args.trace, spans)
+        logger.info(f'Trace: {args.trace}')
+    if args.metrics:
+        write_prometheus(args.metrics, spans)
+        logger.info(f'Metrics: {args.metrics}')
+
+
+def batch_mode(args, stage_timeouts: dict = None):
+    from batch import read_urls, run_batch, merge_stats
+
+    urls = read_urls(args.input)
+    if not urls:
+        logger.error('No URLs to analyze!')
+        return
+
+    # The workers append their spans to the trace file, the metrics are made from it at the end
+    trace_path = args.trace
+    if args.metrics and not trace_path:
+        fd, trace_path = tempfile.mkstemp(prefix='trace-', suffix='.jsonl')
+        os.close(fd)
+
+    start_time = time.time()
+
+    statuses = {}
+    cache_stats = {}
+    session_stats = {}
+    for i, record in enumerate(run_batch(urls, args.workers, args.manifest, args.driver, args.verbose,
+                                         args.optimize, not args.sequential, args.recycle, args.wait_strategy,
+                                         args.formats, args.capture, trace_path=trace_path,
+                                         stages=args.stages, profile=args.profile, max_age=args.max_age,
+                                         block_requests=not args.no_block, tabs=args.tabs,
+                                         deadline=args.deadline, stage_timeouts=stage_timeouts,
+                                         hedge_after=args.hedge), 1):
+        statuses[record['status']] = statuses.get(record['status'], 0) + 1
+        # Workers report their total cache stats, so only the last record of every worker counts
+        cache_stats[record['worker']] = record.get('cache', {})
+        session_stats[record['worker']] = record.get('session', {})
+        logger.info(f"[{i}/{len(urls)}] {record['url']}: {record['status']} ({record['seconds']} seconds)")
+
+    # Checking running time
+    end_time = time.time()
+    logger.info(f'Done {len(urls)} URLs in {int(end_time - start_time)} seconds: ' +
+                ', '.join(f'{count} {status}' for status, count in statuses.items()))
+    logger.info(f'Lookup cache: {format_stats(merge_stats(cache_stats.values()))}')
+    if 'get_gtmetrix' in args.stages:
+        logger.info(f'GTMetrix session: {format_session_stats(merge_session_stats(session_stats.values()))}')
+    logger.info(f'Manifest: {args.manifest}')
+
+    if args.metrics:
+        write_prometheus(args.metrics, load_jsonl(trace_path))
+        logger.info(f'Metrics: {args.metrics}')
+        if not args.trace:
+            os.remove(trace_path)
+    if args.trace:
+        logger.info(f'Trace: {args.trace}')
+
 
 if __name__ == '__main__':
     try:
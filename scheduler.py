@@ -0,0 +1,158 @@
+import os
+import time
+
+from typing import Callable, Dict, Iterable, List, Optional
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import log21
+
+from tracing import tracer, in_context
+from deadline import DeadlineExceeded
+
+# Resources a stage can declare
+BROWSER = 'browser'  # The one WebDriver session of the Analyzer
+NETWORK = 'network'  # Plain HTTP calls
+CPU = 'cpu'  # Image processing and other local work
+
+DEFAULT_LIMITS = {
+    BROWSER: 1,
+    NETWORK: 8,
+    CPU: os.cpu_count() or 1,
+}
+
+
+class Stage:
+    def __init__(self, name: str, func: Callable, resources: Iterable[str] = (), after: Iterable[str] = ()):
+        """
+        A unit of work for the StageScheduler.
+
+        :param name: Name of the stage
+        :param func: The function to run (without arguments)
+        :param resources: Resources the stage needs while it's running
+        :param after: Names of the stages that must be finished before this one starts
+        """
+        self.name = name
+        self.func = func
+        self.resources = tuple(resources)
+        self.after = tuple(after)
+
+    def __repr__(self):
+        return f'Stage({self.name!r}, resources={self.resources}, after={self.after})'
+
+
+class ScheduleReport:
+    def __init__(self):
+        self.results: Dict[str, dict] = {}
+        self.wall_time: float = 0
+
+    @property
+    def busy_time(self) -> float:
+        """The time it would have taken to run the stages one after another."""
+        return sum(result.get('seconds', 0) for result in self.results.values())
+
+    @property
+    def saved_time(self) -> float:
+        """The wall-clock time saved by overlapping the stages."""
+        return max(0.0, self.busy_time - self.wall_time)
+
+    def __repr__(self):
+        return f'ScheduleReport(wall_time={self.wall_time:.3f}, saved_time={self.saved_time:.3f})'
+
+
+class StageScheduler:
+    def __init__(self, stages: Iterable[Stage], limits: Optional[Dict[str, int]] = None, concurrent: bool = True):
+        """
+        Runs stages concurrently as long as their dependencies are finished and the resources they need are free.
+        Stages are started in the order they are given whenever there is a choice.
+
+        :param stages: The stages to run
+        :param limits: Maximum number of stages that can use each resource at the same time
+        :param concurrent: If False, runs the stages one after another
+        """
+        self.stages: List[Stage] = list(stages)
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits or {})
+        self.concurrent = concurrent
+
+        names = {stage.name for stage in self.stages}
+        for stage in self.stages:
+            for dependency in stage.after:
+                if dependency not in names:
+                    raise ValueError(f'{stage.name} depends on an unknown stage: {dependency}')
+
+    def _run_stage(self, stage: Stage, start: float) -> dict:
+        started = time.perf_counter()
+        result = {'status': 'ok', 'start': round(started - start, 3)}
+        with tracer.span(stage.name, kind='stage') as span:
+            try:
+                log21.info(f"Starting {stage.name}...")
+                stage.func()
+                log21.info(f"{stage.name} finished!")
+            except Exception as e:
+                log21.error(f"Error in {stage.name}: {e.__class__.__name__}: {str(e)}")
+                # A stage that ran out of its time budget is told apart from one that failed
+                result['status'] = span.outcome = 'timeout' if isinstance(e, DeadlineExceeded) else 'error'
+                result['error'] = span.error = f"{e.__class__.__name__}: {str(e)}"
+        result['seconds'] = round(time.perf_counter() - started, 3)
+        return result
+
+    def _fits(self, stage: Stage, in_use: Dict[str, int]) -> bool:
+        return all(in_use.get(resource, 0) < self.limits.get(resource, 1) for resource in stage.resources)
+
+    def run(self, on_result: Optional[Callable[[str, dict], None]] = None) -> ScheduleReport:
+        """
+        Runs all the stages.
+        A stage whose dependency has failed is skipped.
+
+        :param on_result: Called with the name and the result of every stage as soon as it's finished or skipped
+        :return: The report of the run
+        """
+        report = ScheduleReport()
+        start = time.perf_counter()
+        pending = list(self.stages)
+        in_use: Dict[str, int] = {}
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=max(1, len(self.stages)) if self.concurrent else 1) as executor:
+            while pending or running:
+                skipped = False
+                for stage in list(pending):
+                    if any(report.results.get(dep, {}).get('status') not in (None, 'ok') for dep in stage.after):
+                        pending.remove(stage)
+                        report.results[stage.name] = {'status': 'skipped', 'seconds': 0,
+                                                      'error': 'A dependency has failed'}
+                        if on_result:
+                            on_result(stage.name, report.results[stage.name])
+                        skipped = True
+                        continue
+                    if not all(dep in report.results for dep in stage.after):
+                        continue
+                    if running and not self.concurrent:
+                        break
+                    if not self._fits(stage, in_use):
+                        continue
+                    pending.remove(stage)
+                    for resource in stage.resources:
+                        in_use[resource] = in_use.get(resource, 0) + 1
+                    running[executor.submit(in_context(self._run_stage), stage, start)] = stage
+
+                if not running:
+                    if skipped:
+                        continue
+                    if pending:
+                        raise RuntimeError(f'Cannot schedule the stages: {pending}')
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    for resource in stage.resources:
+                        in_use[resource] -= 1
+                    report.results[stage.name] = future.result()
+                    if on_result:
+                        on_result(stage.name, report.results[stage.name])
+
+        report.wall_time = time.perf_counter() - start
+        # Keep the order of the stages in the results
+        report.results = {stage.name: report.results[stage.name] for stage in self.stages}
+        return report
@@ -0,0 +1,454 @@
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import mimetypes
+import urllib.parse
+
+from http import HTTPStatus
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from contextlib import nullcontext
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import log21
+
+from decouple import config
+
+from main import Analyzer, is_valid_url, needs_browser, normalize_stages, STAGES, STAGE_NAMES, STAGE_OUTPUTS
+from batch import output_name
+from driver_pool import DriverPool
+import asset_registry
+from tracing import tracer
+from stage_cache import DEFAULT_MAX_AGE
+
+logger = log21.get_logger()
+
+HOST = config('SERVER_HOST', default='127.0.0.1')
+PORT = config('SERVER_PORT', default=8080, cast=int)
+# Jobs that can wait for a worker; more submissions are answered with 503 until the queue has room again
+MAX_PENDING = config('SERVER_MAX_PENDING', default=32, cast=int)
+# Finished jobs (and their events) that are kept for GET /jobs/<id>
+MAX_FINISHED = 1000
+MAX_BODY = 64 * 1024
+MAX_HEADERS = 100
+# Seconds a client is told to wait when the queue is full
+RETRY_AFTER = 5
+
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, headers: Dict[str, str] = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class Job:
+    def __init__(self, url: str, stages: List[str], name: str):
+        """
+        A submitted analysis and the events of its stages.
+
+        :param url: The URL to analyze
+        :param stages: Names of the stages to run
+        :param name: Name of the output directory
+        """
+        self.id = uuid.uuid4().hex[:12]
+        self.url = url
+        self.stages = stages
+        self.name = name
+        self.status = QUEUED
+        self.submitted = time.time()
+        self.saved_path: Optional[str] = None
+        self.events: List[dict] = []
+        self._subscribers: List[asyncio.Queue] = []
+
+    def add_event(self, event: dict):
+        """Adds an event and hands it to the clients that are streaming the job (on the event loop)."""
+        event['t'] = round(time.time() - self.submitted, 3)
+        self.events.append(event)
+        for subscriber in self._subscribers:
+            subscriber.put_nowait(event)
+
+    async def stream(self) -> AsyncIterator[dict]:
+        """Yields the events of the job so far, then the new ones until the job is finished."""
+        # Runs on the event loop: no event can be added between the copy and the subscription
+        subscriber = asyncio.Queue()
+        self._subscribers.append(subscriber)
+        try:
+            for event in list(self.events):
+                yield event
+                if event['event'] == 'done':
+                    return
+            while True:
+                event = await subscriber.get()
+                yield event
+                if event['event'] == 'done':
+                    return
+        finally:
+            self._subscribers.remove(subscriber)
+
+    def to_dict(self) -> dict:
+        return {'id': self.id, 'url': self.url, 'stages': self.stages, 'status': self.status,
+                'saved_path': self.saved_path, 'events': self.events}
+
+
+class AnalyzerService:
+    def __init__(self, workers: int = 2, max_pending: int = MAX_PENDING, chromedriver_path: str = None,
+                 verbose: bool = False, max_age: float = DEFAULT_MAX_AGE, tabs: int = 1, block_requests: bool = True,
+                 deadline: float = None):
+        """
+        Runs the submitted jobs on warm workers: the imports, assets and (pooled) browsers are kept between jobs.
+        Every job reports each stage as soon as its outputs are saved.
+
+        :param workers: Number of jobs that run at the same time (and of browsers)
+        :param max_pending: Number of jobs that can wait for a worker
+        :param chromedriver_path: ChromeDriver path
+        :param verbose: Verbose mode for Chrome
+        :param max_age: Reuse the outputs of stages that finished less than this many seconds ago
+        :param tabs: Number of browser stages every job runs at the same time in tabs
+        :param block_requests: Block the requests the browser stages don't need
+        :param deadline: Time budget of every job in seconds (a stuck site doesn't hold a worker for longer)
+        """
+        self.workers = workers
+        self.max_age = max_age
+        self.tabs = tabs
+        self.block_requests = block_requests
+        self.deadline = deadline
+        self.pool = DriverPool(workers, chromedriver_path, verbose)
+        self.queue: Optional[asyncio.Queue] = None
+        self.max_pending = max_pending
+        self.jobs: Dict[str, Job] = OrderedDict()
+        self.running = 0
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='analyzer')
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self, warm: bool = False):
+        """
+        Starts the workers.
+
+        :param warm: Launch all the browsers now instead of on the first jobs that need them
+        """
+        self._loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(self.max_pending)
+        # Decode the templates and fonts before the first job
+        await self._loop.run_in_executor(self._executor, asset_registry.preload)
+        if warm:
+            drivers = await asyncio.gather(*(self._loop.run_in_executor(self._executor, self.pool.acquire)
+                                             for _ in range(self.workers)))
+            for driver in drivers:
+                self.pool.release(driver)
+            logger.info(f'Launched {len(drivers)} browsers')
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    def submit(self, url: str, stages: List[str], name: str = None) -> Job:
+        """
+        Queues a job.
+
+        :param url: The URL to analyze
+        :param stages: Names of the stages to run
+        :param name: Name of the output directory (defaults to the domain)
+        :return: The job
+        :raise HTTPError: 503 if the queue is full
+        """
+        job = Job(url, stages, name or output_name(url))
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, 'Too many jobs are waiting, try again later',
+                            {'Retry-After': str(RETRY_AFTER)})
+        self.jobs[job.id] = job
+        job.add_event({'event': 'queued', 'job': job.id, 'position': self.queue.qsize()})
+
+        # Forget the oldest finished jobs
+        finished = [key for key, old in self.jobs.items() if old.status == FINISHED]
+        for key in finished[:max(0, len(finished) - MAX_FINISHED)]:
+            del self.jobs[key]
+
+        return job
+
+    async def _work(self):
+        while True:
+            job = await self.queue.get()
+            job.status = RUNNING
+            self.running += 1
+            try:
+                await self._loop.run_in_executor(self._executor, self._run, job)
+            except Exception as e:
+                job.add_event({'event': 'done', 'status': 'failed', 'error': f'{e.__class__.__name__}: {str(e)}'})
+            finally:
+                job.status = FINISHED
+                self.running -= 1
+                self.queue.task_done()
+
+    def _publish(self, job: Job, event: dict):
+        self._loop.call_soon_threadsafe(job.add_event, event)
+
+    @staticmethod
+    def _stage_event(job: Job, stage: str, result: dict) -> dict:
+        files = [f'/jobs/{job.id}/files/{os.path.basename(path)}' for path in result.get('artifacts', ())]
+        return dict(result, event='stage', stage=stage, files=files)
+
+    def _run(self, job: Job):
+        """Runs a job on a worker thread."""
+        start = time.perf_counter()
+        with self.pool.borrow() if needs_browser(job.stages) else nullcontext() as driver:
+            analyzer = Analyzer(job.url, job.name, driver=driver, block_requests=self.block_requests)
+            try:
+                job.saved_path = analyzer.saved_path
+                self._publish(job, {'event': 'started', 'saved_path': analyzer.saved_path})
+                report = analyzer.run_stages(
+                    job.stages, max_age=self.max_age, tabs=self.tabs, deadline=self.deadline,
+                    on_stage=lambda stage, result: self._publish(job, self._stage_event(job, stage, result))
+                )
+            finally:
+                analyzer.close()
+        # The spans of the finished jobs are not kept in memory
+        tracer.pop_spans()
+
+        failed = sum(result['status'] not in ('ok', 'cached') for result in report.results.values())
+        status = 'ok' if not failed else 'failed' if failed == len(report.results) else 'partial'
+        self._publish(job, {'event': 'done', 'status': status, 'seconds': round(time.perf_counter() - start, 3)})
+
+    def health(self) -> dict:
+        return {'workers': self.workers, 'running': self.running, 'queued': self.queue.qsize(),
+                'max_pending': self.max_pending}
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._executor.shutdown(wait=True)
+        self.pool.close()
+
+
+async def read_request(reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], bytes]:
+    """
+    Reads an HTTP/1.1 request.
+
+    :return: The method, the target, the headers (lower-case names) and the body
+    """
+    line = (await reader.readline()).decode('latin-1').strip()
+    try:
+        method, target, _ = line.split(' ')
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, 'Malformed request line')
+
+    headers = {}
+    while True:
+        header = (await reader.readline()).decode('latin-1')
+        if header in ('\r\n', '\n', ''):
+            break
+        if len(headers) >= MAX_HEADERS:
+            raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, 'Too many headers')
+        name, _, value = header.partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length') or 0)
+    if length > MAX_BODY:
+        raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, 'The request body is too large')
+    body = await reader.readexactly(length) if length else b''
+
+    return method, target, headers, body
+
+
+def _head(status: int, headers: Dict[str, str]) -> bytes:
+    lines = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}', 'Connection: close']
+    lines += [f'{name}: {value}' for name, value in headers.items()]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+async def send(writer: asyncio.StreamWriter, status: int, body: bytes, content_type: str = 'application/json',
+               headers: Dict[str, str] = None):
+    writer.write(_head(status, {'Content-Type': content_type, 'Content-Length': str(len(body)), **(headers or {})}))
+    writer.write(body)
+    await writer.drain()
+
+
+async def send_json(writer: asyncio.StreamWriter, status: int, data, headers: Dict[str, str] = None):
+    await send(writer, status, json.dumps(data).encode(), headers=headers)
+
+
+async def send_events(writer: asyncio.StreamWriter, status: int, events: AsyncIterator[dict]):
+    """Streams events as JSON lines (a chunk per event) as soon as they happen."""
+    writer.write(_head(status, {'Content-Type': 'application/x-ndjson', 'Transfer-Encoding': 'chunked',
+                                'Cache-Control': 'no-cache'}))
+    async for event in events:
+        line = json.dumps(event).encode() + b'\n'
+        writer.write(f'{len(line):x}\r\n'.encode() + line + b'\r\n')
+        await writer.drain()
+    writer.write(b'0\r\n\r\n')
+    await writer.drain()
+
+
+def parse_job(body: bytes) -> Tuple[str, List[str], Optional[str]]:
+    """
+    Reads a job submission: `{"url": ..., "stages": ["whois", ...], "name": ...}` (stages and name are optional).
+
+    :return: The URL, the stages and the name
+    """
+    try:
+        data = json.loads(body or b'{}')
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, 'The body is not valid JSON')
+    if not isinstance(data, dict):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, 'The body must be a JSON object')
+
+    url = data.get('url')
+    if not isinstance(url, str) or not is_valid_url(url):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, 'Invalid URL')
+    stages = data.get('stages') or list(STAGES)
+    if not isinstance(stages, list) or any(stage not in STAGES + STAGE_NAMES for stage in stages):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f'Stages must be a list of: {", ".join(STAGE_NAMES)}')
+    stages = normalize_stages(stages)
+    name = data.get('name')
+    if name is not None and (not isinstance(name, str) or not name or os.path.basename(name) != name):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, 'Invalid name')
+
+    return url, stages, name
+
+
+class Server:
+    def __init__(self, service: AnalyzerService):
+        """
+        The HTTP API of an AnalyzerService:
+
+        - `POST /jobs` with `{"url": ..., "stages": [...]}` queues a job (202, or 503 when the queue is full);
+          with `?stream=1` the response streams the events of the job as JSON lines
+        - `GET /jobs/<id>` gets a job and its events so far
+        - `GET /jobs/<id>/events` streams the events of a job as JSON lines
+        - `GET /jobs/<id>/files/<name>` gets an output image of a job
+        - `GET /health` gets the number of running and queued jobs
+        """
+        self.service = service
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                method, target, headers, body = await read_request(reader)
+                await self.route(writer, method, target, body)
+            except HTTPError as e:
+                await send_json(writer, e.status, {'error': str(e)}, e.headers)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+            except Exception as e:
+                logger.error(f'Server: {e.__class__.__name__}: {str(e)}')
+                await send_json(writer, HTTPStatus.INTERNAL_SERVER_ERROR, {'error': 'Internal error'})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def _job(self, job_id: str) -> Job:
+        job = self.service.jobs.get(job_id)
+        if job is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, 'No such job')
+        return job
+
+    async def route(self, writer: asyncio.StreamWriter, method: str, target: str, body: bytes):
+        url = urllib.parse.urlsplit(target)
+        parts = [urllib.parse.unquote(part) for part in url.path.split('/') if part]
+        query = urllib.parse.parse_qs(url.query)
+
+        if parts == ['health'] and method == 'GET':
+            return await send_json(writer, HTTPStatus.OK, self.service.health())
+
+        if parts == ['jobs'] and method == 'POST':
+            job = self.service.submit(*parse_job(body))
+            if query.get('stream', ['0'])[0] not in ('0', 'false', ''):
+                return await send_events(writer, HTTPStatus.ACCEPTED, job.stream())
+            return await send_json(writer, HTTPStatus.ACCEPTED, {'id': job.id, 'events': f'/jobs/{job.id}/events'})
+
+        if len(parts) >= 2 and parts[0] == 'jobs' and method == 'GET':
+            job = self._job(parts[1])
+            if len(parts) == 2:
+                return await send_json(writer, HTTPStatus.OK, job.to_dict())
+            if parts[2:] == ['events']:
+                return await send_events(writer, HTTPStatus.OK, job.stream())
+            if len(parts) == 4 and parts[2] == 'files':
+                return await self._send_file(writer, job, parts[3])
+
+        if parts in (['health'], ['jobs']) or (parts and parts[0] == 'jobs'):
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, 'Method not allowed')
+        raise HTTPError(HTTPStatus.NOT_FOUND, 'Not found')
+
+    async def _send_file(self, writer: asyncio.StreamWriter, job: Job, name: str):
+        # Only the outputs of the stages (and their optimized versions), never a path outside the job
+        stem, extension = os.path.splitext(name)
+        outputs = {os.path.splitext(output)[0] for outputs in STAGE_OUTPUTS.values() for output in outputs}
+        if job.saved_path is None or stem not in outputs or extension not in ('.png', '.webp', '.avif'):
+            raise HTTPError(HTTPStatus.NOT_FOUND, 'No such file')
+        path = os.path.join(job.saved_path, name)
+        try:
+            with open(path, 'rb') as file:
+                data = await asyncio.get_running_loop().run_in_executor(None, file.read)
+        except FileNotFoundError:
+            raise HTTPError(HTTPStatus.NOT_FOUND, 'No such file')
+        await send(writer, HTTPStatus.OK, data, mimetypes.guess_type(name)[0] or 'application/octet-stream')
+
+
+async def serve(host: str = HOST, port: int = PORT, warm: bool = False, **options):
+    """
+    Runs the HTTP service until it's cancelled.
+
+    :param host: Address to listen on
+    :param port: Port to listen on
+    :param warm: Launch the browsers at start
+    :param options: The options of AnalyzerService
+    """
+    service = AnalyzerService(**options)
+    await service.start(warm)
+    server = await asyncio.start_server(Server(service).handle, host, port)
+    logger.info(f"Listening on http://{host}:{server.sockets[0].getsockname()[1]} "
+                f"({service.workers} workers, up to {service.max_pending} queued jobs)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
+
+
+def main():
+    parser = log21.ColorizingArgumentParser()
+    parser.add_argument('-H', '--host', help='Address to listen on', default=HOST)
+    parser.add_argument('-p', '--port', help='Port to listen on', type=int, default=PORT)
+    parser.add_argument('-w', '--workers', help='Number of jobs that run at the same time', type=int, default=2)
+    parser.add_argument('-Q', '--max-pending', help='Number of jobs that can wait for a worker', type=int,
+                        default=MAX_PENDING)
+    parser.add_argument('-W', '--warm', help='Launch the browsers at start', action='store_true')
+    parser.add_argument('-d', '--driver', help='ChromeDriver path')
+    parser.add_argument('-a', '--max-age', help='Reuse the outputs of stages that finished less than this many '
+                        'seconds ago', type=float, default=DEFAULT_MAX_AGE)
+    parser.add_argument('-T', '--tabs', help='Run up to this many browser stages of a job at the same time in tabs',
+                        type=int, default=1)
+    parser.add_argument('-D', '--deadline', help='Time budget of every job in seconds', type=float)
+    parser.add_argument('-N', '--no-block', help="Don't block the requests the browser stages don't need",
+                        action='store_true')
+    parser.add_argument('-v', '--verbose', help='Verbose mode', action='store_true')
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error('Number of workers must be at least 1')
+    if args.max_pending < 1:
+        parser.error('Number of pending jobs must be at least 1')
+    if args.verbose:
+        log21.basic_config(level=log21.DEBUG)
+
+    asyncio.run(serve(args.host, args.port, args.warm, workers=args.workers, max_pending=args.max_pending,
+                      chromedriver_path=args.driver, verbose=args.verbose, max_age=args.max_age, tabs=args.tabs,
+                      block_requests=not args.no_block, deadline=args.deadline))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        logger.clear_line()
+        logger.error("KeyboardInterrupt: Exiting...")
+        sys.exit(0)
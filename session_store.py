@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import base64
+import hashlib
+import tempfile
+import threading
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+from contextlib import contextmanager
+
+import log21
+
+from decouple import config
+
+from lookup_cache import user_cache_dir
+from driver_downloader import file_lock
+
+SESSION_PATH = config('GTMETRIX_SESSION', default=os.path.join(user_cache_dir(), 'gtmetrix-session.bin'))
+# A Fernet key (`Fernet.generate_key()`); without it, the key is derived from the GTMetrix credentials
+SESSION_KEY = config('SESSION_KEY', default='')
+# Saved sessions older than this many seconds are not restored
+SESSION_MAX_AGE = config('SESSION_MAX_AGE', default=7 * 24 * 60 * 60, cast=float)
+KDF_ITERATIONS = 200_000
+SALT_SIZE = 16
+# The cookie fields Network.setCookies takes
+COOKIE_FIELDS = ('name', 'value', 'domain', 'path', 'secure', 'httpOnly', 'sameSite', 'expires', 'priority')
+
+_store: Optional['SessionStore'] = None
+
+
+def get_cookies(driver, url: str) -> List[dict]:
+    """
+    Gets the cookies of a website from the browser, including the HttpOnly ones.
+
+    :param driver: The driver
+    :param url: A URL of the website
+    :return: The cookies (in the format of the DevTools Protocol)
+    """
+    cookies = driver.execute_cdp_cmd('Network.getCookies', {'urls': [url]})['cookies']
+    return [{field: cookie[field] for field in COOKIE_FIELDS if field in cookie} for cookie in cookies]
+
+
+def set_cookies(driver, cookies: List[dict]) -> bool:
+    """
+    Puts cookies in the browser before their website is loaded.
+
+    :param driver: The driver
+    :param cookies: The output of `get_cookies`
+    :return: False if the browser didn't take the cookies
+    """
+    try:
+        driver.execute_cdp_cmd('Network.setCookies', {'cookies': cookies})
+    except Exception as e:
+        log21.debug(f'set_cookies: {e.__class__.__name__}: {str(e)}')
+        return False
+    return True
+
+
+class SessionStore:
+    def __init__(self, path: Union[str, os.PathLike] = SESSION_PATH, key: str = SESSION_KEY, secret: str = None,
+                 max_age: float = SESSION_MAX_AGE):
+        """
+        Keeps the cookies of a logged-in session in an encrypted file,
+        so later runs and the other batch workers can skip the login.
+        The file is encrypted with Fernet (from the optional `cryptography` package);
+        without it, nothing is saved and every run logs in.
+
+        :param path: Path of the file
+        :param key: A Fernet key; if empty, a key is derived from `secret` and a random salt with PBKDF2
+        :param secret: Defaults to the EMAIL and PASSWORD config
+        :param max_age: Saved sessions older than this many seconds are not restored
+        """
+        self.path = os.fspath(path)
+        self.key = key
+        self.secret = secret if secret is not None else config('EMAIL', default='') + config('PASSWORD', default='')
+        self.max_age = max_age
+        self.counts = {'reused': 0, 'logins': 0, 'expired': 0}
+        self._lock = threading.Lock()
+        self._warned = False
+        # The key derived from the secret and the salt of the last file (PBKDF2 takes a while on purpose),
+        # which is reused to save the session again
+        self._derived: Optional[Tuple[str, bytes, Any]] = None
+
+    def _fernet(self, salt: bytes):
+        try:
+            from cryptography.fernet import Fernet
+        except ImportError:
+            if not self._warned:
+                log21.warning('Install `cryptography` to keep the GTMetrix session between runs')
+                self._warned = True
+            return None
+
+        if self.key:
+            return Fernet(self.key)
+        if not self.secret:
+            return None
+        derived = self._derived
+        if derived is not None and derived[:2] == (self.secret, salt):
+            return derived[2]
+        key = hashlib.pbkdf2_hmac('sha256', self.secret.encode(), salt, KDF_ITERATIONS)
+        fernet = Fernet(base64.urlsafe_b64encode(key))
+        self._derived = (self.secret, salt, fernet)
+        return fernet
+
+    def load(self) -> Optional[dict]:
+        """
+        Reads the saved session.
+
+        :return: {'cookies': [...], 'saved': ...} or None if there is no usable session
+        """
+        try:
+            with open(self.path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+
+        fernet = self._fernet(data[:SALT_SIZE])
+        if fernet is None:
+            return None
+        try:
+            session = json.loads(fernet.decrypt(data[SALT_SIZE:], ttl=int(self.max_age)))
+        except Exception as e:
+            # Expired, or saved with another key
+            log21.debug(f'SessionStore: Cannot use the saved session: {e.__class__.__name__}: {str(e)}')
+            return None
+
+        return session
+
+    def save(self, cookies: List[dict]):
+        """
+        Saves the cookies of a session (replacing the file atomically).
+
+        :param cookies: The cookies
+        """
+        # Keep the salt of the last file (Fernet takes a random IV for every message, so the salt can be reused)
+        derived = self._derived
+        salt = derived[1] if derived is not None and derived[0] == self.secret else os.urandom(SALT_SIZE)
+        fernet = self._fernet(salt)
+        if fernet is None:
+            return
+
+        data = salt + fernet.encrypt(json.dumps({'cookies': cookies, 'saved': time.time()}).encode())
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        # mkstemp makes the file readable by the owner only
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.session-')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def clear(self):
+        """Removes the saved session."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def lock(self):
+        """Holds an exclusive lock on the session, so only one process logs in at a time."""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with file_lock(self.path + '.lock'):
+            yield
+
+    def count(self, outcome: str):
+        """
+        Counts a use of the session.
+
+        :param outcome: `reused` (the login was skipped), `logins` or `expired` (a restored session was logged out)
+        """
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Gets the number of times the login was skipped, done and needed again in this process."""
+        with self._lock:
+            return dict(self.counts)
+
+
+def merge_session_stats(stats: Iterable[Dict[str, int]]) -> Dict[str, int]:
+    """
+    Sums the session stats of several workers.
+
+    :param stats: Stats of the workers
+    :return: The total stats
+    """
+    total = {'reused': 0, 'logins': 0, 'expired': 0}
+    for worker_stats in stats:
+        for outcome, count in worker_stats.items():
+            total[outcome] = total.get(outcome, 0) + count
+    return total
+
+
+def format_session_stats(stats: Dict[str, int]) -> str:
+    """
+    Formats the session stats for the logs.
+
+    :param stats: The output of `SessionStore.stats`
+    :return: e.g. `login skipped 9 times, 1 logins (0 expired sessions)`
+    """
+    return f"login skipped {stats['reused']} times, {stats['logins']} logins ({stats['expired']} expired sessions)"
+
+
+def get_session_store() -> SessionStore:
+    """Gets the shared SessionStore of the process."""
+    global _store
+    if _store is None:
+        _store = SessionStore()
+    return _store
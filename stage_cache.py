@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+
+from typing import Iterable, Optional, Union
+
+from decouple import config
+
+from lookup_cache import SQLiteConnectionMixin, open_sqlite, user_cache_dir
+
+CACHE_PATH = config('STAGE_CACHE', default=os.path.join(user_cache_dir(), 'stages.sqlite3'))
+# Outputs younger than this many seconds are reused by `run.py` (0 runs every stage again)
+DEFAULT_MAX_AGE = config('STAGE_MAX_AGE', default=60 * 60, cast=float)
+
+_cache: Optional['StageCache'] = None
+_lock = threading.Lock()
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS stages (
+        key TEXT PRIMARY KEY,
+        url TEXT NOT NULL,
+        stage TEXT NOT NULL,
+        parameters TEXT NOT NULL,
+        saved_path TEXT NOT NULL,
+        files TEXT NOT NULL,
+        created REAL NOT NULL
+    )''',
+)
+
+
+def file_hash(path: Union[str, os.PathLike]) -> str:
+    """
+    Calculates the SHA-256 hash of a file.
+
+    :param path: Path of the file
+    :return: The hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(source: Union[str, os.PathLike], destination: Union[str, os.PathLike]):
+    """
+    Hard-links a file to the destination, or copies it if they are not on the same file system.
+    Files are always replaced (never written in place) by the analyzer, so a hard link can't change the source.
+
+    :param source: Path of the file
+    :param destination: Path of the link or the copy
+    """
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def stage_key(url: str, stage: str, parameters: dict) -> str:
+    return hashlib.sha256(json.dumps([url, stage, parameters], sort_keys=True).encode()).hexdigest()
+
+
+class StageCache(SQLiteConnectionMixin):
+    def __init__(self, path: Union[str, os.PathLike] = CACHE_PATH):
+        """
+        A manifest of the outputs of the finished stages.
+        Every record is keyed by the URL, the stage and the parameters the output depends on,
+        and keeps the time of the run and the path, size and hash of every output file,
+        so a later run can reuse the outputs while they are fresh and untouched.
+
+        :param path: Path of the SQLite database
+        """
+        super().__init__()
+        self.path = os.fspath(path)
+
+    def _connect(self) -> sqlite3.Connection:
+        return open_sqlite(self.path, SCHEMA)
+
+    def record(self, url: str, stage: str, parameters: dict, saved_path: Union[str, os.PathLike],
+               files: Iterable[str], created: float = None) -> float:
+        """
+        Records the outputs of a stage that has just finished successfully.
+
+        :param url: The analyzed URL
+        :param stage: Name of the stage
+        :param parameters: The parameters the outputs depend on
+        :param saved_path: The directory the outputs are in
+        :param files: Names of the output files
+        :param created: Time of the run (defaults to now; pass the old time when the outputs were only optimized)
+        :return: Time of the run
+        """
+        created = time.time() if created is None else created
+        saved_path = os.path.abspath(saved_path)
+        hashes = {}
+        for name in files:
+            path = os.path.join(saved_path, name)
+            hashes[name] = {'size': os.path.getsize(path), 'sha256': file_hash(path)}
+
+        connection = self.connection
+        with self._lock:
+            connection.execute('INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               (stage_key(url, stage, parameters), url, stage, json.dumps(parameters, sort_keys=True),
+                                saved_path, json.dumps(hashes), created))
+
+        return created
+
+    def lookup(self, url: str, stage: str, parameters: dict, max_age: float) -> Optional[dict]:
+        """
+        Finds the fresh outputs of a stage.
+        Outputs that are missing or were changed since they were recorded are not returned.
+
+        :param url: The analyzed URL
+        :param stage: Name of the stage
+        :param parameters: The parameters the outputs depend on
+        :param max_age: Maximum age of the outputs in seconds
+        :return: {'saved_path': ..., 'files': [...], 'age': ...} or None
+        """
+        connection = self.connection
+        with self._lock:
+            row = connection.execute('SELECT saved_path, files, created FROM stages WHERE key = ?',
+                                     (stage_key(url, stage, parameters),)).fetchone()
+        if row is None:
+            return None
+
+        saved_path, files, created = row[0], json.loads(row[1]), row[2]
+        age = time.time() - created
+        if age > max_age:
+            return None
+        for name, expected in files.items():
+            path = os.path.join(saved_path, name)
+            try:
+                if os.path.getsize(path) != expected['size'] or file_hash(path) != expected['sha256']:
+                    return None
+            except OSError:
+                return None
+
+        return {'saved_path': saved_path, 'files': list(files), 'age': age}
+
+    def reuse(self, entry: dict, saved_path: Union[str, os.PathLike]):
+        """
+        Hard-links (or copies) the outputs of a `lookup` into another output directory.
+
+        :param entry: The output of `lookup`
+        :param saved_path: The output directory
+        """
+        if os.path.abspath(saved_path) == entry['saved_path']:
+            return
+        for name in entry['files']:
+            link_or_copy(os.path.join(entry['saved_path'], name), os.path.join(saved_path, name))
+
+    def forget(self, url: str, stage: str, parameters: dict):
+        """Removes the record of a stage."""
+        connection = self.connection
+        with self._lock:
+            connection.execute('DELETE FROM stages WHERE key = ?', (stage_key(url, stage, parameters),))
+
+    def clear(self):
+        """Removes all the records."""
+        connection = self.connection
+        with self._lock:
+            connection.execute('DELETE FROM stages')
+
+
+def get_stage_cache() -> StageCache:
+    """Gets the shared StageCache of the process."""
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = StageCache()
+    return _cache
+
+
+def _reset_lock():
+    global _lock
+    _lock = threading.Lock()
+
+
+# A forked child must not inherit a lock held by another thread of the parent
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_lock)
@@ -0,0 +1,218 @@
+import json
+import queue
+import functools
+import threading
+
+from typing import Dict, List
+from contextlib import contextmanager
+
+import log21
+
+from selenium.common import WebDriverException
+from selenium.webdriver.remote.webelement import WebElement
+
+# Prefix of the window handles of old ChromeDriver versions (the rest is the DevTools target ID)
+HANDLE_PREFIX = 'CDwindow-'
+
+
+def _unwrap(value):
+    if isinstance(value, _Focused):
+        return value._target
+    if isinstance(value, (list, tuple)):
+        return type(value)(_unwrap(item) for item in value)
+    return value
+
+
+class _Focused:
+    def __init__(self, target, tab: 'TabDriver'):
+        """
+        Runs every command of the wrapped object (a driver or an element) in a tab,
+        holding the session while the command runs.
+
+        :param target: The driver or the element
+        :param tab: The tab
+        """
+        self._target = target
+        self._tab = tab
+
+    def _wrap(self, value):
+        if isinstance(value, WebElement):
+            return _Focused(value, self._tab)
+        if isinstance(value, list) and value and all(isinstance(item, WebElement) for item in value):
+            return [_Focused(item, self._tab) for item in value]
+        return value
+
+    def __getattr__(self, name):
+        # Properties like `title` run a command too
+        with self._tab.focus():
+            value = getattr(self._target, name)
+        if not callable(value):
+            return self._wrap(value)
+
+        @functools.wraps(value)
+        def call(*args, **kwargs):
+            with self._tab.focus():
+                return self._wrap(value(*_unwrap(args), **{key: _unwrap(item) for key, item in kwargs.items()}))
+
+        return call
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self._target!r}, handle={self._tab.handle!r})'
+
+
+class TabDriver(_Focused):
+    def __init__(self, tabs: 'TabSet', handle: str):
+        """
+        A tab of a TabSet that can be used like a driver.
+        Its commands wait for the commands of the other tabs, but its waits don't.
+
+        :param tabs: The TabSet
+        :param handle: The window handle of the tab
+        """
+        super().__init__(tabs.driver, self)
+        self.tabs = tabs
+        self.handle = handle
+
+    @contextmanager
+    def focus(self):
+        """Holds the session and switches it to this tab."""
+        with self.tabs.lock:
+            self.tabs.switch(self.handle)
+            yield
+
+    def get_log(self, log_type: str) -> List[dict]:
+        """Reads the log of the session, keeping only the DevTools events of this tab for the performance log."""
+        return self.tabs.get_log(self.handle, log_type)
+
+
+class TabSet:
+    def __init__(self, driver, size: int):
+        """
+        Runs up to `size` stages in the tabs of one browser, so their waits overlap without another Chrome.
+        The WebDriver session runs one command at a time, so every command takes the session and switches
+        to its tab; waiting (sleeping between polls) doesn't hold the session.
+        Tabs are opened on demand and closed by `close`.
+
+        :param driver: The driver
+        :param size: Maximum number of tabs
+        """
+        if size < 1:
+            raise ValueError('Number of tabs must be at least 1')
+
+        self.driver = driver
+        self.size = size
+        self.lock = threading.RLock()
+        self._original = driver.current_window_handle
+        self._current = self._original
+        self._handles: List[str] = [self._original]
+        self._idle = queue.LifoQueue()
+        self._idle.put(self._original)
+        self._created = 1
+        # Performance log entries of the other tabs, by DevTools target ID
+        self._logs: Dict[str, List[dict]] = {}
+
+    def switch(self, handle: str):
+        """Switches the session to a tab (the lock must be held)."""
+        if self._current != handle:
+            self.driver.switch_to.window(handle)
+            self._current = handle
+
+    def _open(self) -> str:
+        with self.lock:
+            self.driver.switch_to.new_window('tab')
+            self._current = handle = self.driver.current_window_handle
+            self._handles.append(handle)
+        log21.debug(f'TabSet: Opened tab {len(self._handles)}')
+        return handle
+
+    def acquire(self, timeout: float = None) -> TabDriver:
+        """
+        Takes a free tab, opening a new one if there are less than `size`.
+
+        :param timeout: Maximum number of seconds to wait for a free tab
+        :return: The tab
+        """
+        with self.lock:
+            create = self._idle.empty() and self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            try:
+                handle = self._open()
+            except BaseException:
+                with self.lock:
+                    self._created -= 1
+                raise
+        else:
+            try:
+                handle = self._idle.get(timeout=timeout)
+            except queue.Empty:
+                raise TimeoutError('No free tab')
+
+        return TabDriver(self, handle)
+
+    def release(self, tab: TabDriver):
+        """Gives a tab back."""
+        self._idle.put(tab.handle)
+
+    @contextmanager
+    def tab(self, timeout: float = None):
+        """
+        Takes a tab for a `with` block.
+
+        :param timeout: Maximum number of seconds to wait for a free tab
+        """
+        tab = self.acquire(timeout)
+        try:
+            yield tab
+        finally:
+            self.release(tab)
+
+    def get_log(self, handle: str, log_type: str) -> List[dict]:
+        """
+        Reads a log of the session for a tab.
+        The performance log has the events of all the tabs, so the ones of the other tabs are kept for them.
+
+        :param handle: The window handle of the tab
+        :param log_type: Type of the log (e.g. `performance`)
+        :return: The entries
+        """
+        with self.lock:
+            entries = self.driver.get_log(log_type)
+            if log_type != 'performance':
+                return entries
+
+            target = handle[len(HANDLE_PREFIX):] if handle.startswith(HANDLE_PREFIX) else handle
+            for entry in entries:
+                try:
+                    webview = json.loads(entry['message']).get('webview', target)
+                except (KeyError, ValueError):
+                    webview = target
+                self._logs.setdefault(webview, []).append(entry)
+
+            return self._logs.pop(target, [])
+
+    def close(self):
+        """Closes the tabs that were opened and switches back to the first one."""
+        with self.lock:
+            for handle in self._handles[1:]:
+                try:
+                    self.switch(handle)
+                    self.driver.close()
+                except WebDriverException as e:
+                    log21.debug(f'TabSet: Could not close a tab: {e.__class__.__name__}: {str(e)}')
+            self._handles = self._handles[:1]
+            try:
+                self.driver.switch_to.window(self._original)
+            finally:
+                self._current = self._original
+            self._logs = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return f'TabSet(size={self.size}, open={len(self._handles)})'
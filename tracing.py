@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import itertools
+import threading
+import contextvars
+
+from typing import Callable, Dict, Iterable, List, Optional, Union
+from contextlib import contextmanager
+
+OK = 'ok'
+ERROR = 'error'
+
+_ids = itertools.count(1)
+_current_span: contextvars.ContextVar = contextvars.ContextVar('current_span', default=None)
+_attributes: contextvars.ContextVar = contextvars.ContextVar('span_attributes', default={})
+
+
+class Span:
+    def __init__(self, name: str, attributes: dict = None, parent: 'Span' = None):
+        """
+        A timed step of the pipeline.
+
+        :param name: Name of the step (e.g. `get_whois`, `page_load`, `http`)
+        :param attributes: Extra information about the step (e.g. the URL)
+        :param parent: The span this one is a part of
+        """
+        self.id = f'{os.getpid()}-{next(_ids)}'
+        self.name = name
+        self.parent_id = parent.id if parent else None
+        self.attributes = dict(_attributes.get())
+        self.attributes.update(attributes or {})
+        self.start = time.time()
+        self.duration: Optional[float] = None
+        self.outcome = OK
+        self.error: Optional[str] = None
+        self._started = time.perf_counter()
+
+    def finish(self, error: BaseException = None):
+        self.duration = time.perf_counter() - self._started
+        if error is not None:
+            self.outcome = ERROR
+            self.error = f'{error.__class__.__name__}: {str(error)}'
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id, 'parent': self.parent_id, 'name': self.name, 'start': round(self.start, 6),
+            'duration': round(self.duration or 0, 6), 'outcome': self.outcome, 'error': self.error,
+            'attributes': self.attributes,
+        }
+
+    def __repr__(self):
+        return f'Span({self.name!r}, duration={self.duration}, outcome={self.outcome!r})'
+
+
+class Tracer:
+    def __init__(self):
+        """Collects the spans of the process."""
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """
+        Times the body of a `with` block as a span.
+        The span is a child of the span that is open in the current context.
+
+        :param name: Name of the span
+        :param attributes: Extra information about the span
+        """
+        span = Span(name, attributes, _current_span.get())
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.finish(e)
+            raise
+        else:
+            span.finish()
+        finally:
+            _current_span.reset(token)
+            with self._lock:
+                self.spans.append(span)
+
+    def record(self, name: str, duration: float, outcome: str = OK, error: str = None, **attributes) -> Span:
+        """
+        Adds a span that has already finished (e.g. one timed by other code).
+
+        :param name: Name of the span
+        :param duration: Duration of the span in seconds
+        :param outcome: `ok`, `error` or anything more specific (e.g. `timeout`)
+        :param error: The error message
+        :param attributes: Extra information about the span
+        """
+        span = Span(name, attributes, _current_span.get())
+        span.start -= duration
+        span.duration = duration
+        span.outcome = outcome
+        span.error = error
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def pop_spans(self) -> List[Span]:
+        """Removes and returns the collected spans."""
+        with self._lock:
+            spans, self.spans = self.spans, []
+        return spans
+
+    def export_jsonl(self, path: Union[str, os.PathLike], spans: Iterable[Span] = None):
+        """
+        Appends spans to a JSON lines file.
+        The lines are appended with a single write, so several processes can share the file.
+
+        :param path: Path of the file
+        :param spans: The spans to export (defaults to removing and exporting all the collected spans)
+        """
+        spans = self.pop_spans() if spans is None else spans
+        data = ''.join(json.dumps(span.to_dict(), default=str) + '\n' for span in spans).encode()
+        if not data:
+            return
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+
+@contextmanager
+def attributes(**values):
+    """Adds attributes (e.g. the URL) to every span that is started in the `with` block."""
+    merged = dict(_attributes.get())
+    merged.update(values)
+    token = _attributes.set(merged)
+    try:
+        yield
+    finally:
+        _attributes.reset(token)
+
+
+def in_context(func: Callable) -> Callable:
+    """
+    Binds a function to the current context, so spans it starts on another thread (e.g. in a
+    ThreadPoolExecutor) are children of the current span and get the current attributes.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(func, *args, **kwargs)
+
+
+def load_jsonl(path: Union[str, os.PathLike]) -> List[dict]:
+    """
+    Reads the spans of a JSON lines file.
+
+    :param path: Path of the file
+    :return: The spans as dictionaries
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(spans: Iterable[Union[Span, dict]], prefix: str = 'website_analyzer') -> str:
+    """
+    Summarizes spans in the Prometheus text format.
+
+    :param spans: Span objects or their dictionaries
+    :param prefix: Prefix of the metric names
+    :return: The metrics
+    """
+    totals: Dict[str, Dict[str, float]] = {}
+    for span in spans:
+        span = span.to_dict() if isinstance(span, Span) else span
+        total = totals.setdefault(span['name'], {'count': 0, 'sum': 0.0, 'max': 0.0, 'errors': 0})
+        total['count'] += 1
+        total['sum'] += span['duration']
+        total['max'] = max(total['max'], span['duration'])
+        if span['outcome'] != OK:
+            total['errors'] += 1
+
+    lines = [
+        f'# HELP {prefix}_span_duration_seconds Duration of the pipeline steps.',
+        f'# TYPE {prefix}_span_duration_seconds summary',
+    ]
+    for name, total in sorted(totals.items()):
+        lines.append(f'{prefix}_span_duration_seconds_sum{{span="{_escape(name)}"}} {total["sum"]:.6f}')
+        lines.append(f'{prefix}_span_duration_seconds_count{{span="{_escape(name)}"}} {total["count"]}')
+    lines += [
+        f'# HELP {prefix}_span_duration_seconds_max Longest duration of the pipeline steps.',
+        f'# TYPE {prefix}_span_duration_seconds_max gauge',
+    ]
+    for name, total in sorted(totals.items()):
+        lines.append(f'{prefix}_span_duration_seconds_max{{span="{_escape(name)}"}} {total["max"]:.6f}')
+    lines += [
+        f'# HELP {prefix}_span_failures_total Pipeline steps that did not finish successfully.',
+        f'# TYPE {prefix}_span_failures_total counter',
+    ]
+    for name, total in sorted(totals.items()):
+        lines.append(f'{prefix}_span_failures_total{{span="{_escape(name)}"}} {total["errors"]}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path: Union[str, os.PathLike], spans: Iterable[Union[Span, dict]]):
+    """
+    Writes the Prometheus textfile of the spans (atomically, as the node exporter expects).
+
+    :param path: Path of the file
+    :param spans: Span objects or their dictionaries
+    """
+    path = os.fspath(path)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        file.write(prometheus_text(spans))
+    os.replace(temp_path, path)
+
+
+tracer = Tracer()
+span = tracer.span
@@ -0,0 +1,193 @@
+import json
+import time
+
+from typing import Callable, Iterator, List, Optional, Tuple, TypeVar
+
+import log21
+
+from selenium.common import (
+    JavascriptException, NoSuchElementException, StaleElementReferenceException,
+    TimeoutException, WebDriverException,
+)
+from selenium.webdriver.common.by import By
+
+from tracing import tracer
+from deadline import DeadlineExceeded, check, limit
+
+T = TypeVar('T')
+
+POLL = 'poll'
+MUTATION = 'mutation'
+STRATEGIES = (POLL, MUTATION)
+
+
+class Backoff:
+    def __init__(self, initial: float = 0.05, factor: float = 1.5, maximum: float = 1.0):
+        """
+        Polling intervals that start fast and grow up to a maximum.
+
+        :param initial: The first interval in seconds
+        :param factor: Every interval is this many times longer than the previous one
+        :param maximum: The longest interval in seconds
+        """
+        self.initial = initial
+        self.factor = factor
+        self.maximum = maximum
+
+    def __iter__(self) -> Iterator[float]:
+        delay = self.initial
+        while True:
+            yield delay
+            delay = min(self.maximum, delay * self.factor)
+
+
+class WaitRecord:
+    def __init__(self, label: str, seconds: float, outcome: str, strategy: str):
+        self.label = label
+        self.seconds = seconds
+        self.outcome = outcome
+        self.strategy = strategy
+
+    def __repr__(self):
+        return f'WaitRecord({self.label!r}, seconds={self.seconds:.3f}, outcome={self.outcome!r})'
+
+
+def wait_for(condition: Callable[[], T], timeout: float, label: str = 'wait', backoff: Backoff = None,
+             ignored: Tuple[type, ...] = (NoSuchElementException, StaleElementReferenceException),
+             records: Optional[List[WaitRecord]] = None) -> T:
+    """
+    Calls the condition until it returns a truthy value or the timeout passes.
+
+    :param condition: A function without arguments
+    :param timeout: Maximum number of seconds to wait (cut short by the time budget of the caller)
+    :param label: Name of the wait for the logs and the records
+    :param backoff: Polling intervals (defaults to `Backoff()`)
+    :param ignored: Exceptions of the condition that count as a falsy result
+    :param records: A list to append the WaitRecord of the wait to
+    :return: The value of the condition
+    :raise DeadlineExceeded: If the time budget of the caller is spent before the condition is met
+    """
+    timeout = limit(timeout)
+    start = time.perf_counter()
+    deadline = start + timeout
+    outcome = 'timeout'
+    try:
+        for delay in backoff or Backoff():
+            try:
+                value = condition()
+                if value:
+                    outcome = 'ok'
+                    return value
+            except ignored:
+                pass
+
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                check()
+                raise TimeoutException(f'Timed out after {timeout} seconds waiting for {label}')
+            time.sleep(min(delay, remaining))
+    except TimeoutException:
+        raise
+    except DeadlineExceeded:
+        outcome = 'deadline'
+        raise
+    except BaseException:
+        outcome = 'error'
+        raise
+    finally:
+        _record(records, label, time.perf_counter() - start, outcome, POLL)
+
+
+def _record(records: Optional[List[WaitRecord]], label: str, seconds: float, outcome: str, strategy: str):
+    log21.debug(f'wait: {label}: {outcome} after {seconds:.3f} seconds ({strategy})')
+    tracer.record('wait', seconds, outcome, label=label, strategy=strategy)
+    if records is not None:
+        records.append(WaitRecord(label, seconds, outcome, strategy))
+
+
+# JavaScript expressions that find an element like `driver.find_element`
+_FINDERS = {
+    By.XPATH: 'document.evaluate({0}, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue',
+    By.ID: 'document.getElementById({0})',
+    By.NAME: 'document.getElementsByName({0})[0]',
+    By.CLASS_NAME: 'document.getElementsByClassName({0})[0]',
+    By.CSS_SELECTOR: 'document.querySelector({0})',
+    By.TAG_NAME: 'document.getElementsByTagName({0})[0]',
+}
+
+_OBSERVER_SCRIPT = '''
+const done = arguments[arguments.length - 1];
+const check = () => { try { return Boolean(%s) === %s; } catch (e) { return false; } };
+if (check()) { done(true); return; }
+const observer = new MutationObserver(() => {
+    if (check()) { observer.disconnect(); clearTimeout(timer); done(true); }
+});
+const timer = setTimeout(() => { observer.disconnect(); done(false); }, arguments[0]);
+observer.observe(document, {childList: true, subtree: true, attributes: true});
+'''
+
+
+def wait_for_element(driver, by: str, el: str, present: bool = True, timeout: float = 10,
+                     strategy: str = POLL, backoff: Backoff = None, records: Optional[List[WaitRecord]] = None):
+    """
+    Waits until an element appears on the page (or disappears from it).
+
+    With the `poll` strategy the page is checked with growing intervals.
+    With the `mutation` strategy a MutationObserver in the page reports the change as soon as it happens;
+    if the page navigates away while waiting, it falls back to polling for the rest of the time.
+
+    :param driver: The driver
+    :param by: By what basis to find the element?
+    :param el: The element you want to find on the page
+    :param present: Wait for the element to exist (True) or to be gone (False)
+    :param timeout: Maximum number of seconds to wait (cut short by the time budget of the caller)
+    :param strategy: `poll` or `mutation`
+    :param backoff: Polling intervals of the `poll` strategy
+    :param records: A list to append the WaitRecord of the wait to
+    :return: The element if `present` is True, else True
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f'Unknown wait strategy: {strategy}')
+    label = f'{el} {"present" if present else "gone"}'
+    timeout = limit(timeout)
+
+    if strategy == MUTATION and by in _FINDERS:
+        start = time.perf_counter()
+        script = _OBSERVER_SCRIPT % (_FINDERS[by].format(json.dumps(el)), 'true' if present else 'false')
+        outcome = 'timeout'
+        script_timeout = driver.timeouts.script
+        try:
+            driver.set_script_timeout(timeout + 5)
+            if driver.execute_async_script(script, int(timeout * 1000)):
+                outcome = 'ok'
+        except (JavascriptException, TimeoutException) as e:
+            # The page navigated away while waiting; poll the new page for the rest of the time
+            outcome = f'fallback: {e.__class__.__name__}'
+        except WebDriverException:
+            outcome = 'error'
+            raise
+        finally:
+            _record(records, label, time.perf_counter() - start, outcome, MUTATION)
+            try:
+                driver.set_script_timeout(script_timeout)
+            except WebDriverException:
+                pass
+
+        if outcome == 'ok':
+            return driver.find_element(by, el) if present else True
+        timeout = max(0.0, timeout - (time.perf_counter() - start))
+        if outcome == 'timeout':
+            check()
+            raise TimeoutException(f'Timed out waiting for {label}')
+
+    if present:
+        return wait_for(lambda: driver.find_element(by, el), timeout, label, backoff, records=records)
+
+    def gone() -> bool:
+        try:
+            driver.find_element(by, el)
+        except NoSuchElementException:
+            return True
+        return False
+
+    return wait_for(gone, timeout, label, backoff, records=records)
@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import threading
+import multiprocessing
+
+from typing import Optional
+
+import log21
+
+from main import STAGES, STAGE_NAMES, HEDGE_AFTER, is_valid_url, normalize_stages
+from batch import read_urls, init_worker, analyze_url
+from job_queue import (
+    Job, JobQueue, LeaseLost, open_queue, QUEUE_URL, DEFAULT_LEASE, DEFAULT_MAX_ATTEMPTS, PENDING, RUNNING, DONE,
+    STATUSES,
+)
+from waiting import POLL
+from capture import FULL
+from stage_cache import DEFAULT_MAX_AGE
+
+# The progress of the jobs is shown even though the workers log only the errors of the stages
+logger = log21.get_logger('worker', level=log21.INFO)
+
+# Seconds between the claims of an idle worker
+POLL_INTERVAL = 2.0
+
+
+class Heartbeat:
+    def __init__(self, queue: JobQueue, job: Job, lease: float):
+        """
+        Renews the lease of a job in the background while it's running.
+
+        :param queue: The queue
+        :param job: The claimed job
+        :param lease: Length of the lease in seconds; it's renewed every third of it
+        """
+        self.queue = queue
+        self.job = job
+        self.lease = lease
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+
+    def _beat(self):
+        while not self._stop.wait(self.lease / 3):
+            try:
+                self.queue.heartbeat(self.job, self.lease)
+            except LeaseLost as e:
+                logger.warning(str(e))
+                return
+            except Exception as e:
+                logger.error(f"Couldn't renew the lease of job {self.job.id}: {e.__class__.__name__}: {str(e)}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_job(queue: JobQueue, job: Job, lease: float = DEFAULT_LEASE) -> Optional[str]:
+    """
+    Analyzes the URL of a claimed job and records the result in the queue.
+
+    :param queue: The queue
+    :param job: The claimed job
+    :param lease: Length of the lease in seconds
+    :return: The new status of the job, or None if the lease was lost
+    """
+    if not is_valid_url(job.url):
+        return queue.fail(job, 'Invalid URL', retry=False)
+
+    with Heartbeat(queue, job, lease):
+        record = analyze_url(job.url, job.stages, job.id)
+    record['job'] = job.id
+    record['attempt'] = job.attempts
+
+    try:
+        if record['status'] == 'ok':
+            queue.complete(job, record)
+            return DONE
+        error = record.get('error') or '; '.join(f"{stage}: {result.get('error')}"
+                                                 for stage, result in record.get('stages', {}).items()
+                                                 if result['status'] not in ('ok', 'cached'))
+        # The successful stages of a partial run are reused by the retry (through the stage cache)
+        return queue.fail(job, error, record)
+    except LeaseLost as e:
+        logger.warning(f'{e}; dropping the result of attempt {job.attempts}')
+        return None
+
+
+def work(queue_url: str = QUEUE_URL, options: dict = None, chromedriver_path: str = None, recycle: int = 50,
+         lease: float = DEFAULT_LEASE, exit_when_empty: bool = False, poll_interval: float = POLL_INTERVAL):
+    """
+    Claims and runs jobs until it's stopped (SIGTERM or SIGINT finish the running job first).
+
+    :param queue_url: URL of the queue
+    :param options: The options of `run_batch` (without `stages`; every job has its own)
+    :param chromedriver_path: ChromeDriver path
+    :param recycle: Number of jobs after which the worker restarts its browser (0 for never)
+    :param lease: Length of the leases in seconds
+    :param exit_when_empty: Stop when there are no pending or running jobs left
+    :param poll_interval: Seconds between the claims while there's nothing to do
+    """
+    stopping = threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *args: stopping.set())
+
+    init_worker(chromedriver_path, recycle, options or {})
+    queue = open_queue(queue_url)
+    name = f'{socket.gethostname()}:{os.getpid()}'
+    done = 0
+    try:
+        while not stopping.is_set():
+            job = queue.claim(name, lease)
+            if job is None:
+                stats = queue.stats()
+                if exit_when_empty and not stats[PENDING] and not stats[RUNNING]:
+                    break
+                stopping.wait(poll_interval)
+                continue
+
+            start = time.time()
+            status = run_job(queue, job, lease)
+            done += 1
+            logger.info(f'[{name}] Job {job.id} ({job.url}, attempt {job.attempts}/{job.max_attempts}): '
+                        f'{status or "lease lost"} in {time.time() - start:.1f} seconds')
+    finally:
+        queue.close()
+    logger.info(f'[{name}] Ran {done} jobs')
+
+
+def worker_options(args) -> dict:
+    return {'verbose': args.verbose, 'optimize': args.optimize, 'concurrent': not args.sequential,
+            'wait_strategy': POLL, 'formats': None, 'capture_method': FULL, 'trace_path': args.trace,
+            'profile': (), 'max_age': args.max_age, 'block_requests': not args.no_block, 'tabs': args.tabs,
+            'deadline': args.deadline, 'hedge_after': args.hedge,
+            'stage_timeouts': dict.fromkeys(STAGES, args.stage_timeout) if args.stage_timeout else None}
+
+
+def main():
+    parser = log21.ColorizingArgumentParser()
+    parser.add_argument('-Q', '--queue', help='URL of the job queue (e.g. sqlite:///jobs.sqlite3)', default=QUEUE_URL)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    enqueue = commands.add_parser('enqueue', help='Add URLs to the queue')
+    source = enqueue.add_mutually_exclusive_group(required=True)
+    source.add_argument('-u', '--url', help='URL to analyze')
+    source.add_argument('-i', '--input', help='File containing URLs to analyze (one per line, `-` for stdin)')
+    enqueue.add_argument('-p', '--priority', help='Jobs with a higher priority run first', type=int, default=0)
+    enqueue.add_argument('-S', '--stages', help=f'Stages to run ({", ".join(STAGE_NAMES)})', nargs='*',
+                         choices=STAGES + STAGE_NAMES, default=list(STAGES), metavar='STAGE')
+    enqueue.add_argument('-A', '--attempts', help='Number of times a job is tried before it is dead-lettered',
+                         type=int, default=DEFAULT_MAX_ATTEMPTS)
+
+    worker = commands.add_parser('work', help='Run jobs from the queue')
+    worker.add_argument('-w', '--workers', help='Number of worker processes', type=int, default=1)
+    worker.add_argument('-l', '--lease', help='Seconds a job stays with a worker that stopped responding',
+                        type=float, default=DEFAULT_LEASE)
+    worker.add_argument('-e', '--exit-when-empty', help='Stop when the queue is empty', action='store_true')
+    worker.add_argument('-r', '--recycle', help='Restart the browser of a worker after this many jobs', type=int,
+                        default=50)
+    worker.add_argument('-d', '--driver', help='ChromeDriver path')
+    worker.add_argument('-O', '--optimize', help='Optimize images', action='store_true')
+    worker.add_argument('-s', '--sequential', help='Run the stages one after another', action='store_true')
+    worker.add_argument('-T', '--tabs', help='Run up to this many browser stages at the same time in tabs',
+                        type=int, default=1)
+    worker.add_argument('-a', '--max-age', help='Reuse the outputs of stages that finished less than this many '
+                        'seconds ago', type=float, default=DEFAULT_MAX_AGE)
+    worker.add_argument('-D', '--deadline', help='Time budget of every job in seconds', type=float)
+    worker.add_argument('-B', '--stage-timeout', help='Time budget of every stage in seconds', type=float)
+    worker.add_argument('-H', '--hedge', help="Send the lookups that haven't answered after this many seconds "
+                        "again (0 for never)", type=float, default=HEDGE_AFTER)
+    worker.add_argument('-N', '--no-block', help="Don't block the requests the browser stages don't need",
+                        action='store_true')
+    worker.add_argument('-t', '--trace', help='Append the tracing spans to this JSON lines file')
+
+    status = commands.add_parser('status', help='Show the number of jobs of every status')
+    status.add_argument('-j', '--jobs', help='Also list the jobs of this status', choices=STATUSES)
+
+    requeue = commands.add_parser('requeue', help='Put dead-lettered jobs back in the queue')
+    requeue.add_argument('ids', help='IDs of the jobs (defaults to all the dead jobs)', nargs='*', type=int)
+
+    results = commands.add_parser('results', help='Print the results of the jobs as JSON lines')
+    results.add_argument('-j', '--jobs', help='Only the jobs of this status', choices=STATUSES, default=DONE)
+
+    parser.add_argument('-v', '--verbose', help='Verbose mode', action='store_true')
+    args = parser.parse_args()
+    if args.verbose:
+        log21.basic_config(level=log21.DEBUG)
+
+    queue = open_queue(args.queue)
+
+    if args.command == 'enqueue':
+        if not args.stages:
+            parser.error('-S/--stages needs at least one stage')
+        stages = normalize_stages(args.stages)
+        urls = [args.url] if args.url else read_urls(args.input)
+        ids = queue.enqueue(urls, stages, args.priority, args.attempts)
+        logger.info(f'Enqueued {len(ids)} jobs (priority {args.priority})')
+
+    elif args.command == 'work':
+        if args.workers < 1:
+            parser.error('Number of workers must be at least 1')
+        queue.close()
+        work_args = (args.queue, worker_options(args), args.driver, args.recycle, args.lease, args.exit_when_empty)
+        if args.workers == 1:
+            return work(*work_args)
+
+        processes = [multiprocessing.Process(target=work, args=work_args) for _ in range(args.workers)]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            # The workers got the SIGINT too; they finish their running jobs
+            for process in processes:
+                process.join()
+
+    elif args.command == 'status':
+        logger.info(', '.join(f'{count} {status}' for status, count in queue.stats().items()))
+        if args.jobs:
+            for job in queue.jobs(args.jobs):
+                logger.info(f'{job.id}: {job.url} (attempts: {job.attempts}/{job.max_attempts}, '
+                            f'priority: {job.priority}){": " + job.error if job.error else ""}')
+
+    elif args.command == 'requeue':
+        logger.info(f'Requeued {queue.requeue(args.ids or None)} jobs')
+
+    elif args.command == 'results':
+        for job in queue.jobs(args.jobs):
+            print(json.dumps(job.to_dict()))
+
+    queue.close()
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        logger.clear_line()
+        logger.error("KeyboardInterrupt: Exiting...")
+        sys.exit(0)